@@ -0,0 +1,177 @@
+"""
+Аналитика по всей истории: скользящие средние, тренд энергии (EWMA) и корреляции.
+
+История загружается одним запросом и раскладывается в колонки NumPy по дням
+(пропуски — NaN), дальше всё считается векторно. Результат кешируется
+до изменения данных (версия данных из БД). Здесь же кешируются ряды по периодам
+для графиков Mini App.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from .config import ALLOWED_USER_ID
+from .database import HISTORY_FIELDS, get_daily_history, get_data_version, get_series, to_day, from_day
+
+# Колонки истории: поля ответов + доля выполненных дневных задач
+METRICS = (*HISTORY_FIELDS, "goals")
+
+# Окна скользящих средних (дней)
+ROLLING_WINDOWS = (7, 30, 90, 365)
+
+# Период полураспада EWMA энергии (дней) и размер блока для векторного расчёта
+EWMA_HALFLIFE = 7
+EWMA_BLOCK = 64
+
+# Пары для корреляций
+CORRELATION_PAIRS = (
+    ("energy", "walk"),
+    ("energy", "alcohol"),
+    ("energy", "goals"),
+    ("walk", "goals"),
+    ("alcohol", "goals"),
+    ("alcohol", "walk"),
+)
+
+# Минимум общих дней, чтобы корреляция что-то значила
+MIN_CORRELATION_DAYS = 10
+
+# {user_id: ((версия данных, сегодня), результат)} — окна сдвигаются и со сменой дня
+_cache = {}
+
+# Ряды для графиков: {(user_id, metric, bucket, day_from, day_to, версия): ряд}
+SERIES_CACHE_SIZE = 128
+_series_cache = OrderedDict()
+
+
+def load_columns(user_id: int = ALLOWED_USER_ID):
+    """История в колонках: (first_day, {metric: float-массив по дням до сегодня}). None, если истории нет."""
+    rows = get_daily_history(user_id)
+    if not rows:
+        return None
+    data = np.array(rows, dtype=float)  # None → nan
+    days = data[:, 0].astype(np.int64)
+    first_day = int(days[0])
+    length = max(to_day(), int(days[-1])) - first_day + 1
+    columns = {}
+    for i, metric in enumerate(METRICS, 1):
+        column = np.full(length, np.nan)
+        column[days - first_day] = data[:, i]
+        columns[metric] = column
+    return first_day, columns
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Скользящее среднее по окну в днях без учёта пропусков (nan, если в окне нет данных)."""
+    present = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(present, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(present)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    window_counts = counts[ends] - counts[starts]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(window_counts > 0, (sums[ends] - sums[starts]) / window_counts, np.nan)
+
+
+def ewma(values: np.ndarray, halflife: float = EWMA_HALFLIFE, block: int = EWMA_BLOCK) -> np.ndarray:
+    """Экспоненциальное среднее с пропусками, посчитанное блоками.
+
+    Внутри блока рекурсия s_t = d·s_{t-1} + a·x_t разворачивается в d^t·cumsum(a·x_j·d^-j);
+    блок ограничен, чтобы d^-j не переполнялся. Пропуски не учитываются (нормировка на веса).
+    """
+    decay = 0.5 ** (1 / halflife)
+    alpha = 1 - decay
+    present = ~np.isnan(values)
+    x = np.where(present, values, 0.0)
+    weights = present.astype(float)
+    out = np.full(len(values), np.nan)
+    num_state = den_state = 0.0
+    for start in range(0, len(values), block):
+        stop = min(start + block, len(values))
+        k = np.arange(stop - start)
+        grow = decay ** -k
+        shrink = decay ** k
+        num = shrink * (decay * num_state + np.cumsum(alpha * x[start:stop] * grow))
+        den = shrink * (decay * den_state + np.cumsum(alpha * weights[start:stop] * grow))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[start:stop] = np.where(den > 0, num / den, np.nan)
+        num_state, den_state = num[-1], den[-1]
+    return out
+
+
+def correlation(a: np.ndarray, b: np.ndarray):
+    """Корреляция Пирсона по дням, где есть оба значения. None — мало данных или нет разброса."""
+    both = ~(np.isnan(a) | np.isnan(b))
+    if both.sum() < MIN_CORRELATION_DAYS:
+        return None
+    a, b = a[both], b[both]
+    a = a - a.mean()
+    b = b - b.mean()
+    denominator = np.sqrt((a * a).sum() * (b * b).sum())
+    if denominator == 0:
+        return None
+    return float((a * b).sum() / denominator)
+
+
+def _round(value, digits=2):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def compute_insights(user_id: int = ALLOWED_USER_ID) -> dict:
+    """Скользящие средние на сегодня, тренд энергии и корреляции по всей истории."""
+    loaded = load_columns(user_id)
+    if loaded is None:
+        return {"days": 0, "first_date": None, "rolling": {}, "energy_trend": None, "correlations": {}}
+    first_day, columns = loaded
+
+    rolling = {
+        metric: {str(window): _round(rolling_mean(values, window)[-1]) for window in ROLLING_WINDOWS}
+        for metric, values in columns.items()
+    }
+
+    trend = ewma(columns["energy"])
+    week_ago = trend[-8] if len(trend) > 7 else np.nan
+    energy_trend = {
+        "ewma": _round(trend[-1]),
+        "change_7d": _round(trend[-1] - week_ago),
+    }
+
+    correlations = {
+        f"{a}~{b}": _round(correlation(columns[a], columns[b]))
+        for a, b in CORRELATION_PAIRS
+    }
+
+    tracked = ~np.all([np.isnan(values) for values in columns.values()], axis=0)
+    return {
+        "days": int(tracked.sum()),
+        "first_date": from_day(first_day).isoformat(),
+        "rolling": rolling,
+        "energy_trend": energy_trend,
+        "correlations": correlations,
+    }
+
+
+def get_insights(user_id: int = ALLOWED_USER_ID) -> dict:
+    """Аналитика из кеша; пересчитывается, только если данные изменились."""
+    version = get_data_version()
+    key = (version, to_day())
+    cached = _cache.get(user_id)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    insights = compute_insights(user_id)
+    insights["version"] = version
+    _cache[user_id] = (key, insights)
+    return insights
+
+
+def get_series_cached(metric: str, bucket: str, day_from: int, day_to: int, user_id: int = ALLOWED_USER_ID):
+    """Ряд метрики по периодам (см. database.get_series) из кеша по версии данных."""
+    key = (user_id, metric, bucket, day_from, day_to, get_data_version())
+    if key in _series_cache:
+        _series_cache.move_to_end(key)
+        return _series_cache[key]
+    series = get_series(metric, bucket, day_from, day_to, user_id)
+    _series_cache[key] = series
+    while len(_series_cache) > SERIES_CACHE_SIZE:
+        _series_cache.popitem(last=False)
+    return series
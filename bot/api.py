@@ -3,8 +3,12 @@
 Обрабатывает запросы из Mini App для работы с данными
 """
 
+import base64
+import json
 import logging
-from flask import Flask, request, jsonify
+import math
+import sqlite3
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 
 logging.basicConfig(
@@ -15,27 +19,181 @@ logger = logging.getLogger(__name__)
 import hmac
 import hashlib
 from urllib.parse import parse_qs
-from bot.config import BOT_TOKEN
+from werkzeug.middleware.proxy_fix import ProxyFix
+from bot.config import BOT_TOKEN, ALLOWED_USER_ID, DEBUG_TOKEN, TRUSTED_PROXIES
 from bot.database import (
     get_daily_goals, toggle_daily_goal_completion, add_daily_goals,
     get_weekly_goals, toggle_goal_completion, add_weekly_goals,
     get_monthly_goals, toggle_monthly_goal_completion, add_monthly_goals,
-    get_today_log, get_last_n_days
+    GOAL_TABLES, set_goals_completed, complete_all_goals, clear_completed_goals,
+    get_today_log, get_last_n_days, get_habit_stats,
+    SERIES_BUCKETS, local_today, to_day, from_day, get_heatmap, search_goals,
+    get_changes, SYNC_PAGE_SIZE, apply_mutations,
+    claim_idempotency_key, save_idempotent_response, release_idempotency_key, probe_db
 )
+from bot import events, health, ratelimit, serialization
+from bot.heatmap import HEATMAP_METRICS, NO_DATA, year_bounds
+from bot.reports import build_week_stats, render_week_report, goal_progress, render_insights
+from bot.analytics import get_insights, get_series_cached
 from datetime import datetime, timedelta
 
 app = Flask(__name__)
-CORS(app)
+# Адрес клиента (request.remote_addr) — из X-Forwarded-For, но только от TRUSTED_PROXIES доверенных прокси:
+# записи левее них клиент может подставить сам
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+serialization.init_app(app)
+# Заголовки ответа, которые нужны Mini App и при прямом обращении с localhost
+CORS(app, expose_headers=['ETag', 'Retry-After', 'Idempotent-Replayed'])
+
+
+# Проверки здоровья приходят часто: в лог — только неудачные
+QUIET_ENDPOINTS = ('healthz', 'readyz')
 
 
 @app.before_request
 def log_request():
-    logger.info("→ %s %s", request.method, request.path)
+    if request.endpoint not in QUIET_ENDPOINTS:
+        logger.info("→ %s %s", request.method, request.path)
 
 
 @app.after_request
 def log_response(response):
-    logger.info("← %s %s → %d", request.method, request.path, response.status_code)
+    if request.endpoint not in QUIET_ENDPOINTS or response.status_code >= 400:
+        logger.info("← %s %s → %d", request.method, request.path, response.status_code)
+    return response
+
+
+@app.after_request
+def add_etag(response):
+    """Слабый ETag по телу успешных GET-ответов: повторный запрос с If-None-Match получит 304 без тела.
+    Слабый — потому что сжатое и несжатое представления получают один и тот же ETag.
+
+    Объявлен после log_response: Flask вызывает after_request в обратном порядке, и в лог попадает итоговый статус.
+    """
+    if (request.method == 'GET' and response.status_code == 200
+            and not response.direct_passthrough and not response.is_streamed):
+        response.add_etag(weak=True)
+        response.make_conditional(request)
+    return response
+
+
+def client_key() -> str:
+    """Кто делает запрос: пользователь Telegram из подписанного initData, иначе адрес клиента."""
+    init_data = request.headers.get('X-Telegram-Init-Data')
+    if init_data and verify_telegram_web_app_data(init_data):
+        try:
+            return f"user:{json.loads(parse_qs(init_data)['user'][0])['id']}"
+        except (KeyError, IndexError, TypeError, ValueError):
+            pass
+    return f"ip:{request.remote_addr}"
+
+
+def too_many_requests(retry_after: float):
+    response = jsonify({'success': False, 'error': 'Слишком много запросов, повторите позже'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+@app.before_request
+def admit_request():
+    """Token bucket на клиента и класс маршрута; записи — через очередь допуска (см. bot.ratelimit)."""
+    kind = ratelimit.route_class(request.method, request.endpoint)
+    if kind is None:
+        return None
+    client = client_key()
+    wait = ratelimit.take(client, kind)
+    if wait:
+        logger.warning("rate limit %s %s: %s", kind, request.path, client)
+        return too_many_requests(wait)
+    if kind == 'write':
+        if not ratelimit.write_gate.acquire():
+            logger.warning("write queue full: %s", request.path)
+            return too_many_requests(ratelimit.WRITE_RETRY_AFTER)
+        g.write_admitted = True
+    return None
+
+
+# Методы, запросы которых можно повторять с Idempotency-Key; длина ключа не больше
+IDEMPOTENT_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+@app.before_request
+def check_idempotency_key():
+    """Повтор запроса с тем же Idempotency-Key получает сохранённый ответ, запись не выполняется заново."""
+    key = request.headers.get('Idempotency-Key')
+    if request.method not in IDEMPOTENT_METHODS or not key:
+        return None
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return jsonify({'success': False, 'error': 'Слишком длинный Idempotency-Key'}), 400
+    # Формат ответа — часть отпечатка: сохранённое тело в msgpack не должно уйти клиенту, ждущему JSON
+    fingerprint = hashlib.sha256(
+        f"{request.method} {request.full_path} {serialization.response_mimetype()}\n".encode()
+        + request.get_data(cache=True)
+    ).hexdigest()
+    state, stored = claim_idempotency_key(key, fingerprint)
+    if state == 'new':
+        g.idempotency_key = key
+        return None
+    if state == 'replay':
+        status, mimetype, body = stored
+        logger.info("idempotent replay %s %s", request.path, key)
+        return Response(body, status=status, mimetype=mimetype, headers={'Idempotent-Replayed': 'true'})
+    if state == 'in_progress':
+        response = jsonify({'success': False, 'error': 'Запрос с этим ключом ещё выполняется'})
+        response.status_code = 409
+        response.headers['Retry-After'] = '1'
+        return response
+    return jsonify({'success': False, 'error': 'Idempotency-Key уже использован для другого запроса'}), 422
+
+
+@app.after_request
+def store_idempotent_response(response):
+    """Сохраняет ответ для повторов; ошибка сервера (5xx) ключ освобождает — повтор выполнит запрос."""
+    key = g.pop('idempotency_key', None)
+    if key is not None:
+        if response.status_code >= 500 or response.is_streamed:
+            release_idempotency_key(key)
+        else:
+            save_idempotent_response(key, response.status_code, response.mimetype, response.get_data())
+    return response
+
+
+@app.teardown_request
+def release_request(exc):
+    """Освобождает место в очереди записей и незавершённый Idempotency-Key."""
+    if g.pop('write_admitted', False):
+        ratelimit.write_gate.release()
+    # Запрос оборвался до after_request
+    key = g.pop('idempotency_key', None)
+    if key is not None:
+        release_idempotency_key(key)
+
+
+# Cache-Control по маршрутам (endpoint → политика). Данные меняются в любой момент (бот пишет в ту же БД),
+# поэтому по умолчанию GET можно хранить, но только с проверкой ETag перед использованием.
+DEFAULT_CACHE_POLICY = 'private, no-cache'
+CACHE_POLICIES = {
+    'sync_api': 'no-store',  # ответ зависит от since и сразу устаревает
+    'healthz': 'no-store',
+    'readyz': 'no-store',
+    'debug_profile': 'no-store',
+}
+# Прошлые годы тепловой карты меняются только при записи задним числом
+PAST_HEATMAP_POLICY = 'private, max-age=3600'
+
+
+@app.after_request
+def set_cache_policy(response):
+    """Cache-Control и Vary для ответа (маршрут может задать свою политику сам)."""
+    if 'Cache-Control' not in response.headers:
+        if request.method != 'GET' or response.status_code >= 400:
+            response.headers['Cache-Control'] = 'no-store'
+        else:
+            response.headers['Cache-Control'] = CACHE_POLICIES.get(request.endpoint, DEFAULT_CACHE_POLICY)
+    response.vary.add('Accept-Encoding')
     return response
 
 
@@ -205,6 +363,159 @@ def add_monthly_goals_api():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# Максимум id в одном PATCH /api/goals/<type>
+GOALS_BULK_MAX_IDS = 500
+# Действия над всеми задачами периода
+GOALS_BULK_ACTIONS = {'complete_all': complete_all_goals, 'clear_completed': clear_completed_goals}
+
+
+@app.route('/api/goals/<goal_type>', methods=['PATCH'])
+def update_goals_api(goal_type):
+    """Статус нескольких целей одним запросом.
+
+    {"ids": [1, 2], "completed": true} — отметить (или снять отметку) у перечисленных;
+    {"action": "complete_all" | "clear_completed", "period": "YYYY-MM-DD"?} — у всех задач периода
+    (по умолчанию текущего). Ответ: сколько изменилось и новые счётчики периода.
+    """
+    try:
+        if goal_type not in GOAL_TABLES:
+            return jsonify({'success': False, 'error': 'Неизвестный тип целей'}), 404
+        data = request.get_json(silent=True) or {}
+        if 'action' in data:
+            action = GOALS_BULK_ACTIONS.get(data['action'])
+            if action is None:
+                return jsonify({'success': False, 'error': 'Неизвестное действие'}), 400
+            period = data.get('period')
+            if period is not None:
+                try:
+                    datetime.strptime(str(period), '%Y-%m-%d')
+                except ValueError:
+                    return jsonify({'success': False, 'error': 'Дата периода — YYYY-MM-DD'}), 400
+            result = action(goal_type, period)
+        else:
+            ids = data.get('ids')
+            if (not isinstance(ids, list) or not ids
+                    or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids)
+                    or not isinstance(data.get('completed'), bool)):
+                return jsonify({'success': False, 'error': 'Ожидается список ids и completed'}), 400
+            if len(ids) > GOALS_BULK_MAX_IDS:
+                return jsonify({'success': False, 'error': f'Не больше {GOALS_BULK_MAX_IDS} целей за раз'}), 400
+            result = set_goals_completed(goal_type, ids, data['completed'])
+        logger.info("bulk %s goals: %s", goal_type, result)
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        logger.exception("update_goals error")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# Размер страницы поиска по умолчанию и максимум
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+
+@app.route('/api/goals/search', methods=['GET'])
+def search_goals_api():
+    """Поиск по всем целям: ?q=текст&limit=20&offset=0 (по релевантности)"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'error': 'Пустой запрос'}), 400
+        limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), SEARCH_MAX_PAGE_SIZE)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        found = search_goals(query, limit, offset)
+        return jsonify({
+            'success': True,
+            'total': found['total'],
+            'limit': limit,
+            'offset': offset,
+            'results': [
+                {
+                    'id': r['id'],
+                    'type': r['kind'],
+                    'date': r['date'],
+                    'text': r['task_text'],
+                    'snippet': r['snippet'],
+                    'completed': r['is_completed'] == 1
+                }
+                for r in found['results']
+            ]
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# Пауза между комментариями-пингами в потоке событий (сек): держит соединение через прокси
+# и позволяет заметить отключившегося клиента; и через сколько EventSource переподключается (мс)
+EVENTS_HEARTBEAT_SECONDS = 25
+EVENTS_RETRY_MS = 3000
+
+
+@app.route('/api/events', methods=['GET'])
+def events_api():
+    """Поток изменений (text/event-stream): событие changes — дельта журнала как в /api/sync плюс since"""
+    headers = {'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'}
+    # HEAD — только заголовки: тело не читается, подписка не нужна
+    if request.method == 'HEAD':
+        return Response(mimetype='text/event-stream', headers=headers)
+    subscription = events.subscribe()
+    if subscription is None:
+        return jsonify({'success': False, 'error': 'Слишком много подключений'}), 503
+
+    def stream():
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        while True:
+            event = subscription.get(EVENTS_HEARTBEAT_SECONDS)
+            if event is None:
+                yield ": ping\n\n"
+            else:
+                data = serialization.dumps_json(event).decode('utf-8')
+                yield f"id: {event['rev']}\nevent: changes\ndata: {data}\n\n"
+
+    logger.info("events: подписчиков %d", events.subscriber_count())
+    response = Response(stream(), mimetype='text/event-stream', headers=headers)
+    # Отписка при закрытии ответа — даже если клиент ушёл до первой части и генератор не запускался
+    response.call_on_close(lambda: events.unsubscribe(subscription))
+    return response
+
+
+# Максимум изменений в одной пачке /api/mutations
+MUTATIONS_MAX_BATCH = 100
+
+
+@app.route('/api/mutations', methods=['POST'])
+def mutations_api():
+    """Пачка изменений целей одной транзакцией: {"mutations": [{key, op, type, id?, text?, completed?}, ...]}
+
+    op: add | toggle | set | edit. Результаты — по порядку, с ключами; повтор ключа не применяется дважды.
+    """
+    try:
+        mutations = (request.get_json(silent=True) or {}).get('mutations')
+        if not isinstance(mutations, list) or not all(isinstance(m, dict) for m in mutations):
+            return jsonify({'success': False, 'error': 'Ожидается список mutations'}), 400
+        if len(mutations) > MUTATIONS_MAX_BATCH:
+            return jsonify({'success': False, 'error': f'Не больше {MUTATIONS_MAX_BATCH} изменений за раз'}), 400
+        results = apply_mutations(mutations)
+        logger.info("mutations: %d шт., ошибок %d", len(results), sum(not r['ok'] for r in results))
+        return jsonify({'success': True, 'results': results})
+    except Exception as e:
+        logger.exception("mutations error")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/sync', methods=['GET'])
+def sync_api():
+    """Изменения после ревизии: ?since=<rev>&limit=400 → изменённые строки и id удалённых (см. get_changes)"""
+    try:
+        since = max(request.args.get('since', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', SYNC_PAGE_SIZE, type=int), 1), SYNC_PAGE_SIZE)
+        changes = get_changes(since, limit)
+        logger.info("sync since=%d → rev=%d", since, changes['rev'])
+        return jsonify({'success': True, **changes})
+    except Exception as e:
+        logger.exception("sync error")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/stats/progress', methods=['GET'])
 def get_progress_stats():
     """Получить статистику прогресса"""
@@ -216,59 +527,142 @@ def get_progress_stats():
         energy_values = [log.get('energy') for log in logs if log.get('energy') is not None]
         avg_energy = round(sum(energy_values) / total_days, 1) if total_days > 0 else 0
         
-        walks = sum(1 for log in logs if log.get('walk'))
+        walk = get_habit_stats('walk', days=7)
+        goals_done = get_habit_stats('goals_done')
         
         # Цели
-        daily_goals = get_daily_goals(datetime.now().strftime("%Y-%m-%d"))
-        daily_completed = sum(1 for g in daily_goals if g['is_completed'])
-        daily_total = len(daily_goals)
-        
-        weekly_goals = get_weekly_goals()
-        weekly_completed = sum(1 for g in weekly_goals if g['is_completed'])
-        weekly_total = len(weekly_goals)
-        
-        monthly_goals = get_monthly_goals()
-        monthly_completed = sum(1 for g in monthly_goals if g['is_completed'])
-        monthly_total = len(monthly_goals)
+        goals = goal_progress()
         
         return jsonify({
             'success': True,
             'stats': {
                 'avg_energy': avg_energy,
-                'walks_count': walks,
-                'daily_goals': {'completed': daily_completed, 'total': daily_total},
-                'weekly_goals': {'completed': weekly_completed, 'total': weekly_total},
-                'monthly_goals': {'completed': monthly_completed, 'total': monthly_total}
+                'walks_count': walk['count'],
+                'walk_streak': walk['current_streak'],
+                'longest_walk_streak': walk['longest_streak'],
+                'goals_done_streak': goals_done['current_streak'],
+                'longest_goals_done_streak': goals_done['longest_streak'],
+                'daily_goals': goals['daily'],
+                'weekly_goals': goals['weekly'],
+                'monthly_goals': goals['monthly']
             }
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/reports/week', methods=['GET'])
+def get_week_report():
+    """Недельный отчёт — те же данные и текст, что в /week у бота"""
+    try:
+        stats = build_week_stats()
+        return jsonify({
+            'success': True,
+            'stats': stats,
+            'text': render_week_report(stats)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# Период по умолчанию для /api/stats/series (дней назад от сегодня)
+SERIES_DEFAULT_DAYS = {'day': 29, 'week': 7 * 12 - 1, 'month': 364}
+
+
+@app.route('/api/stats/series', methods=['GET'])
+def get_series_api():
+    """Ряд метрики по дням/неделям/месяцам: ?metric=energy&bucket=week&from=YYYY-MM-DD&to=YYYY-MM-DD"""
+    try:
+        metric = request.args.get('metric', 'energy')
+        bucket = request.args.get('bucket', 'day')
+        if bucket not in SERIES_BUCKETS:
+            return jsonify({'success': False, 'error': f'bucket: {", ".join(SERIES_BUCKETS)}'}), 400
+        try:
+            day_to = to_day(request.args['to']) if request.args.get('to') else local_today()
+            if request.args.get('from'):
+                day_from = to_day(request.args['from'])
+            else:
+                day_from = day_to - SERIES_DEFAULT_DAYS[bucket]
+                if bucket == 'week':
+                    day_from -= (day_from + 3) % 7  # с понедельника, чтобы первая неделя была полной
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Даты в формате YYYY-MM-DD'}), 400
+        
+        series = get_series_cached(metric, bucket, day_from, day_to)
+        if series is None:
+            return jsonify({'success': False, 'error': f'Неизвестная метрика: {metric}'}), 404
+        return jsonify({
+            'success': True,
+            'metric': metric,
+            'bucket': bucket,
+            'series': series
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/heatmap', methods=['GET'])
+def get_heatmap_api():
+    """Тепловая карта года: по байту на день для каждой метрики (base64, или ?format=binary — подряд)"""
+    try:
+        year = request.args.get('year', type=int) or from_day(local_today()).year
+        maps = get_heatmap(year)
+        start, days = year_bounds(year)
+        if request.args.get('format') == 'binary':
+            response = Response(
+                b''.join(maps[m] for m in HEATMAP_METRICS),
+                mimetype='application/octet-stream',
+                headers={'X-Heatmap-Metrics': ','.join(HEATMAP_METRICS), 'X-Heatmap-Days': str(days)}
+            )
+        else:
+            response = jsonify({
+                'success': True,
+                'year': year,
+                'start': from_day(start).isoformat(),
+                'days': days,
+                'no_data': NO_DATA,
+                'metrics': {m: base64.b64encode(maps[m]).decode('ascii') for m in HEATMAP_METRICS}
+            })
+        if year < from_day(local_today()).year:
+            response.headers['Cache-Control'] = PAST_HEATMAP_POLICY
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/insights', methods=['GET'])
+def get_insights_api():
+    """Аналитика за всю историю (скользящие средние, тренд энергии, корреляции) — как /insights у бота"""
+    try:
+        insights = get_insights()
+        return jsonify({
+            'success': True,
+            'insights': insights,
+            'text': render_insights(insights)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/stats/alcohol', methods=['GET'])
 def get_alcohol_stats():
-    """Получить статистику по алкоголю"""
+    """Получить статистику по алкоголю (по битовым картам привычек, без обхода логов)"""
     try:
-        logs = get_last_n_days(30)
-        
-        # Находим последний день с алкоголем
-        last_alcohol_day = None
-        for log in reversed(logs):
-            if log.get('alcohol'):
-                last_alcohol_day = datetime.strptime(log['date'], "%Y-%m-%d")
-                break
+        alcohol = get_habit_stats('alcohol')
+        sober = get_habit_stats('sober')
         
-        # Считаем дни без алкоголя
-        if last_alcohol_day:
+        # Считаем дни без алкоголя с последнего эпизода
+        if alcohol['last_day']:
+            last_alcohol_day = datetime.strptime(alcohol['last_day'], "%Y-%m-%d")
             days_sober = (datetime.now() - last_alcohol_day).days
         else:
-            days_sober = len(logs) if logs else 0
+            days_sober = sober['total']
         
         # Считаем экономию (3000 за эпизод)
         money_saved = days_sober * (3000 / 3.5)  # примерно 2-3 раза в неделю
         
         # Статистика за месяц
-        alcohol_episodes = sum(1 for log in logs if log.get('alcohol'))
+        alcohol_episodes = alcohol['count']
         money_spent = alcohol_episodes * 3000
         
         return jsonify({
@@ -277,12 +671,95 @@ def get_alcohol_stats():
                 'days_sober': days_sober,
                 'money_saved': int(money_saved),
                 'episodes_this_month': alcohol_episodes,
-                'money_spent_this_month': money_spent
+                'money_spent_this_month': money_spent,
+                'sober_streak': sober['current_streak'],
+                'longest_sober_streak': sober['longest_streak']
             }
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# Сколько ждать БД в /readyz (сек) и какая задержка цикла событий бота ещё нормальна (сек)
+READY_DB_TIMEOUT = 1.0
+READY_MAX_LOOP_LAG = 2.0
+# Длительность профилирования по умолчанию (сек)
+PROFILE_DEFAULT_SECONDS = 5
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Процесс жив и поток API отвечает"""
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Готовность: БД отвечает и отдаёт блокировку записи за READY_DB_TIMEOUT, цикл событий бота не завис.
+
+    503, если какая-то проверка не прошла. Без бота в процессе (python -m bot.api) цикл не проверяется.
+    """
+    checks = {}
+    try:
+        checks['db'] = {'ok': True, 'ms': round(probe_db(READY_DB_TIMEOUT), 1)}
+    except sqlite3.Error as e:
+        checks['db'] = {'ok': False, 'error': str(e)}
+    lag = health.loop_lag()
+    if lag is not None:
+        checks['bot_loop'] = {'ok': lag < READY_MAX_LOOP_LAG, 'lag_ms': round(lag * 1000, 1)}
+    ready = all(check['ok'] for check in checks.values())
+    if not ready:
+        logger.warning("not ready: %s", checks)
+    return jsonify({'status': 'ok' if ready else 'unavailable', 'checks': checks}), 200 if ready else 503
+
+
+# Сколько действует initData владельца для /debug/* (сек): перехваченная подпись не должна быть вечным пропуском
+ADMIN_INIT_DATA_MAX_AGE = 24 * 3600
+
+
+def is_admin() -> bool:
+    """Запрос с X-Debug-Token или от владельца бота по подписанному initData не старше ADMIN_INIT_DATA_MAX_AGE."""
+    token = request.headers.get('X-Debug-Token', '')
+    if DEBUG_TOKEN and token and hmac.compare_digest(token, DEBUG_TOKEN):
+        return True
+    init_data = request.headers.get('X-Telegram-Init-Data')
+    if not init_data or not verify_telegram_web_app_data(init_data):
+        return False
+    try:
+        parsed = parse_qs(init_data)
+        auth_date = int(parsed['auth_date'][0])
+        user_id = json.loads(parsed['user'][0])['id']
+    except (KeyError, IndexError, TypeError, ValueError):
+        return False
+    age = datetime.now().timestamp() - auth_date
+    return user_id == ALLOWED_USER_ID and 0 <= age <= ADMIN_INIT_DATA_MAX_AGE
+
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """Сэмплирующий профиль всех потоков процесса (API и бот): ?seconds=5
+
+    Ответ — collapsed stacks (text/plain) для flamegraph.pl и speedscope;
+    ?format=json — те же стеки и статистика маршрутов бота.
+    """
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Нет доступа'}), 403
+    seconds = request.args.get('seconds', PROFILE_DEFAULT_SECONDS, type=float)
+    seconds = min(max(seconds, health.PROFILE_INTERVAL), health.PROFILE_MAX_SECONDS)
+    stacks = health.sample_stacks(seconds)
+    if stacks is None:
+        return jsonify({'success': False, 'error': 'Профилирование уже идёт'}), 409
+    logger.info("profile %.1f s: %d снимков", seconds, sum(stacks.values()))
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'success': True,
+            'seconds': seconds,
+            'samples': sum(stacks.values()),
+            'stacks': dict(stacks.most_common()),
+            **health.extra_stats()
+        })
+    return Response(health.collapse(stacks), mimetype='text/plain')
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,114 @@
+"""
+Замер сериализации ответов API: время кодирования и размер на проводе.
+
+Для каждого GET-маршрута ответ кодируется стандартным json, orjson и MessagePack,
+затем сжимается gzip и brotli (что из этого установлено). Данные — временная БД
+с тестовой историей за --days дней, рабочая БД не трогается.
+
+Запуск: python3 -m bot.bench_serialization [--days 365] [--goals 2000]
+"""
+import argparse
+import gzip
+import json
+import logging
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from . import database, serialization
+
+# Маршруты, которые сравниваем (как их вызывает Mini App)
+ROUTES = (
+    "/api/goals/daily",
+    "/api/stats/progress",
+    "/api/stats/alcohol",
+    "/api/reports/week",
+    "/api/stats/series?metric=energy&bucket=day&from={year_ago}",
+    "/api/stats/series?metric=goals&bucket=week",
+    "/api/heatmap",
+    "/api/insights",
+    "/api/goals/search?q=задача&limit=100",
+    "/api/sync?since=0",
+)
+
+
+def _seed(days: int, goals: int):
+    """Тестовая история: ответы за days дней и goals дневных задач, распределённых по тем же дням."""
+    database.init_db()
+    database.add_test_data(days)
+    today = date.today()
+    per_day = max(1, goals // days)
+    for i in range(min(days, goals)):
+        database.add_daily_goals(
+            [f"Задача {i}-{n}: тренировка, чтение, проект" for n in range(per_day)],
+            (today - timedelta(days=i)).isoformat()
+        )
+
+
+def _best_time(fn, repeat: int) -> float:
+    """Лучшее время вызова (мс) из repeat попыток."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def _encoders() -> dict:
+    encoders = {
+        "json": lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+    }
+    if serialization.orjson is not None:
+        encoders["orjson"] = lambda obj: serialization.orjson.dumps(obj, option=serialization.orjson.OPT_NON_STR_KEYS)
+    if serialization.msgpack is not None:
+        encoders["msgpack"] = serialization.dumps_msgpack
+    return encoders
+
+
+def _compressors() -> dict:
+    compressors = {"—": lambda body: body, "gzip": lambda body: gzip.compress(body, serialization.GZIP_LEVEL)}
+    if serialization.brotli is not None:
+        compressors["br"] = lambda body: serialization.brotli.compress(body, quality=serialization.BROTLI_QUALITY)
+    return compressors
+
+
+def run(days: int, goals: int, repeat: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = Path(tmp) / "bench.db"
+        _seed(days, goals)
+        from .api import app  # после подмены DB_PATH
+        logging.getLogger("bot.api").setLevel(logging.WARNING)
+
+        client = app.test_client()
+        encoders = _encoders()
+        compressors = _compressors()
+        header = f"{'маршрут':<60} {'формат':<8} {'кодир., мс':>10}" + "".join(f" {name:>8}" for name in compressors)
+        print(f"История: {days} дн., задач: {goals}. Размер — байт на проводе по сжатию.\n")
+        print(header)
+        print("-" * len(header))
+        year_ago = (date.today() - timedelta(days=364)).isoformat()
+        for route in ROUTES:
+            route = route.format(year_ago=year_ago)
+            response = client.get(route, headers={"Accept-Encoding": "identity"})
+            obj = json.loads(response.get_data())
+            for name, encode in encoders.items():
+                body = encode(obj)
+                encode_ms = _best_time(lambda: encode(obj), repeat)
+                sizes = "".join(f" {len(compress(body)):>8}" for compress in compressors.values())
+                print(f"{route[:60]:<60} {name:<8} {encode_ms:>10.3f}{sizes}")
+        print(f"\nСжатие включается от {serialization.COMPRESS_MIN_BYTES} байт.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=365, help="дней тестовой истории")
+    parser.add_argument("--goals", type=int, default=2000, help="дневных задач в истории")
+    parser.add_argument("--repeat", type=int, default=50, help="повторов замера кодирования")
+    args = parser.parse_args()
+    run(args.days, args.goals, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
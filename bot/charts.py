@@ -0,0 +1,144 @@
+"""
+Графики к недельному и месячному отчётам (PNG).
+
+Рисование (matplotlib) выполняется в отдельном процессе, чтобы не блокировать
+цикл событий бота. Готовые PNG кешируются по (пользователь, период, версия данных),
+а file_id, который Telegram вернул после загрузки, переиспользуется для одинаковых
+картинок — повторный показ не стоит ни CPU, ни загрузки.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .config import ALLOWED_USER_ID, CHART_WORKERS
+from .database import get_data_version, get_first_day_of_month, local_today, to_day, from_day
+from .analytics import get_series_cached
+
+logger = logging.getLogger(__name__)
+
+# Сколько PNG и file_id помнить
+CHART_CACHE_SIZE = 32
+FILE_ID_CACHE_SIZE = 256
+
+# Подписи периодов
+PERIOD_TITLES = {"week": "Неделя", "month": "Месяц"}
+
+_executor = None
+# {(user_id, period, day_from, day_to, версия): png}
+_png_cache = OrderedDict()
+# {sha256 png: file_id}
+_file_ids = OrderedDict()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: бот многопоточный (API в соседнем потоке), fork копировал бы чужие блокировки
+        _executor = ProcessPoolExecutor(CHART_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown():
+    """Останавливает процессы рисования (при остановке бота)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def render_png(title: str, days: list, energy: list, goals_done: list, goals_total: list) -> bytes:
+    """Рисует тренд энергии и столбцы выполнения дневных задач. Выполняется в процессе пула."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    x = range(len(days))
+    labels = [d[8:10] + "." + d[5:7] for d in days]
+    fig, (top, bottom) = plt.subplots(2, 1, figsize=(7, 5), sharex=True, dpi=100)
+    fig.suptitle(title)
+
+    points = [(i, v) for i, v in zip(x, energy) if v is not None]
+    if points:
+        top.plot([i for i, _ in points], [v for _, v in points], marker="o", color="#2481cc")
+    top.set_ylim(0, 10.5)
+    top.set_ylabel("Энергия")
+    top.grid(alpha=0.3)
+
+    bottom.bar(x, goals_total, color="#d0d7de", label="Всего")
+    bottom.bar(x, goals_done, color="#2ea043", label="Выполнено")
+    bottom.set_ylabel("Задачи дня")
+    bottom.legend(loc="upper left", fontsize=8)
+    bottom.yaxis.get_major_locator().set_params(integer=True)
+    step = -(-len(days) // 8)  # не больше 8 подписей дат
+    bottom.set_xticks(list(x)[::step], labels[::step])
+
+    fig.tight_layout()
+    out = io.BytesIO()
+    fig.savefig(out, format="png")
+    plt.close(fig)
+    return out.getvalue()
+
+
+def _period_range(period: str):
+    """(day_from, day_to) периода, заканчивающегося сегодня."""
+    today = local_today()
+    if period == "month":
+        return to_day(get_first_day_of_month(from_day(today))), today
+    return today - 6, today
+
+
+def _chart_data(day_from: int, day_to: int, user_id: int):
+    """Данные графика по дням периода (пропуски — None/0)."""
+    days = [from_day(d).isoformat() for d in range(day_from, day_to + 1)]
+    energy = {p["start"]: p["avg"] for p in get_series_cached("energy", "day", day_from, day_to, user_id) or []}
+    goals = {p["start"]: p for p in get_series_cached("goals", "day", day_from, day_to, user_id) or []}
+    return (
+        days,
+        [energy.get(d) for d in days],
+        [goals[d]["sum"] if d in goals else 0 for d in days],
+        [goals[d]["count"] if d in goals else 0 for d in days],
+    )
+
+
+async def chart_png(period: str, user_id: int = ALLOWED_USER_ID) -> bytes:
+    """PNG графика за период ("week" или "month"), из кеша, если данные не менялись."""
+    day_from, day_to = _period_range(period)
+    key = (user_id, period, day_from, day_to, await asyncio.to_thread(get_data_version))
+    if key in _png_cache:
+        _png_cache.move_to_end(key)
+        return _png_cache[key]
+    data = await asyncio.to_thread(_chart_data, day_from, day_to, user_id)
+    title = f"{PERIOD_TITLES[period]}: {data[0][0]} — {data[0][-1]}"
+    try:
+        png = await asyncio.get_running_loop().run_in_executor(_get_executor(), render_png, title, *data)
+    except BrokenProcessPool:
+        # Упавший процесс ломает весь пул — следующий график создаст новый
+        shutdown()
+        raise
+    _png_cache[key] = png
+    while len(_png_cache) > CHART_CACHE_SIZE:
+        _png_cache.popitem(last=False)
+    return png
+
+
+async def send_chart(bot, chat_id: int, period: str, user_id: int = ALLOWED_USER_ID):
+    """Отправляет график периода. Ошибка рисования не мешает текстовому отчёту."""
+    try:
+        png = await chart_png(period, user_id)
+        digest = hashlib.sha256(png).hexdigest()
+        file_id = _file_ids.get(digest)
+        if file_id is not None:
+            _file_ids.move_to_end(digest)
+            await bot.send_photo(chat_id, photo=file_id)
+            return
+        msg = await bot.send_photo(chat_id, photo=png)
+        _file_ids[digest] = msg.photo[-1].file_id
+        while len(_file_ids) > FILE_ID_CACHE_SIZE:
+            _file_ids.popitem(last=False)
+    except Exception:
+        logger.exception("chart %s for %s failed", period, chat_id)
@@ -0,0 +1,199 @@
+"""
+Чек-листы целей (дневные, недельные, месячные) с inline-кнопками.
+
+Нажатия на кнопки копятся для каждого сообщения и применяются пачкой после паузы:
+одна транзакция в БД и одно редактирование сообщения. Если текст и кнопки
+не изменились, сообщение не редактируется. Кнопки «отметить все» и «снять отметки»
+применяются сразу, одним UPDATE по задачам этого сообщения.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from functools import partial
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+
+from .concurrency import user_lock
+from .config import CHECKLIST_DEBOUNCE_SECONDS
+from .database import get_daily_goals, get_weekly_goals, get_monthly_goals, toggle_goals, set_goals_completed
+from .router import CALLBACK_SEP, encode_callback
+
+logger = logging.getLogger(__name__)
+
+# Типы чек-листов по префиксу callback_data (legacy — префикс в старом формате "dgoal_12")
+CHECKLISTS = {
+    "dg": {
+        "legacy": "dgoal",
+        "kind": "daily",
+        "title": "☀️ Задачи на сегодня",
+        "load": get_daily_goals,
+        "respect": "🔥 РЕСПЕКТ! 🔥\n\nВсе задачи на сегодня выполнены!",
+    },
+    "wg": {
+        "legacy": "goal",
+        "kind": "weekly",
+        "title": "📋 Цели на неделю",
+        "load": get_weekly_goals,
+        "respect": "🔥 РЕСПЕКТ! 🔥\n\nВсе цели выполнены!",
+    },
+    "mg": {
+        "legacy": "mgoal",
+        "kind": "monthly",
+        "title": "🗓 Цели на месяц",
+        "load": get_monthly_goals,
+        "respect": "🔥 РЕСПЕКТ! 🔥\n\nВсе месячные цели выполнены!",
+    },
+}
+
+# Ответ на нажатие: изменение применяется позже (после паузы или в очереди пользователя)
+PENDING_ANSWER = "Обновляю…"
+
+# Аргументы callback_data кнопок над всеми задачами сообщения: {аргумент: новый статус}
+BULK_ACTIONS = {"all": True, "clear": False}
+
+# Сколько последних отрисовок помнить (для пропуска одинаковых правок)
+RENDERED_CACHE_SIZE = 256
+
+# Накопленные нажатия: {(chat_id, message_id): {"prefix": str, "ids": set, "user_id": int, "task": Task}}
+_pending = {}
+# Последний отправленный вид сообщения: {(chat_id, message_id): (text, callbacks)}
+_rendered = OrderedDict()
+
+
+def render_checklist(prefix: str, goals: list):
+    """Текст и клавиатура чек-листа. Возвращает (text, keyboard, completed_count)."""
+    completed_count = sum(1 for g in goals if g["is_completed"] == 1)
+    lines = [f"{CHECKLISTS[prefix]['title']} ({completed_count}/{len(goals)})", ""]
+    buttons = []
+    for g in goals:
+        checkbox = "☑️" if g["is_completed"] == 1 else "☐"
+        task_text = g["task_text"]
+        lines.append(f"{checkbox} {task_text}")
+        buttons.append([InlineKeyboardButton(
+            f"{checkbox} {task_text[:40]}{'...' if len(task_text) > 40 else ''}",
+            callback_data=encode_callback(prefix, g["id"])
+        )])
+    bulk = []
+    if completed_count < len(goals):
+        bulk.append(InlineKeyboardButton("✅ Отметить все", callback_data=encode_callback(prefix, "all")))
+    if completed_count:
+        bulk.append(InlineKeyboardButton("↩️ Снять отметки", callback_data=encode_callback(prefix, "clear")))
+    if bulk:
+        buttons.append(bulk)
+    return "\n".join(lines) + "\n", InlineKeyboardMarkup(buttons), completed_count
+
+
+def _remember(key, text: str, keyboard: InlineKeyboardMarkup):
+    """Запоминает отрисованный вид. Возвращает False, если он совпадает с предыдущим."""
+    signature = (text, tuple(b.text + b.callback_data for row in keyboard.inline_keyboard for b in row))
+    if _rendered.get(key) == signature:
+        _rendered.move_to_end(key)
+        return False
+    _rendered[key] = signature
+    _rendered.move_to_end(key)
+    while len(_rendered) > RENDERED_CACHE_SIZE:
+        _rendered.popitem(last=False)
+    return True
+
+
+async def reply_checklist(message, prefix: str, goals: list):
+    """Отправляет чек-лист в ответ на сообщение. Возвращает число выполненных."""
+    text, keyboard, completed_count = render_checklist(prefix, goals)
+    sent = await message.reply_text(text, reply_markup=keyboard)
+    _remember((sent.chat_id, sent.message_id), text, keyboard)
+    return completed_count
+
+
+def register_routes(router):
+    """Подключает нажатия на задачи чек-листов к роутеру."""
+    for prefix, checklist in CHECKLISTS.items():
+        router.add_callback(prefix, partial(_on_toggle, prefix), [checklist["legacy"]])
+
+
+async def _on_toggle(prefix, update, context, goal_id):
+    if goal_id in BULK_ACTIONS:
+        await handle_bulk(update.callback_query, context, prefix, BULK_ACTIONS[goal_id])
+    else:
+        await handle_toggle(update.callback_query, context, prefix, int(goal_id))
+
+
+async def handle_toggle(query, context, prefix: str, goal_id: int):
+    """Нажатие на задачу: запоминаем и откладываем применение до паузы в нажатиях.
+
+    Каждое нажатие заново отсчитывает CHECKLIST_DEBOUNCE_SECONDS: серия нажатий — одно применение.
+    """
+    # Ответ до применения: об успехе пока говорить рано
+    await query.answer(PENDING_ANSWER)
+    key = (query.message.chat_id, query.message.message_id)
+    pending = _pending.get(key)
+    if pending is None:
+        pending = _pending[key] = {"prefix": prefix, "ids": set(), "user_id": query.from_user.id}
+    else:
+        # Таймер ещё спит (после сна _flush_later сразу забирает нажатия из _pending)
+        pending["task"].cancel()
+    pending["task"] = asyncio.create_task(_flush_later(context.bot, key))
+    # Два нажатия на одну задачу отменяют друг друга
+    pending["ids"] ^= {goal_id}
+
+
+def _message_goal_ids(message) -> list:
+    """id задач, кнопки которых есть в сообщении."""
+    ids = []
+    for row in message.reply_markup.inline_keyboard if message.reply_markup else ():
+        for button in row:
+            arg = (button.callback_data or "").rpartition(CALLBACK_SEP)[2]
+            if arg.isdigit():
+                ids.append(int(arg))
+    return ids
+
+
+async def handle_bulk(query, context, prefix: str, completed: bool):
+    """«Отметить все» / «снять отметки»: сразу, одним UPDATE по задачам этого сообщения."""
+    await query.answer(PENDING_ANSWER)
+    key = (query.message.chat_id, query.message.message_id)
+    # Отложенные нажатия по этому сообщению перекрываются общим статусом
+    pending = _pending.pop(key, None)
+    if pending is not None:
+        pending["task"].cancel()
+    goal_ids = _message_goal_ids(query.message)
+    if not goal_ids:
+        return
+    kind = CHECKLISTS[prefix]["kind"]
+    await _apply_and_render(context.bot, key, prefix, query.from_user.id,
+                            partial(set_goals_completed, kind, goal_ids, completed))
+
+
+async def _flush_later(bot, key):
+    """После паузы применяет накопленные нажатия и один раз обновляет сообщение."""
+    await asyncio.sleep(CHECKLIST_DEBOUNCE_SECONDS)
+    pending = _pending.pop(key)
+    if not pending["ids"]:
+        return
+    kind = CHECKLISTS[pending["prefix"]]["kind"]
+    await _apply_and_render(bot, key, pending["prefix"], pending["user_id"],
+                            partial(toggle_goals, kind, pending["ids"]))
+
+
+async def _apply_and_render(bot, key, prefix: str, user_id: int, apply):
+    """Применяет изменение в БД и обновляет сообщение чек-листа, если его вид изменился."""
+    checklist = CHECKLISTS[prefix]
+    chat_id, message_id = key
+    try:
+        async with user_lock(user_id):
+            result = apply()
+            if not result["updated"]:
+                return
+            goals = checklist["load"]()
+            text, keyboard, completed_count = render_checklist(prefix, goals)
+            if _remember(key, text, keyboard):
+                try:
+                    await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=keyboard)
+                except BadRequest as e:
+                    if "not modified" not in str(e):
+                        raise
+            # Проверяем, все ли выполнены (и отправляем респект)
+            if goals and completed_count == len(goals):
+                await bot.send_message(chat_id, checklist["respect"])
+    except Exception:
+        logger.exception("checklist flush failed: %s", key)
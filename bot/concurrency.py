@@ -0,0 +1,49 @@
+"""
+Параллельная обработка апдейтов с сохранением порядка для каждого пользователя.
+
+Апдейты разных пользователей обрабатываются параллельно, апдейты одного
+пользователя — строго по очереди (asyncio.Lock отдаёт блокировку в порядке FIFO).
+Задачи JobQueue, которые меняют состояние диалога, берут ту же блокировку через user_lock().
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Блокировки по пользователям: {user_id: [asyncio.Lock, число владельцев и ожидающих]}
+_locks = {}
+
+
+@asynccontextmanager
+async def user_lock(user_id):
+    """Последовательный доступ к состоянию пользователя. Неиспользуемые блокировки удаляются."""
+    entry = _locks.get(user_id)
+    if entry is None:
+        entry = _locks[user_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _locks[user_id]
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает до max_concurrent_updates апдейтов одновременно, по одному на пользователя."""
+
+    async def do_process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+        async with user_lock(user.id):
+            await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
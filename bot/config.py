@@ -18,9 +18,25 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 WEBAPP_URL = os.getenv("WEBAPP_URL", "")
 BOT_USERNAME = os.getenv("BOT_USERNAME", "")
 
+# Сколько апдейтов обрабатывать одновременно (апдейты одного пользователя — по очереди)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES") or "64")
+
+# Пауза после последнего нажатия в чек-листе целей, после которой сообщение обновляется (сек)
+CHECKLIST_DEBOUNCE_SECONDS = float(os.getenv("CHECKLIST_DEBOUNCE_SECONDS") or "0.7")
+
+# Сколько процессов рисуют графики к отчётам
+CHART_WORKERS = int(os.getenv("CHART_WORKERS") or "1")
+
 # ID пользователя — бот работает только для этого пользователя
 ALLOWED_USER_ID = int(os.getenv("ALLOWED_USER_ID") or "0")
 
+# Сколько прокси перед API добавляют адрес в X-Forwarded-For (Vercel → ngrok → API — 2).
+# 0 — API доступен напрямую, адрес клиента — адрес соединения
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES") or "0")
+
+# Токен для /debug/* API (заголовок X-Debug-Token); без него доступ — только по initData владельца
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+
 # Часовой пояс Красноярска
 TIMEZONE = "Asia/Krasnoyarsk"
 
@@ -37,6 +53,13 @@ FRIDAY_REMINDER_HOUR, FRIDAY_REMINDER_MINUTE = 22, 0
 # Проверка месячных целей (каждый день, внутри функции проверяется, последний ли день)
 END_OF_MONTH_CHECK_HOUR, END_OF_MONTH_CHECK_MINUTE = 22, 30
 
+# Создание целей из шаблонов при смене дня (недели, месяца)
+GOAL_ROLLOVER_HOUR, GOAL_ROLLOVER_MINUTE = 0, 5
+
+# Сборка плановых отчётов заранее: ночью и ещё раз за N минут до отправки
+REPORTS_PRECOMPUTE_HOUR, REPORTS_PRECOMPUTE_MINUTE = 3, 0
+REPORTS_REFRESH_MINUTES_BEFORE = 30
+
 # Финансовая модель алкоголя
 ALCOHOL_COST_PER_EPISODE = 3000  # стоимость одного эпизода
 WEEKLY_ALCOHOL_BUDGET = 7000     # недельный бюджет (≈30 000 / 4.33)
@@ -1,21 +1,102 @@
 """
 Работа с SQLite базой данных.
 """
+import json
 import sqlite3
+import time
 from datetime import date, datetime
 from pathlib import Path
 
-from .config import DB_PATH
+import pytz
+
+from . import habits, heatmap
+from .config import DB_PATH, ALLOWED_USER_ID, TIMEZONE
+
+
+# Даты хранятся целыми номерами дней от 1970-01-01 (компактные ключи для индексов и диапазонов)
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def to_day(value=None) -> int:
+    """Дата (date, datetime, 'YYYY-MM-DD' или уже номер дня) → номер дня. None — сегодня."""
+    if value is None:
+        value = date.today()
+    elif isinstance(value, int):
+        return value
+    elif isinstance(value, str):
+        value = date.fromisoformat(value)
+    elif isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal() - _EPOCH_ORDINAL
+
+
+def from_day(day: int) -> date:
+    """Номер дня → date."""
+    return date.fromordinal(day + _EPOCH_ORDINAL)
+
+
+def local_today() -> int:
+    """Сегодняшний номер дня в часовом поясе пользователя (TIMEZONE), а не сервера."""
+    return to_day(datetime.now(pytz.timezone(TIMEZONE)))
+
+
+# Таблицы целей по типу (для общих операций над чек-листами)
+GOAL_TABLES = {"daily": "daily_goals", "weekly": "weekly_goals", "monthly": "monthly_goals"}
+
+
+# Вызываются после каждого commit, в котором что-то записано (см. bot.events)
+COMMIT_LISTENERS = []
+
+
+class _Connection(sqlite3.Connection):
+    """Подключение, которое сообщает COMMIT_LISTENERS о записанных транзакциях (commit и with conn)."""
+
+    _notified_changes = 0
+
+    def _notify(self):
+        if self.total_changes != self._notified_changes:
+            self._notified_changes = self.total_changes
+            for listener in COMMIT_LISTENERS:
+                listener()
+
+    def commit(self):
+        super().commit()
+        self._notify()
+
+    def __exit__(self, exc_type, exc, tb):
+        result = super().__exit__(exc_type, exc, tb)
+        if exc_type is None:
+            self._notify()
+        return result
 
 
 def get_connection():
     """Создаёт подключение к БД, создаёт папку и таблицу при необходимости."""
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, factory=_Connection)
     conn.row_factory = sqlite3.Row  # Результаты как словари
     return conn
 
 
+def probe_db(timeout: float) -> float:
+    """Проверка готовности БД: чтение и захват блокировки записи, ждать не дольше timeout (сек).
+
+    Возвращает время проверки (мс); если БД занята дольше timeout — sqlite3.OperationalError.
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(DB_PATH, timeout=timeout, isolation_level=None)
+    try:
+        conn.execute("SELECT MAX(rev) FROM changes").fetchone()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("ROLLBACK")
+    finally:
+        conn.close()
+    return (time.perf_counter() - started) * 1000
+
+
+# Поля, которые читает код бота и API; в записи за день есть всегда (None, если вопроса или ответа нет)
+LOG_FIELDS = ("wake_time", "alcohol", "deep_work_minutes", "walk", "energy")
+
 # Дефолтные вопросы (для первой инициализации)
 DEFAULT_QUESTIONS = [
     ("morning", 0, "wake_time", "Во сколько проснулся? (например: 7:30)", None),
@@ -24,6 +105,14 @@ DEFAULT_QUESTIONS = [
     ("evening", 1, "energy", "Энергия 1–10", "1,2,3,4,5,6,7,8,9,10"),
 ]
 
+# Опрос для полей LOG_FIELDS, о которых бот не спрашивает (история из daily_logs и отчёты):
+# вопрос есть, чтобы хранить ответы в answers, но в утренний и вечерний опрос не попадает
+ARCHIVE_SURVEY = "archive"
+_ARCHIVE_QUESTIONS = {
+    **{fn: (txt, opt) for _, _, fn, txt, opt in DEFAULT_QUESTIONS},
+    "deep_work_minutes": ("Главная задача выполнена?", "Да,Нет"),
+}
+
 
 def init_db():
     """Создаёт таблицы daily_logs, questions и weekly_goals если их нет."""
@@ -94,53 +183,517 @@ def init_db():
                 (st, oi, fn, txt, opt),
             )
         conn.commit()
+    _migrate(conn)
+    # Владелец записей без user_id (цели, вопросы) для журнала изменений
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('owner_user_id', ?)", (ALLOWED_USER_ID,)
+        )
     conn.close()
 
 
-def get_or_create_today():
-    """Возвращает запись на сегодня. Создаёт пустую, если нет."""
-    conn = get_connection()
-    today = date.today().isoformat()
-    row = conn.execute(
-        "SELECT * FROM daily_logs WHERE date = ?", (today,)
-    ).fetchone()
-    if row is None:
+def _migration_answers(conn):
+    """v1: ответы в узкой таблице answers вместо колонок daily_logs."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS answers (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            question_id INTEGER NOT NULL,
+            int_value INTEGER,
+            text_value TEXT,
+            PRIMARY KEY (user_id, question_id, date)
+        ) WITHOUT ROWID
+    """)
+    # Первичный ключ — ряд по вопросу во времени, индекс — все ответы за день (оба покрывающие)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_answers_day
+        ON answers (user_id, date, question_id, int_value, text_value)
+    """)
+    _copy_log_answers(conn)
+
+
+def _ensure_log_questions(conn):
+    """Вопрос (в опросе ARCHIVE_SURVEY) для каждого поля LOG_FIELDS, у которого вопроса нет."""
+    for order_idx, field in enumerate(LOG_FIELDS):
+        if conn.execute("SELECT 1 FROM questions WHERE field_name = ?", (field,)).fetchone() is None:
+            text, options = _ARCHIVE_QUESTIONS[field]
+            conn.execute(
+                "INSERT INTO questions (survey_type, order_idx, field_name, text, options) VALUES (?, ?, ?, ?, ?)",
+                (ARCHIVE_SURVEY, order_idx, field, text, options)
+            )
+
+
+def _copy_log_answers(conn):
+    """Переносит ответы из колонок daily_logs в answers (уже перенесённые не трогает)."""
+    _ensure_log_questions(conn)
+    for field in LOG_FIELDS:
+        value_column = "text_value" if field == "wake_time" else "int_value"
         conn.execute(
-            "INSERT INTO daily_logs (date, created_at) VALUES (?, ?)",
-            (today, datetime.now().isoformat())
+            f"""INSERT OR IGNORE INTO answers (user_id, date, question_id, {value_column})
+                SELECT ?, l.date, q.id, l.{field} FROM daily_logs l
+                JOIN questions q ON q.field_name = ?
+                WHERE l.{field} IS NOT NULL""",
+            (ALLOWED_USER_ID, field)
         )
-        conn.commit()
-        row = conn.execute(
-            "SELECT * FROM daily_logs WHERE date = ?", (today,)
-        ).fetchone()
+
+
+# Колонки с датами, которые v2 переводит в номера дней: {таблица: колонка}
+_DATE_COLUMNS = {
+    "daily_logs": "date",
+    "daily_goals": "date",
+    "weekly_goals": "week_start_date",
+    "monthly_goals": "month_start_date",
+    "answers": "date",
+}
+
+
+def _migration_integer_days(conn):
+    """v2: даты вместо ISO-строк хранятся номерами дней (INTEGER).
+
+    Колонку с TEXT-аффинностью нельзя перевести на месте (SQLite вернёт число строкой),
+    поэтому таблицы пересоздаются по исходному DDL с заменой типа колонки.
+    """
+    for table, column in _DATE_COLUMNS.items():
+        ddl = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+        new_ddl = ddl.replace(f"{column} TEXT NOT NULL", f"{column} INTEGER NOT NULL", 1)
+        new_ddl = new_ddl.replace(table, f"{table}_new", 1)
+        columns = [r["name"] for r in conn.execute(f"PRAGMA table_info({table})")]
+        select = ", ".join(
+            f"CAST(julianday({c}) - 2440587.5 AS INTEGER)" if c == column else c for c in columns
+        )
+        conn.execute(new_ddl)
+        conn.execute(f"INSERT INTO {table}_new ({', '.join(columns)}) SELECT {select} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_answers_day
+        ON answers (user_id, date, question_id, int_value, text_value)
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_daily_goals_date ON daily_goals (date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_weekly_goals_week ON weekly_goals (week_start_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_monthly_goals_month ON monthly_goals (month_start_date)")
+
+
+def _migration_habit_bits(conn):
+    """v3: битовые карты привычек по годам (см. bot.habits), заполняются из истории."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS habit_bits (
+            user_id INTEGER NOT NULL,
+            habit TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            bits BLOB NOT NULL,
+            PRIMARY KEY (user_id, habit, year)
+        ) WITHOUT ROWID
+    """)
+    habits.rebuild(conn, ALLOWED_USER_ID)
+
+
+# Таблицы с данными пользователя: любое изменение в них увеличивает версию данных
+_VERSIONED_TABLES = ("answers", "daily_goals", "weekly_goals", "monthly_goals")
+
+
+def _migration_data_version(conn):
+    """v4: счётчик версии данных, который триггеры увеличивают при каждой записи.
+
+    Бот и API — разные процессы, поэтому версия хранится в БД: кеши вычислений
+    (аналитика, графики) сверяются с ней и пересчитываются только после изменений.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 0)")
+    for table in _VERSIONED_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table}
+                BEGIN
+                    UPDATE meta SET value = value + 1 WHERE key = 'data_version';
+                END
+            """)
+
+
+def _migration_heatmaps(conn):
+    """v5: готовые годовые тепловые карты (см. bot.heatmap), строятся при первом запросе."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS heatmaps (
+            user_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (user_id, year)
+        ) WITHOUT ROWID
+    """)
+
+
+def _migration_reports(conn):
+    """v6: заранее собранные отчёты (недельная сводка, итоги месяца) с версией данных, из которой они собраны."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reports (
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            period_start INTEGER NOT NULL,
+            data_version INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            built_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, kind, period_start)
+        ) WITHOUT ROWID
+    """)
+
+
+# Поиск по целям: {тип: (таблица, колонка периода, код в rowid goals_fts)}
+_SEARCH_SOURCES = {
+    "daily": ("daily_goals", "date", 0),
+    "weekly": ("weekly_goals", "week_start_date", 1),
+    "monthly": ("monthly_goals", "month_start_date", 2),
+}
+
+
+def _migration_goals_fts(conn):
+    """v7: полнотекстовый индекс FTS5 по всем целям, синхронизируется триггерами.
+
+    Одна таблица на три источника: rowid = id * 3 + код типа, статус берётся из исходной таблицы.
+    """
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS goals_fts USING fts5(
+            task_text, kind UNINDEXED, goal_id UNINDEXED, period UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    for kind, (table, period, code) in _SEARCH_SOURCES.items():
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO goals_fts (rowid, task_text, kind, goal_id, period)
+                VALUES (new.id * 3 + {code}, new.task_text, '{kind}', new.id, new.{period});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF task_text, {period} ON {table}
+            BEGIN
+                UPDATE goals_fts SET task_text = new.task_text, period = new.{period}
+                WHERE rowid = new.id * 3 + {code};
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table}
+            BEGIN
+                DELETE FROM goals_fts WHERE rowid = old.id * 3 + {code};
+            END
+        """)
+        conn.execute(
+            f"""INSERT INTO goals_fts (rowid, task_text, kind, goal_id, period)
+                SELECT id * 3 + {code}, task_text, '{kind}', id, {period} FROM {table}"""
+        )
+
+
+def _migration_goal_templates(conn):
+    """v8: шаблоны повторяющихся целей и ссылка на шаблон у созданных из него целей.
+
+    Уникальный индекс (период, template_id) делает материализацию идемпотентной.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS goal_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            weekdays INTEGER NOT NULL DEFAULT 127,
+            task_text TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_goal_templates_kind ON goal_templates (kind)")
+    for kind, (table, period, _) in _SEARCH_SOURCES.items():
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN template_id INTEGER")
+        conn.execute(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_template
+            ON {table} ({period}, template_id) WHERE template_id IS NOT NULL
+        """)
+
+
+# Журнал изменений для синхронизации Mini App:
+# {таблица: (id записи в журнале, владелец записи)} — SQL-выражения от строки {row} (new/old)
+_OWNER_SQL = "(SELECT value FROM meta WHERE key = 'owner_user_id')"
+CHANGE_SOURCES = {
+    "answers": ("{row}.date || ':' || {row}.question_id", "{row}.user_id"),
+    "daily_goals": ("{row}.id", _OWNER_SQL),
+    "weekly_goals": ("{row}.id", _OWNER_SQL),
+    "monthly_goals": ("{row}.id", _OWNER_SQL),
+    "questions": ("{row}.id", _OWNER_SQL),
+    "goal_templates": ("{row}.id", "{row}.user_id"),
+}
+
+
+def _migration_change_log(conn):
+    """v9: журнал изменений с ревизией вместо счётчика data_version.
+
+    Триггеры на каждую запись добавляют строку (сущность, id, upsert/delete) с новой ревизией
+    и удаляют прежнюю строку той же сущности — журнал не растёт больше числа записей
+    и удалённых записей. Таблицы целей и вопросов без user_id относятся к владельцу бота
+    (meta.owner_user_id). Версия данных = последняя ревизия.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS changes (
+            rev INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            entity TEXT NOT NULL,
+            entity_id TEXT NOT NULL,
+            op TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_changes_entity ON changes (entity, entity_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_changes_user ON changes (user_id, rev)")
+    conn.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES ('owner_user_id', ?)", (ALLOWED_USER_ID,)
+    )
+    for table in _VERSIONED_TABLES:
+        for event in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {table}_{event}_version")
+    conn.execute("DELETE FROM meta WHERE key = 'data_version'")
+    # Отчёты помнят прежнюю версию данных — пусть соберутся заново
+    conn.execute("DELETE FROM reports")
+    for table, (id_sql, owner_sql) in CHANGE_SOURCES.items():
+        for event, row, op in (("INSERT", "new", "upsert"), ("UPDATE", "new", "upsert"), ("DELETE", "old", "delete")):
+            entity_id = id_sql.format(row=row)
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_change AFTER {event} ON {table}
+                BEGIN
+                    DELETE FROM changes WHERE entity = '{table}' AND entity_id = CAST({entity_id} AS TEXT);
+                    INSERT INTO changes (user_id, entity, entity_id, op)
+                    VALUES ({owner_sql.format(row=row)}, '{table}', CAST({entity_id} AS TEXT), '{op}');
+                END
+            """)
+        # Уже существующие записи — в журнал, чтобы синхронизация с нуля получила всё
+        conn.execute(
+            f"""INSERT OR IGNORE INTO changes (user_id, entity, entity_id, op)
+                SELECT {owner_sql.format(row=table)}, '{table}', CAST({id_sql.format(row=table)} AS TEXT), 'upsert'
+                FROM {table}"""
+        )
+
+
+def _migration_applied_mutations(conn):
+    """v10: результаты применённых изменений Mini App по ключам идемпотентности (хранятся ограниченное время)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS applied_mutations (
+            key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_applied_mutations_time ON applied_mutations (applied_at)")
+
+
+def _migration_idempotency_keys(conn):
+    """v11: ответы на запросы с Idempotency-Key (для повторов; status NULL — запрос ещё выполняется)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            status INTEGER,
+            mimetype TEXT,
+            body BLOB,
+            created_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_time ON idempotency_keys (created_at)")
+
+
+def _migration_log_questions(conn):
+    """v12: ответы из колонок daily_logs без вопроса (deep_work_minutes), которые v1 пропустила."""
+    _copy_log_answers(conn)
+
+
+# Миграции схемы по порядку; номер применённой хранится в PRAGMA user_version
+MIGRATIONS = [
+    _migration_answers,
+    _migration_integer_days,
+    _migration_habit_bits,
+    _migration_data_version,
+    _migration_heatmaps,
+    _migration_reports,
+    _migration_goals_fts,
+    _migration_goal_templates,
+    _migration_change_log,
+    _migration_applied_mutations,
+    _migration_idempotency_keys,
+    _migration_log_questions,
+]
+
+
+def _migrate(conn):
+    """Применяет миграции, которых ещё нет в БД."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, migration in enumerate(MIGRATIONS, 1):
+        if version < target:
+            with conn:
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {target}")
+
+
+def get_data_version() -> int:
+    """Текущая версия данных — последняя ревизия журнала изменений (растёт при любой записи)."""
+    conn = get_connection()
+    row = conn.execute("SELECT MAX(rev) FROM changes").fetchone()
     conn.close()
-    return dict(zip(row.keys(), row))
+    return row[0] or 0
 
 
-def update_field(field: str, value):
-    """Обновляет одно поле в записи на сегодня."""
+def encode_answer(options, value):
+    """Ответ → (int_value, text_value).
+
+    Без вариантов — текст. Числовые варианты — число. Два варианта: первый = 1,
+    второй = 0 (Да/Нет), текст варианта тоже сохраняется. Иначе — номер варианта и текст.
+    """
+    if not options:
+        return None, str(value)
+    if all(o.strip().lstrip("-").isdigit() for o in options):
+        return int(value), None
+    if len(options) == 2:
+        return (1 if value == options[0] else 0), value
+    return options.index(value), value
+
+
+def save_answer(question_id: int, value, target_date=None, user_id: int = ALLOWED_USER_ID):
+    """Сохраняет ответ на вопрос за день (по умолчанию — сегодня). Повторный ответ заменяет прежний."""
     conn = get_connection()
-    today = date.today().isoformat()
+    row = conn.execute("SELECT options FROM questions WHERE id = ?", (question_id,)).fetchone()
+    options = row["options"].split(",") if row and row["options"] else None
+    int_value, text_value = encode_answer(options, value)
+    day = to_day(target_date)
     conn.execute(
-        f"UPDATE daily_logs SET {field} = ? WHERE date = ?",
-        (value, today)
+        """INSERT OR REPLACE INTO answers (user_id, date, question_id, int_value, text_value)
+           VALUES (?, ?, ?, ?, ?)""",
+        (user_id, day, question_id, int_value, text_value)
     )
+    _day_changed(conn, user_id, day)
     conn.commit()
     conn.close()
 
 
+def _get_logs(conn, day_from: int, day_to: int, user_id: int = ALLOWED_USER_ID) -> dict:
+    """Ответы за период (номера дней), собранные в записи по дням: {day: {"date": "YYYY-MM-DD", field_name: value}}."""
+    rows = conn.execute(
+        """SELECT a.date, q.field_name, a.int_value, a.text_value
+           FROM answers a JOIN questions q ON q.id = a.question_id
+           WHERE a.user_id = ? AND a.date >= ? AND a.date <= ?""",
+        (user_id, day_from, day_to)
+    ).fetchall()
+    logs = {}
+    for r in rows:
+        log = logs.get(r["date"])
+        if log is None:
+            log = logs[r["date"]] = {"date": from_day(r["date"]).isoformat(), **dict.fromkeys(LOG_FIELDS)}
+        log[r["field_name"]] = r["int_value"] if r["int_value"] is not None else r["text_value"]
+    return logs
+
+
+# Числовые поля истории для аналитики (плюс доля выполненных дневных задач — goals)
+HISTORY_FIELDS = ("energy", "walk", "alcohol")
+
+
+def get_daily_history(user_id: int = ALLOWED_USER_ID) -> list:
+    """Вся история одним запросом: строки (day, energy, walk, alcohol, goals) по возрастанию дня.
+    goals — доля выполненных дневных задач (None, если задач не было)."""
+    pivot = ",\n".join(
+        f"MAX(CASE WHEN q.field_name = '{field}' THEN a.int_value END) AS {field}" for field in HISTORY_FIELDS
+    )
+    conn = get_connection()
+    rows = conn.execute(
+        f"""WITH logs AS (
+                SELECT a.date AS date, {pivot}
+                FROM answers a JOIN questions q ON q.id = a.question_id
+                WHERE a.user_id = ?
+                GROUP BY a.date
+            ), goals AS (
+                SELECT date, AVG(is_completed) AS goals FROM daily_goals GROUP BY date
+            )
+            SELECT l.date, l.energy, l.walk, l.alcohol, g.goals
+            FROM logs l LEFT JOIN goals g ON g.date = l.date
+            UNION ALL
+            SELECT g.date, NULL, NULL, NULL, g.goals
+            FROM goals g WHERE g.date NOT IN (SELECT date FROM logs)
+            ORDER BY 1""",
+        (user_id,)
+    ).fetchall()
+    conn.close()
+    return [tuple(r) for r in rows]
+
+
+# Начало периода для номера дня в SQL: неделя с понедельника (1970-01-01 — четверг,
+# как в get_monday_of_week), месяц — с первого числа
+SERIES_BUCKETS = {
+    "day": "{column}",
+    "week": "{column} - ({column} + 3) % 7",
+    "month": "CAST(strftime('%s', {column} * 86400, 'unixepoch', 'start of month') AS INTEGER) / 86400",
+}
+
+
+def get_series(metric: str, bucket: str, day_from: int, day_to: int, user_id: int = ALLOWED_USER_ID):
+    """Ряд метрики по периодам одним GROUP BY: [{"start": "YYYY-MM-DD", "avg", "sum", "count"}].
+
+    metric — field_name вопроса или "goals" (выполненные дневные задачи: sum — выполнено,
+    count — всего, avg — доля). None, если такой метрики нет.
+    """
+    conn = get_connection()
+    if metric == "goals":
+        period = SERIES_BUCKETS[bucket].format(column="date")
+        rows = conn.execute(
+            f"""SELECT {period} AS period, AVG(is_completed), SUM(is_completed), COUNT(*)
+                FROM daily_goals WHERE date BETWEEN ? AND ?
+                GROUP BY period ORDER BY period""",
+            (day_from, day_to)
+        ).fetchall()
+    elif conn.execute("SELECT 1 FROM questions WHERE field_name = ?", (metric,)).fetchone():
+        period = SERIES_BUCKETS[bucket].format(column="a.date")
+        rows = conn.execute(
+            f"""SELECT {period} AS period, AVG(a.int_value), SUM(a.int_value), COUNT(a.int_value)
+                FROM answers a JOIN questions q ON q.id = a.question_id
+                WHERE a.user_id = ? AND q.field_name = ? AND a.date BETWEEN ? AND ?
+                GROUP BY period ORDER BY period""",
+            (user_id, metric, day_from, day_to)
+        ).fetchall()
+    else:
+        rows = None
+    conn.close()
+    if rows is None:
+        return None
+    return [
+        {
+            "start": from_day(r[0]).isoformat(),
+            "avg": round(r[1], 2) if r[1] is not None else None,
+            "sum": r[2],
+            "count": r[3],
+        }
+        for r in rows
+    ]
+
+
+def get_or_create_today():
+    """Возвращает запись на сегодня (пустую, если ответов ещё нет)."""
+    today = to_day()
+    conn = get_connection()
+    logs = _get_logs(conn, today, today)
+    conn.close()
+    return logs.get(today) or {"date": from_day(today).isoformat(), **dict.fromkeys(LOG_FIELDS)}
+
+
+# Кеш списков вопросов по типу опроса; сбрасывается при редактировании вопросов
+_questions_cache = {}
+
+
 def get_questions(survey_type: str) -> list:
-    """Возвращает список вопросов для опроса. Каждый элемент — dict с field_name, text, options."""
+    """Возвращает список вопросов для опроса. Каждый элемент — dict с id, field_name, text, options.
+    Список кешируется до следующего изменения вопросов."""
+    cached = _questions_cache.get(survey_type)
+    if cached is not None:
+        return cached
     conn = get_connection()
     rows = conn.execute(
-        "SELECT field_name, text, options FROM questions WHERE survey_type = ? ORDER BY order_idx",
+        "SELECT id, field_name, text, options FROM questions WHERE survey_type = ? ORDER BY order_idx",
         (survey_type,),
     ).fetchall()
     conn.close()
     result = []
     for r in rows:
         opt = r["options"].split(",") if r["options"] else None
-        result.append({"field_name": r["field_name"], "text": r["text"], "options": opt})
+        result.append({"id": r["id"], "field_name": r["field_name"], "text": r["text"], "options": opt})
+    _questions_cache[survey_type] = result
     return result
 
 
@@ -148,8 +701,10 @@ def get_all_questions_numbered() -> list:
     """Все вопросы с глобальным номером (1-based) для /questions и /edit_q."""
     conn = get_connection()
     rows = conn.execute(
-        """SELECT id, survey_type, order_idx, field_name, text, options FROM questions 
-           ORDER BY CASE survey_type WHEN 'morning' THEN 0 ELSE 1 END, order_idx"""
+        """SELECT id, survey_type, order_idx, field_name, text, options FROM questions
+           WHERE survey_type != ?
+           ORDER BY CASE survey_type WHEN 'morning' THEN 0 ELSE 1 END, order_idx""",
+        (ARCHIVE_SURVEY,)
     ).fetchall()
     conn.close()
     return [dict(zip(r.keys(), r)) for r in rows]
@@ -161,6 +716,7 @@ def update_question_text(question_id: int, new_text: str):
     conn.execute("UPDATE questions SET text = ? WHERE id = ?", (new_text, question_id))
     conn.commit()
     conn.close()
+    _questions_cache.clear()
 
 
 def update_question_options(question_id: int, options_str: str):
@@ -169,38 +725,69 @@ def update_question_options(question_id: int, options_str: str):
     conn.execute("UPDATE questions SET options = ? WHERE id = ?", (options_str, question_id))
     conn.commit()
     conn.close()
+    _questions_cache.clear()
+
+
+def add_question(survey_type: str, text: str, options_str: str = None) -> int:
+    """Добавляет вопрос в конец опроса. Ответы хранятся в answers, поэтому схему менять не нужно."""
+    conn = get_connection()
+    order_idx = conn.execute(
+        "SELECT COALESCE(MAX(order_idx), -1) + 1 FROM questions WHERE survey_type = ?", (survey_type,)
+    ).fetchone()[0]
+    cur = conn.execute(
+        "INSERT INTO questions (survey_type, order_idx, field_name, text, options) VALUES (?, ?, '', ?, ?)",
+        (survey_type, order_idx, text, options_str or None)
+    )
+    question_id = cur.lastrowid
+    conn.execute("UPDATE questions SET field_name = ? WHERE id = ?", (f"q{question_id}", question_id))
+    conn.commit()
+    conn.close()
+    _questions_cache.clear()
+    return question_id
 
 
 def add_test_data(days: int):
     """Добавляет тестовые данные за N дней назад."""
     import random
-    from datetime import timedelta
     
     conn = get_connection()
-    today = date.today()
+    today = to_day()
+    questions = conn.execute("SELECT id, field_name, options FROM questions").fetchall()
     
     for i in range(days):
-        test_date = (today - timedelta(days=i)).isoformat()
+        test_day = today - i
         
-        # Проверяем, есть ли уже запись
-        existing = conn.execute("SELECT id FROM daily_logs WHERE date = ?", (test_date,)).fetchone()
+        # Проверяем, есть ли уже ответы за этот день
+        existing = conn.execute(
+            "SELECT 1 FROM answers WHERE user_id = ? AND date = ? LIMIT 1", (ALLOWED_USER_ID, test_day)
+        ).fetchone()
         if existing:
             continue
         
         # Генерируем случайные данные
-        wake_time = f"{random.randint(6, 9)}:{random.choice(['00', '15', '30', '45'])}"
-        alcohol = random.choice([0, 0, 0, 0, 1])  # 20% вероятность
-        deep_work = random.choice([0, 1, 1])  # 66% выполнения
-        walk = random.choice([0, 1, 1])  # 66% прогулок
-        energy = random.randint(5, 9)
-        
-        conn.execute(
-            """INSERT INTO daily_logs 
-               (date, wake_time, alcohol, deep_work_minutes, walk, energy, created_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            (test_date, wake_time, alcohol, deep_work, walk, energy, datetime.now().isoformat())
-        )
+        generated = {
+            "wake_time": (None, f"{random.randint(6, 9)}:{random.choice(['00', '15', '30', '45'])}"),
+            "alcohol": (random.choice([0, 0, 0, 0, 1]), None),  # 20% вероятность
+            "deep_work_minutes": (random.choice([0, 1, 1]), None),  # 66% выполнения
+            "walk": (random.choice([0, 1, 1]), None),  # 66% прогулок
+            "energy": (random.randint(5, 9), None),
+        }
+        for q in questions:
+            if q["field_name"] in generated:
+                int_value, text_value = generated[q["field_name"]]
+            elif q["options"]:
+                options = q["options"].split(",")
+                int_value, text_value = encode_answer(options, random.choice(options))
+            else:
+                continue
+            conn.execute(
+                """INSERT INTO answers (user_id, date, question_id, int_value, text_value)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (ALLOWED_USER_ID, test_day, q["id"], int_value, text_value)
+            )
     
+    habits.rebuild(conn, ALLOWED_USER_ID)
+    conn.execute("DELETE FROM heatmaps WHERE user_id = ?", (ALLOWED_USER_ID,))
     conn.commit()
     conn.close()
 
@@ -220,12 +807,8 @@ def get_options_for_field(field_name: str) -> list:
 def get_week_stats():
     """Статистика за последние 7 дней."""
     conn = get_connection()
-    today = date.today()
-    rows = conn.execute(
-        """SELECT alcohol, deep_work_minutes, energy FROM daily_logs
-           WHERE date >= date(?, '-7 days') AND date <= ?""",
-        (today.isoformat(), today.isoformat())
-    ).fetchall()
+    today = to_day()
+    rows = list(_get_logs(conn, today - 7, today).values())
     conn.close()
 
     days_without_alcohol = sum(1 for r in rows if r["alcohol"] == 0)
@@ -256,7 +839,7 @@ def get_monday_of_week(target_date=None):
 def add_weekly_goals(tasks_list):
     """Добавляет список задач на текущую неделю."""
     conn = get_connection()
-    week_start = get_monday_of_week()
+    week_start = to_day(get_monday_of_week())
     now = datetime.now().isoformat()
     for task in tasks_list:
         task = task.strip()
@@ -276,7 +859,7 @@ def get_weekly_goals(week_start=None):
         week_start = get_monday_of_week()
     rows = conn.execute(
         "SELECT id, task_text, is_completed FROM weekly_goals WHERE week_start_date = ? ORDER BY id",
-        (week_start,)
+        (to_day(week_start),)
     ).fetchall()
     conn.close()
     return [dict(zip(row.keys(), row)) for row in rows]
@@ -293,6 +876,112 @@ def toggle_goal_completion(goal_id):
     conn.close()
 
 
+def _goal_counts(conn, kind: str, days) -> dict:
+    """Выполнено и всего задач типа kind в периодах days (дни начала периодов)."""
+    table, period, _ = _SEARCH_SOURCES[kind]
+    days = list(days)
+    placeholders = ",".join("?" * len(days))
+    row = conn.execute(
+        f"SELECT COUNT(*), COALESCE(SUM(is_completed), 0) FROM {table} WHERE {period} IN ({placeholders})", days
+    ).fetchone()
+    return {"completed": row[1], "total": row[0]}
+
+
+def _goal_days(conn, kind: str, goal_ids: list) -> list:
+    """Дни начала периодов, к которым относятся задачи."""
+    table, period, _ = _SEARCH_SOURCES[kind]
+    placeholders = ",".join("?" * len(goal_ids))
+    return [row[0] for row in conn.execute(
+        f"SELECT DISTINCT {period} FROM {table} WHERE id IN ({placeholders})", goal_ids
+    )]
+
+
+def _update_goals(conn, kind: str, days: list, assignment: str, where: str, params: list) -> dict:
+    """Один UPDATE задач типа kind по условию where. Возвращает {updated, completed, total}
+    (счётчики — по периодам days)."""
+    table = GOAL_TABLES[kind]
+    updated = conn.execute(f"UPDATE {table} SET {assignment} WHERE {where}", params).rowcount
+    if kind == "daily" and updated:
+        for day in days:
+            _day_changed(conn, ALLOWED_USER_ID, day)
+    return {"updated": updated, **_goal_counts(conn, kind, days)}
+
+
+def _set_goals_completed(conn, kind: str, goal_ids, completed: bool) -> dict:
+    goal_ids = [int(goal_id) for goal_id in goal_ids]
+    placeholders = ",".join("?" * len(goal_ids))
+    # Только задачи, у которых статус меняется: в журнал изменений не попадают пустые правки
+    return _update_goals(
+        conn, kind, _goal_days(conn, kind, goal_ids), "is_completed = ?",
+        f"id IN ({placeholders}) AND is_completed != ?", [int(completed), *goal_ids, int(completed)]
+    )
+
+
+def toggle_goals(kind: str, goal_ids) -> dict:
+    """Переключает статус нескольких задач одного типа одним UPDATE. Возвращает {updated, completed, total}."""
+    goal_ids = [int(goal_id) for goal_id in goal_ids]
+    placeholders = ",".join("?" * len(goal_ids))
+    conn = get_connection()
+    with conn:
+        result = _update_goals(
+            conn, kind, _goal_days(conn, kind, goal_ids),
+            "is_completed = 1 - is_completed", f"id IN ({placeholders})", goal_ids
+        )
+    conn.close()
+    return result
+
+
+def set_goals_completed(kind: str, goal_ids, completed: bool) -> dict:
+    """Отмечает задачи одного типа выполненными (или снимает отметку) одним UPDATE.
+
+    Возвращает {updated, completed, total}: сколько задач изменилось и счётчики их периодов.
+    """
+    conn = get_connection()
+    with conn:
+        result = _set_goals_completed(conn, kind, goal_ids, bool(completed))
+    conn.close()
+    return result
+
+
+def _set_period_completed(kind: str, period_start, completed: bool) -> dict:
+    _, period, _ = _SEARCH_SOURCES[kind]
+    day = to_day(period_start if period_start is not None else _PERIOD_STARTS[kind]())
+    conn = get_connection()
+    with conn:
+        result = _update_goals(
+            conn, kind, [day], "is_completed = ?", f"{period} = ? AND is_completed != ?",
+            [int(completed), day, int(completed)]
+        )
+    conn.close()
+    return result
+
+
+def complete_all_goals(kind: str, period_start=None) -> dict:
+    """Отмечает выполненными все задачи периода (по умолчанию — текущего). Возвращает {updated, completed, total}."""
+    return _set_period_completed(kind, period_start, True)
+
+
+def clear_completed_goals(kind: str, period_start=None) -> dict:
+    """Снимает отметку со всех выполненных задач периода (задачи остаются). Возвращает {updated, completed, total}."""
+    return _set_period_completed(kind, period_start, False)
+
+
+def _day_changed(conn, user_id: int, day: int):
+    """Обновляет производные данные за день: битовые карты привычек и тепловую карту."""
+    habits.refresh_day(conn, user_id, day)
+    heatmap.patch_day(conn, user_id, day)
+
+
+def _refresh_goal_days(conn, goal_ids):
+    """Обновляет производные данные за дни, к которым относятся дневные задачи."""
+    goal_ids = list(goal_ids)
+    placeholders = ",".join("?" * len(goal_ids))
+    for row in conn.execute(
+        f"SELECT DISTINCT date FROM daily_goals WHERE id IN ({placeholders})", goal_ids
+    ).fetchall():
+        _day_changed(conn, ALLOWED_USER_ID, row["date"])
+
+
 def get_incomplete_goals(week_start=None):
     """Возвращает список невыполненных задач на неделю."""
     conn = get_connection()
@@ -300,7 +989,7 @@ def get_incomplete_goals(week_start=None):
         week_start = get_monday_of_week()
     rows = conn.execute(
         "SELECT id, task_text FROM weekly_goals WHERE week_start_date = ? AND is_completed = 0 ORDER BY id",
-        (week_start,)
+        (to_day(week_start),)
     ).fetchall()
     conn.close()
     return [dict(zip(row.keys(), row)) for row in rows]
@@ -308,22 +997,17 @@ def get_incomplete_goals(week_start=None):
 
 def move_goals_to_next_week(goal_ids):
     """Переносит задачи на следующую неделю."""
-    from datetime import timedelta
     conn = get_connection()
-    current_monday = date.fromisoformat(get_monday_of_week())
-    next_monday = (current_monday + timedelta(days=7)).isoformat()
+    next_monday = to_day(get_monday_of_week()) + 7
     now = datetime.now().isoformat()
     
-    for goal_id in goal_ids:
-        # Получаем текст задачи
-        row = conn.execute("SELECT task_text FROM weekly_goals WHERE id = ?", (goal_id,)).fetchone()
-        if row:
-            task_text = row["task_text"]
-            # Создаём новую задачу на следующую неделю
-            conn.execute(
-                "INSERT INTO weekly_goals (week_start_date, task_text, is_completed, created_at) VALUES (?, ?, 0, ?)",
-                (next_monday, task_text, now)
-            )
+    # Копия сохраняет template_id: если цель из шаблона уже есть в следующем периоде
+    # (или появится при смене периода), второй такой не будет
+    conn.executemany(
+        """INSERT OR IGNORE INTO weekly_goals (week_start_date, task_text, is_completed, created_at, template_id)
+           SELECT ?, task_text, 0, ?, template_id FROM weekly_goals WHERE id = ?""",
+        [(next_monday, now, goal_id) for goal_id in goal_ids]
+    )
     conn.commit()
     conn.close()
 
@@ -348,7 +1032,7 @@ def is_last_day_of_month(target_date=None):
 def add_monthly_goals(tasks_list):
     """Добавляет список задач на текущий месяц."""
     conn = get_connection()
-    month_start = get_first_day_of_month()
+    month_start = to_day(get_first_day_of_month())
     now = datetime.now().isoformat()
     for task in tasks_list:
         task = task.strip()
@@ -368,7 +1052,7 @@ def get_monthly_goals(month_start=None):
         month_start = get_first_day_of_month()
     rows = conn.execute(
         "SELECT id, task_text, is_completed FROM monthly_goals WHERE month_start_date = ? ORDER BY id",
-        (month_start,)
+        (to_day(month_start),)
     ).fetchall()
     conn.close()
     return [dict(zip(row.keys(), row)) for row in rows]
@@ -392,7 +1076,7 @@ def get_incomplete_monthly_goals(month_start=None):
         month_start = get_first_day_of_month()
     rows = conn.execute(
         "SELECT id, task_text FROM monthly_goals WHERE month_start_date = ? AND is_completed = 0 ORDER BY id",
-        (month_start,)
+        (to_day(month_start),)
     ).fetchall()
     conn.close()
     return [dict(zip(row.keys(), row)) for row in rows]
@@ -400,7 +1084,6 @@ def get_incomplete_monthly_goals(month_start=None):
 
 def move_monthly_goals_to_next_month(goal_ids):
     """Переносит задачи на следующий месяц."""
-    from datetime import timedelta
     conn = get_connection()
     current_first = date.fromisoformat(get_first_day_of_month())
     # Следующий месяц = первое число следующего месяца
@@ -408,19 +1091,16 @@ def move_monthly_goals_to_next_month(goal_ids):
         next_first = date(current_first.year + 1, 1, 1)
     else:
         next_first = date(current_first.year, current_first.month + 1, 1)
-    next_month_start = next_first.isoformat()
+    next_month_start = to_day(next_first)
     now = datetime.now().isoformat()
     
-    for goal_id in goal_ids:
-        # Получаем текст задачи
-        row = conn.execute("SELECT task_text FROM monthly_goals WHERE id = ?", (goal_id,)).fetchone()
-        if row:
-            task_text = row["task_text"]
-            # Создаём новую задачу на следующий месяц
-            conn.execute(
-                "INSERT INTO monthly_goals (month_start_date, task_text, is_completed, created_at) VALUES (?, ?, 0, ?)",
-                (next_month_start, task_text, now)
-            )
+    # Копия сохраняет template_id: если цель из шаблона уже есть в следующем периоде
+    # (или появится при смене периода), второй такой не будет
+    conn.executemany(
+        """INSERT OR IGNORE INTO monthly_goals (month_start_date, task_text, is_completed, created_at, template_id)
+           SELECT ?, task_text, 0, ?, template_id FROM monthly_goals WHERE id = ?""",
+        [(next_month_start, now, goal_id) for goal_id in goal_ids]
+    )
     conn.commit()
     conn.close()
 
@@ -446,17 +1126,16 @@ def get_monthly_stats():
 def add_daily_goals(tasks_list, target_date=None):
     """Добавляет список дневных задач."""
     conn = get_connection()
-    if target_date is None:
-        target_date = date.today()
-    date_str = target_date.isoformat()
+    day = to_day(target_date)
     now = datetime.now().isoformat()
     for task in tasks_list:
         task = task.strip()
         if task:
             conn.execute(
                 "INSERT INTO daily_goals (date, task_text, is_completed, created_at) VALUES (?, ?, 0, ?)",
-                (date_str, task, now)
+                (day, task, now)
             )
+    _day_changed(conn, ALLOWED_USER_ID, day)
     conn.commit()
     conn.close()
 
@@ -464,12 +1143,9 @@ def add_daily_goals(tasks_list, target_date=None):
 def get_daily_goals(target_date=None):
     """Возвращает список дневных целей."""
     conn = get_connection()
-    if target_date is None:
-        target_date = date.today()
-    date_str = target_date.isoformat()
     rows = conn.execute(
         "SELECT id, task_text, is_completed FROM daily_goals WHERE date = ? ORDER BY id",
-        (date_str,)
+        (to_day(target_date),)
     ).fetchall()
     conn.close()
     return [dict(zip(row.keys(), row)) for row in rows]
@@ -482,6 +1158,7 @@ def toggle_daily_goal_completion(goal_id):
         "UPDATE daily_goals SET is_completed = 1 - is_completed WHERE id = ?",
         (goal_id,)
     )
+    _refresh_goal_days(conn, [goal_id])
     conn.commit()
     conn.close()
 
@@ -513,9 +1190,14 @@ def reset_all_data():
     """Полностью очищает все данные пользователя."""
     conn = get_connection()
     conn.execute("DELETE FROM daily_logs")
+    conn.execute("DELETE FROM answers")
     conn.execute("DELETE FROM daily_goals")
     conn.execute("DELETE FROM weekly_goals")
     conn.execute("DELETE FROM monthly_goals")
+    conn.execute("DELETE FROM habit_bits")
+    conn.execute("DELETE FROM heatmaps")
+    conn.execute("DELETE FROM reports")
+    conn.execute("DELETE FROM goal_templates")
     conn.execute("UPDATE user_settings SET onboarding_completed = 0")
     conn.commit()
     conn.close()
@@ -523,25 +1205,426 @@ def reset_all_data():
 
 def get_today_log():
     """Получить запись за сегодня."""
+    today = to_day()
     conn = get_connection()
-    today = date.today().isoformat()
-    row = conn.execute(
-        "SELECT * FROM daily_logs WHERE date = ?",
-        (today,)
-    ).fetchone()
+    logs = _get_logs(conn, today, today)
     conn.close()
-    return dict(row) if row else None
+    return logs.get(today)
 
 
 def get_last_n_days(n=7):
     """Получить записи за последние N дней."""
     conn = get_connection()
-    today = date.today()
+    today = to_day()
+    logs = _get_logs(conn, today - n, today)
+    conn.close()
+    return sorted(logs.values(), key=lambda log: log["date"], reverse=True)
+
+
+def get_habit_stats(habit: str, user_id: int = ALLOWED_USER_ID, days: int = 30) -> dict:
+    """Статистика привычки по битовой карте: текущая и лучшая серия, дней за последние N дней,
+    последний отмеченный день (ISO или None)."""
+    conn = get_connection()
+    bits, base = habits.load(conn, user_id, habit)
+    conn.close()
+    today = to_day()
+    last = habits.last_day(bits, base, today)
+    return {
+        "current_streak": habits.current_streak(bits, base, today),
+        "longest_streak": habits.longest_streak(bits),
+        "count": habits.count_in_range(bits, base, today - days, today),
+        "total": bits.bit_count(),
+        "last_day": from_day(last).isoformat() if last is not None else None,
+    }
+
+
+def get_heatmap(year: int, user_id: int = ALLOWED_USER_ID) -> dict:
+    """Тепловая карта года {metric: bytes} (см. bot.heatmap)."""
+    conn = get_connection()
+    result = heatmap.get(conn, user_id, year)
+    conn.commit()
+    conn.close()
+    return result
+
+
+def save_report(kind: str, period_start: int, data_version: int, payload: dict, user_id: int = ALLOWED_USER_ID):
+    """Сохраняет собранный отчёт за период (заменяет прежний)."""
+    conn = get_connection()
+    conn.execute(
+        """INSERT OR REPLACE INTO reports (user_id, kind, period_start, data_version, payload, built_at)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (user_id, kind, period_start, data_version, json.dumps(payload, ensure_ascii=False), datetime.now().isoformat())
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_report(kind: str, period_start: int, user_id: int = ALLOWED_USER_ID):
+    """Собранный отчёт за период: (data_version, payload) или None."""
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT data_version, payload FROM reports WHERE user_id = ? AND kind = ? AND period_start = ?",
+        (user_id, kind, period_start)
+    ).fetchone()
+    conn.close()
+    if row is None:
+        return None
+    return row["data_version"], json.loads(row["payload"])
+
+
+def _fts_query(text: str) -> str:
+    """Запрос пользователя → запрос FTS5: каждое слово как префикс ("моло" найдёт «молоко»)."""
+    words = "".join(ch if ch.isalnum() else " " for ch in text).split()
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def search_goals(query: str, limit: int = 10, offset: int = 0) -> dict:
+    """Поиск целей всех типов по тексту, по релевантности (bm25).
+
+    Возвращает {"total": N, "results": [{"kind", "id", "date", "task_text", "snippet", "is_completed"}]}.
+    """
+    match = _fts_query(query)
+    if not match:
+        return {"total": 0, "results": []}
+    conn = get_connection()
+    total = conn.execute("SELECT COUNT(*) FROM goals_fts WHERE goals_fts MATCH ?", (match,)).fetchone()[0]
+    rows = conn.execute(
+        """SELECT kind, goal_id, period, task_text, snippet(goals_fts, 0, '[', ']', '…', 12) AS snippet
+           FROM goals_fts WHERE goals_fts MATCH ?
+           ORDER BY rank LIMIT ? OFFSET ?""",
+        (match, limit, offset)
+    ).fetchall()
+    # Статус — из исходных таблиц, только для найденной страницы
+    status = {}
+    for kind, (table, _, _) in _SEARCH_SOURCES.items():
+        ids = [r["goal_id"] for r in rows if r["kind"] == kind]
+        if ids:
+            for r in conn.execute(
+                f"SELECT id, is_completed FROM {table} WHERE id IN ({','.join('?' * len(ids))})", ids
+            ):
+                status[(kind, r["id"])] = r["is_completed"]
+    conn.close()
+    return {
+        "total": total,
+        "results": [
+            {
+                "kind": r["kind"],
+                "id": r["goal_id"],
+                "date": from_day(r["period"]).isoformat(),
+                "task_text": r["task_text"],
+                "snippet": r["snippet"],
+                "is_completed": status.get((r["kind"], r["goal_id"]), 0),
+            }
+            for r in rows
+        ],
+    }
+
+
+# Дни недели шаблона — битовая маска, бит 0 = понедельник (как date.weekday())
+ALL_WEEKDAYS = 0b1111111
+
+
+def add_goal_template(kind: str, task_text: str, weekdays: int = ALL_WEEKDAYS, user_id: int = ALLOWED_USER_ID) -> int:
+    """Добавляет шаблон повторяющейся цели (daily — по дням недели из weekdays, weekly, monthly)."""
+    conn = get_connection()
+    cur = conn.execute(
+        "INSERT INTO goal_templates (user_id, kind, weekdays, task_text, created_at) VALUES (?, ?, ?, ?, ?)",
+        (user_id, kind, weekdays, task_text.strip(), datetime.now().isoformat())
+    )
+    conn.commit()
+    conn.close()
+    return cur.lastrowid
+
+
+def get_goal_templates(user_id: int = ALLOWED_USER_ID) -> list:
+    """Шаблоны пользователя: дневные, недельные, месячные."""
+    conn = get_connection()
+    rows = conn.execute(
+        """SELECT id, kind, weekdays, task_text FROM goal_templates WHERE user_id = ?
+           ORDER BY CASE kind WHEN 'daily' THEN 0 WHEN 'weekly' THEN 1 ELSE 2 END, id""",
+        (user_id,)
+    ).fetchall()
+    conn.close()
+    return [dict(zip(row.keys(), row)) for row in rows]
+
+
+def delete_goal_template(template_id: int):
+    """Удаляет шаблон. Уже созданные из него цели остаются."""
+    conn = get_connection()
+    conn.execute("DELETE FROM goal_templates WHERE id = ?", (template_id,))
+    conn.commit()
+    conn.close()
+
+
+def materialize_goal_templates(target_date=None) -> dict:
+    """Создаёт цели из шаблонов на день target_date для всех пользователей — по одному INSERT ... SELECT на тип.
+
+    Дневные — если день недели входит в шаблон; недельные и месячные — на неделю и месяц, в которые
+    попадает target_date (в любой день периода: если смена недели или месяца пришлась на простой бота,
+    цели появятся при следующем вызове). Повторный вызов за тот же период ничего не добавляет.
+    Возвращает {kind: добавлено}.
+    """
+    target = date.fromisoformat(target_date) if isinstance(target_date, str) else (target_date or date.today())
+    day = to_day(target)
+    now = datetime.now().isoformat()
+    periods = {
+        "daily": day,
+        "weekly": to_day(get_monday_of_week(target)),
+        "monthly": to_day(get_first_day_of_month(target)),
+    }
+    conn = get_connection()
+    added = {}
+    with conn:
+        for kind, period_day in periods.items():
+            table, period, _ = _SEARCH_SOURCES[kind]
+            cur = conn.execute(
+                f"""INSERT OR IGNORE INTO {table} ({period}, task_text, is_completed, created_at, template_id)
+                    SELECT ?, task_text, 0, ?, id FROM goal_templates
+                    WHERE kind = ? AND (weekdays >> ?) & 1
+                    ORDER BY id""",
+                (period_day, now, kind, from_day(period_day).weekday())
+            )
+            added[kind] = cur.rowcount
+        if added["daily"]:
+            _day_changed(conn, ALLOWED_USER_ID, day)
+    conn.close()
+    return added
+
+
+# Строки сущностей для синхронизации: {таблица: (SELECT по списку id, колонки ключа)}
+_SYNC_SELECTS = {
+    "daily_goals": "SELECT id, date, task_text AS text, is_completed AS completed, template_id FROM daily_goals",
+    "weekly_goals": """SELECT id, week_start_date AS date, task_text AS text, is_completed AS completed, template_id
+                       FROM weekly_goals""",
+    "monthly_goals": """SELECT id, month_start_date AS date, task_text AS text, is_completed AS completed, template_id
+                        FROM monthly_goals""",
+    "questions": "SELECT id, survey_type, order_idx, field_name, text, options FROM questions",
+    "goal_templates": "SELECT id, kind, weekdays, task_text AS text FROM goal_templates",
+}
+
+# Сколько изменений отдавать за один запрос синхронизации (ключ ответа — 2 параметра SQL, лимит 999)
+SYNC_PAGE_SIZE = 400
+
+
+def _sync_rows(conn, entity: str, entity_ids: list, user_id: int) -> list:
+    """Текущие строки изменённых записей сущности (даты — ISO, id — как в журнале)."""
+    if entity == "answers":
+        keys = [tuple(int(part) for part in entity_id.split(":")) for entity_id in entity_ids]
+        rows = conn.execute(
+            f"""SELECT a.date, a.question_id, q.field_name, a.int_value, a.text_value FROM answers a
+                LEFT JOIN questions q ON q.id = a.question_id
+                WHERE a.user_id = ? AND (a.date, a.question_id) IN (VALUES {','.join(['(?, ?)'] * len(keys))})""",
+            (user_id, *(v for key in keys for v in key))
+        ).fetchall()
+        return [
+            {"id": f"{r['date']}:{r['question_id']}", **dict(zip(r.keys(), r)), "date": from_day(r["date"]).isoformat()}
+            for r in rows
+        ]
     rows = conn.execute(
-        """SELECT * FROM daily_logs
-           WHERE date >= date(?, ? || ' days') AND date <= ?
-           ORDER BY date DESC""",
-        (today.isoformat(), f'-{n}', today.isoformat())
+        f"{_SYNC_SELECTS[entity]} WHERE id IN ({','.join('?' * len(entity_ids))})",
+        [int(entity_id) for entity_id in entity_ids]
     ).fetchall()
+    result = []
+    for r in rows:
+        row = dict(zip(r.keys(), r))
+        row["id"] = str(row["id"])
+        if entity in GOAL_TABLES.values():
+            row["date"] = from_day(row["date"]).isoformat()
+            row["completed"] = bool(row["completed"])
+        result.append(row)
+    return result
+
+
+def get_changes(since: int = 0, limit: int = SYNC_PAGE_SIZE, user_id: int = ALLOWED_USER_ID) -> dict:
+    """Изменения после ревизии since: текущие строки изменённых записей и id удалённых.
+
+    rev — ревизия, до которой клиент теперь синхронизирован (передать в следующий since);
+    more — есть ещё изменения (запросить снова); reset — ревизия клиента из будущего
+    (база сброшена или заменена), клиент должен очистить копию — ответ содержит всё с нуля.
+    periods — текущие день, неделя и месяц (ISO), чтобы отобрать актуальные цели из копии.
+    """
+    conn = get_connection()
+    latest = conn.execute("SELECT MAX(rev) FROM changes").fetchone()[0] or 0
+    reset = since > latest
+    if reset:
+        since = 0
+    changes = conn.execute(
+        "SELECT rev, entity, entity_id, op FROM changes WHERE user_id = ? AND rev > ? ORDER BY rev LIMIT ?",
+        (user_id, since, limit + 1)
+    ).fetchall()
+    more = len(changes) > limit
+    changes = changes[:limit]
+    upserts, deletes = {}, {}
+    for c in changes:
+        target = upserts if c["op"] == "upsert" else deletes
+        target.setdefault(c["entity"], []).append(c["entity_id"])
+    upserts = {entity: _sync_rows(conn, entity, ids, user_id) for entity, ids in upserts.items()}
+    conn.close()
+    return {
+        "rev": changes[-1]["rev"] if more else latest,
+        "more": more,
+        "reset": reset,
+        "periods": {
+            "daily": date.today().isoformat(),
+            "weekly": get_monday_of_week(),
+            "monthly": get_first_day_of_month(),
+        },
+        "upserts": upserts,
+        "deletes": deletes,
+    }
+
+
+# Сколько хранить результаты применённых изменений (повтор с тем же ключом позже применится заново)
+MUTATION_KEY_TTL = 7 * 24 * 3600
+
+# Начало текущего периода для новых целей: {тип: функция → ISO-дата}
+_PERIOD_STARTS = {
+    "daily": lambda: date.today().isoformat(),
+    "weekly": get_monday_of_week,
+    "monthly": get_first_day_of_month,
+}
+
+
+def _apply_mutation(conn, mutation: dict) -> dict:
+    """Применяет одно изменение цели: add (text), toggle (id), set (id, completed), edit (id, text),
+    set_many (ids, completed)."""
+    kind = mutation.get("type")
+    if kind not in GOAL_TABLES:
+        raise ValueError(f"Неизвестный тип целей: {kind}")
+    table, period, _ = _SEARCH_SOURCES[kind]
+    op = mutation.get("op")
+    if op == "set_many":
+        goal_ids = mutation["ids"]
+        if not isinstance(goal_ids, list) or not goal_ids:
+            raise ValueError("Ожидается непустой список ids")
+        return _set_goals_completed(conn, kind, goal_ids, bool(mutation["completed"]))
+    if op in ("add", "edit"):
+        text = str(mutation.get("text") or "").strip()
+        if not text:
+            raise ValueError("Пустой текст цели")
+    if op == "add":
+        goal_id = conn.execute(
+            f"INSERT INTO {table} ({period}, task_text, is_completed, created_at) VALUES (?, ?, 0, ?)",
+            (to_day(_PERIOD_STARTS[kind]()), text, datetime.now().isoformat())
+        ).lastrowid
+    elif op in ("toggle", "set", "edit"):
+        goal_id = int(mutation["id"])
+        if op == "toggle":
+            cur = conn.execute(f"UPDATE {table} SET is_completed = 1 - is_completed WHERE id = ?", (goal_id,))
+        elif op == "set":
+            cur = conn.execute(
+                f"UPDATE {table} SET is_completed = ? WHERE id = ?", (int(bool(mutation["completed"])), goal_id)
+            )
+        else:
+            cur = conn.execute(f"UPDATE {table} SET task_text = ? WHERE id = ?", (text, goal_id))
+        if cur.rowcount == 0:
+            raise LookupError(f"Цель {goal_id} не найдена")
+    else:
+        raise ValueError(f"Неизвестная операция: {op}")
+    if kind == "daily":
+        _refresh_goal_days(conn, [goal_id])
+    return {"id": goal_id}
+
+
+def apply_mutations(mutations: list) -> list:
+    """Применяет пачку изменений целей по порядку одной транзакцией.
+
+    Каждое изменение — в своей точке сохранения: ошибка одного откатывает только его.
+    Изменение с ключом (key), уже применённое раньше, не повторяется — возвращается
+    сохранённый результат с replayed=True. Возвращает результаты по порядку:
+    {key, ok, id} или {key, ok: False, error}.
+    """
+    now = int(datetime.now().timestamp())
+    results = []
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM applied_mutations WHERE applied_at < ?", (now - MUTATION_KEY_TTL,))
+        for mutation in mutations:
+            key = mutation.get("key")
+            if key is not None:
+                row = conn.execute("SELECT result FROM applied_mutations WHERE key = ?", (str(key),)).fetchone()
+                if row is not None:
+                    results.append({"key": key, **json.loads(row[0]), "replayed": True})
+                    continue
+            conn.execute("SAVEPOINT mutation")
+            try:
+                result = {"ok": True, **_apply_mutation(conn, mutation)}
+                conn.execute("RELEASE mutation")
+            except (KeyError, TypeError, ValueError, LookupError) as e:
+                conn.execute("ROLLBACK TO mutation")
+                conn.execute("RELEASE mutation")
+                result = {"ok": False, "error": str(e)}
+            if key is not None:
+                conn.execute(
+                    "INSERT INTO applied_mutations (key, result, applied_at) VALUES (?, ?, ?)",
+                    (str(key), json.dumps(result), now)
+                )
+            results.append({"key": key, **result})
+    conn.close()
+    return results
+
+
+# Сколько хранить ответы по Idempotency-Key, сколько ключей максимум и через сколько
+# считать брошенным запрос, который так и не завершился (процесс упал)
+IDEMPOTENCY_TTL = 24 * 3600
+IDEMPOTENCY_MAX_KEYS = 10000
+IDEMPOTENCY_LOCK_SECONDS = 60
+
+
+def claim_idempotency_key(key: str, fingerprint: str):
+    """Занимает ключ перед выполнением запроса.
+
+    Возвращает ("new", None) — выполнять; ("replay", (status, mimetype, body)) — отдать сохранённый
+    ответ; ("in_progress", None) — запрос с этим ключом ещё выполняется; ("mismatch", None) — ключ
+    уже использован для другого запроса. Ключ занимается вставкой строки, поэтому работает
+    и между процессами (бот с API и отдельный API).
+    """
+    now = int(datetime.now().timestamp())
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (now - IDEMPOTENCY_TTL,))
+        # Незавершённый запрос, брошенный упавшим процессом, можно выполнить заново
+        conn.execute(
+            "DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL AND created_at < ?",
+            (key, now - IDEMPOTENCY_LOCK_SECONDS)
+        )
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO idempotency_keys (key, fingerprint, created_at) VALUES (?, ?, ?)",
+            (key, fingerprint, now)
+        ).rowcount
+        row = None if inserted else conn.execute(
+            "SELECT fingerprint, status, mimetype, body FROM idempotency_keys WHERE key = ?", (key,)
+        ).fetchone()
+    conn.close()
+    if inserted:
+        return "new", None
+    if row["fingerprint"] != fingerprint:
+        return "mismatch", None
+    if row["status"] is None:
+        return "in_progress", None
+    return "replay", (row["status"], row["mimetype"], row["body"])
+
+
+def save_idempotent_response(key: str, status: int, mimetype: str, body: bytes):
+    """Сохраняет ответ на запрос с ключом; лишние старые ключи сверх IDEMPOTENCY_MAX_KEYS удаляются."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "UPDATE idempotency_keys SET status = ?, mimetype = ?, body = ? WHERE key = ?",
+            (status, mimetype, body, key)
+        )
+        conn.execute(
+            """DELETE FROM idempotency_keys WHERE key IN (
+                   SELECT key FROM idempotency_keys ORDER BY created_at DESC LIMIT -1 OFFSET ?
+               )""",
+            (IDEMPOTENCY_MAX_KEYS,)
+        )
+    conn.close()
+
+
+def release_idempotency_key(key: str):
+    """Освобождает ключ незавершённого запроса (ошибка сервера — повтор выполнит запрос заново)."""
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL", (key,))
     conn.close()
-    return [dict(row) for row in rows]
@@ -0,0 +1,113 @@
+"""
+Живые обновления для Mini App: шина событий для /api/events (Server-Sent Events).
+
+Запись в БД (commit в bot.database) будит публикатор. Он один раз читает журнал изменений
+после последней разосланной ревизии и раздаёт эту дельту всем подписчикам — чтение из БД
+не зависит от числа открытых соединений. Записи из другого процесса (API запущен отдельно
+от бота) публикатор замечает, сверяя ревизию раз в POLL_INTERVAL.
+
+У подписчика — короткая очередь: если клиент не успевает читать, старые события
+вытесняются, и клиент догоняет пропуск через /api/sync (ревизии не сойдутся).
+"""
+import logging
+import threading
+from collections import deque
+
+from .database import COMMIT_LISTENERS, get_changes, get_data_version
+
+logger = logging.getLogger(__name__)
+
+# Как часто сверять ревизию без сигнала о записи (сек) — для записей из другого процесса
+POLL_INTERVAL = 2.0
+# Сколько событий держать для медленного подписчика
+SUBSCRIBER_QUEUE = 8
+# Предел одновременных подписчиков (у каждого открытое соединение и поток сервера)
+MAX_SUBSCRIBERS = 1000
+
+_lock = threading.Lock()
+_subscribers = set()
+_wake = threading.Event()
+_publisher = None
+
+
+class Subscription:
+    """Очередь событий одного клиента."""
+
+    def __init__(self):
+        self._events = deque(maxlen=SUBSCRIBER_QUEUE)
+        self._ready = threading.Event()
+
+    def push(self, event: dict):
+        self._events.append(event)
+        self._ready.set()
+
+    def get(self, timeout: float):
+        """Следующее событие или None, если за timeout ничего не пришло."""
+        if not self._events:
+            self._ready.wait(timeout)
+        self._ready.clear()
+        try:
+            return self._events.popleft()
+        except IndexError:
+            return None
+
+
+def notify():
+    """Сигнал о записи в БД: публикатор проверит журнал изменений."""
+    _wake.set()
+
+
+def subscribe():
+    """Новый подписчик или None, если подписчиков уже MAX_SUBSCRIBERS."""
+    with _lock:
+        if len(_subscribers) >= MAX_SUBSCRIBERS:
+            return None
+        subscription = Subscription()
+        _subscribers.add(subscription)
+        _start()
+    return subscription
+
+
+def unsubscribe(subscription: Subscription):
+    with _lock:
+        _subscribers.discard(subscription)
+
+
+def subscriber_count() -> int:
+    return len(_subscribers)
+
+
+def _start():
+    """Запускает публикатор при первой подписке (вызывается под _lock)."""
+    global _publisher
+    if _publisher is None:
+        if notify not in COMMIT_LISTENERS:
+            COMMIT_LISTENERS.append(notify)
+        _publisher = threading.Thread(target=_publish_loop, name="events-publisher", daemon=True)
+        _publisher.start()
+
+
+def _publish_loop():
+    """Рассылает дельты журнала изменений, пока процесс жив."""
+    last_rev = get_data_version()
+    while True:
+        _wake.wait(POLL_INTERVAL)
+        _wake.clear()
+        try:
+            rev = get_data_version()
+            if rev == last_rev:
+                continue
+            if not _subscribers:
+                last_rev = rev
+                continue
+            # since — ревизия, от которой считана дельта: клиент применяет её, только если она совпадает с его ревизией
+            event = {"since": last_rev, **get_changes(last_rev)}
+            last_rev = event["rev"]
+            if event["more"]:
+                _wake.set()
+            with _lock:
+                subscribers = list(_subscribers)
+            for subscription in subscribers:
+                subscription.push(event)
+        except Exception:
+            logger.exception("events publish failed")
@@ -0,0 +1,170 @@
+"""
+История привычек в битовых картах.
+
+Для каждой привычки пользователя хранится по одной карте на год (BLOB в habit_bits):
+бит N — день N от 1 января. Карта обновляется при записи ответа или изменении целей,
+а серии и количества считаются битовыми операциями и popcount без обхода дней.
+
+Привычки:
+    alcohol    — был алкоголь (ответ «да» на вопрос alcohol)
+    sober      — без алкоголя (ответ «нет»)
+    walk       — была прогулка
+    goals_done — выполнены все дневные задачи
+"""
+from datetime import date
+
+# Номер дня 1970-01-01 в ordinal-нумерации datetime (как в bot.database.to_day)
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Привычки из ответов: {привычка: (field_name вопроса, значение int_value)}
+ANSWER_HABITS = {
+    "alcohol": ("alcohol", 1),
+    "sober": ("alcohol", 0),
+    "walk": ("walk", 1),
+}
+HABITS = (*ANSWER_HABITS, "goals_done")
+
+# Размер карты: 366 бит
+_BLOB_SIZE = 46
+
+
+def _year_start(year: int) -> int:
+    return date(year, 1, 1).toordinal() - _EPOCH_ORDINAL
+
+
+def _year_of(day: int) -> int:
+    return date.fromordinal(day + _EPOCH_ORDINAL).year
+
+
+def set_day(conn, user_id: int, habit: str, day: int, value: bool):
+    """Устанавливает или снимает бит дня в карте года."""
+    year = _year_of(day)
+    row = conn.execute(
+        "SELECT bits FROM habit_bits WHERE user_id = ? AND habit = ? AND year = ?",
+        (user_id, habit, year)
+    ).fetchone()
+    bits = int.from_bytes(row[0], "little") if row else 0
+    mask = 1 << (day - _year_start(year))
+    new_bits = bits | mask if value else bits & ~mask
+    if new_bits == bits:
+        return
+    conn.execute(
+        "INSERT OR REPLACE INTO habit_bits (user_id, habit, year, bits) VALUES (?, ?, ?, ?)",
+        (user_id, habit, year, new_bits.to_bytes(_BLOB_SIZE, "little"))
+    )
+
+
+def refresh_day(conn, user_id: int, day: int):
+    """Пересчитывает все привычки за день из answers и daily_goals."""
+    values = {
+        r["field_name"]: r["int_value"]
+        for r in conn.execute(
+            """SELECT q.field_name, a.int_value FROM answers a
+               JOIN questions q ON q.id = a.question_id
+               WHERE a.user_id = ? AND a.date = ?""",
+            (user_id, day)
+        )
+    }
+    for habit, (field, expected) in ANSWER_HABITS.items():
+        set_day(conn, user_id, habit, day, values.get(field) == expected)
+    total, completed = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(is_completed), 0) FROM daily_goals WHERE date = ?", (day,)
+    ).fetchone()
+    set_day(conn, user_id, "goals_done", day, total > 0 and completed == total)
+
+
+def rebuild(conn, user_id: int):
+    """Строит все карты заново одним проходом по answers и daily_goals."""
+    conn.execute("DELETE FROM habit_bits WHERE user_id = ?", (user_id,))
+    days = {}
+    for habit, (field, expected) in ANSWER_HABITS.items():
+        days[habit] = [
+            r[0] for r in conn.execute(
+                """SELECT a.date FROM answers a JOIN questions q ON q.id = a.question_id
+                   WHERE a.user_id = ? AND q.field_name = ? AND a.int_value = ?""",
+                (user_id, field, expected)
+            )
+        ]
+    days["goals_done"] = [
+        r[0] for r in conn.execute(
+            "SELECT date FROM daily_goals GROUP BY date HAVING COUNT(*) > 0 AND SUM(is_completed) = COUNT(*)"
+        )
+    ]
+    for habit, habit_days in days.items():
+        years = {}
+        for day in habit_days:
+            year = _year_of(day)
+            years[year] = years.get(year, 0) | 1 << (day - _year_start(year))
+        conn.executemany(
+            "INSERT INTO habit_bits (user_id, habit, year, bits) VALUES (?, ?, ?, ?)",
+            [(user_id, habit, year, bits.to_bytes(_BLOB_SIZE, "little")) for year, bits in years.items()]
+        )
+
+
+def load(conn, user_id: int, habit: str):
+    """Все карты привычки, склеенные в одно число. Возвращает (bits, base_day): бит i — день base_day + i."""
+    rows = conn.execute(
+        "SELECT year, bits FROM habit_bits WHERE user_id = ? AND habit = ? ORDER BY year",
+        (user_id, habit)
+    ).fetchall()
+    if not rows:
+        return 0, 0
+    base = _year_start(rows[0][0])
+    bits = 0
+    for year, blob in rows:
+        bits |= int.from_bytes(blob, "little") << (_year_start(year) - base)
+    return bits, base
+
+
+def count_in_range(bits: int, base: int, day_from: int, day_to: int) -> int:
+    """Сколько дней с привычкой в диапазоне [day_from, day_to]."""
+    if day_to < base or day_to < day_from:
+        return 0
+    day_from = max(day_from, base)
+    window = (bits >> (day_from - base)) & ((1 << (day_to - day_from + 1)) - 1)
+    return window.bit_count()
+
+
+def current_streak(bits: int, base: int, today: int) -> int:
+    """Серия подряд идущих дней, заканчивающаяся сегодня (или вчера, если сегодня ещё не отмечено)."""
+    pos = today - base
+    if pos < 0:
+        return 0
+    if not bits >> pos & 1:
+        pos -= 1
+        if pos < 0 or not bits >> pos & 1:
+            return 0
+    prefix = bits & ((1 << (pos + 1)) - 1)
+    gaps = ~prefix & ((1 << (pos + 1)) - 1)
+    # Самый старший ноль ниже pos ограничивает серию снизу
+    return pos + 1 - gaps.bit_length()
+
+
+def longest_streak(bits: int) -> int:
+    """Самая длинная серия. Обходит серии по их границам, а не по дням.
+
+    Стоимость O(r · n/w): r — число серий, n — длина карты в битах, w — размер машинного слова.
+    """
+    # Старший бит каждой серии и младший бит каждой серии
+    ends = bits & ~(bits >> 1)
+    starts = bits & ~(bits << 1)
+    longest = 0
+    while ends:
+        end = ends.bit_length() - 1
+        start = starts.bit_length() - 1
+        longest = max(longest, end - start + 1)
+        # Отбрасываем обработанную серию, числа укорачиваются с каждым шагом
+        low = (1 << start) - 1
+        ends &= low
+        starts &= low
+    return longest
+
+
+def last_day(bits: int, base: int, up_to: int):
+    """Последний день с привычкой не позже up_to (или None)."""
+    if up_to < base:
+        return None
+    window = bits & ((1 << (up_to - base + 1)) - 1)
+    if not window:
+        return None
+    return base + window.bit_length() - 1
@@ -0,0 +1,98 @@
+"""
+Здоровье процесса для API: задержка цикла событий бота и сэмплирующий профилировщик.
+
+Бот и API живут в одном процессе: API — в потоке werkzeug, бот — в цикле asyncio.
+Монитор задержки — корутина в цикле бота: спит LAG_INTERVAL и замеряет, насколько позже
+проснулась. Если цикл занят блокирующим вызовом, замеры прекращаются, и задержка растёт
+от последнего пробуждения — это видно из потока API.
+
+Профилировщик раз в PROFILE_INTERVAL снимает стеки всех потоков (sys._current_frames)
+и считает одинаковые стеки — результат в формате collapsed stacks для flamegraph.pl и speedscope.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Как часто монитор замеряет задержку цикла событий (сек)
+LAG_INTERVAL = 0.5
+# Пауза между снимками стеков (сек) и предел длительности профилирования
+PROFILE_INTERVAL = 0.01
+PROFILE_MAX_SECONDS = 30
+
+# Дополнительная статистика для /debug/profile: {имя: функция без аргументов → dict}
+STATS_PROVIDERS = {}
+
+_last_tick = None
+_last_lag = 0.0
+_monitor = None
+_profile_lock = threading.Lock()
+
+
+def start_loop_monitor():
+    """Запускает монитор задержки в текущем цикле событий (вызывать из корутины бота)."""
+    global _monitor
+    if _monitor is None:
+        _monitor = asyncio.get_running_loop().create_task(_watch_loop())
+
+
+async def _watch_loop():
+    global _last_tick, _last_lag
+    _last_tick = time.monotonic()
+    while True:
+        await asyncio.sleep(LAG_INTERVAL)
+        now = time.monotonic()
+        _last_lag = max(0.0, now - _last_tick - LAG_INTERVAL)
+        _last_tick = now
+
+
+def loop_lag():
+    """Задержка цикла событий бота (сек) или None, если монитор не запущен (API отдельно от бота)."""
+    if _last_tick is None:
+        return None
+    # Цикл ещё не проснулся: задержка — сколько он уже опаздывает
+    overdue = time.monotonic() - _last_tick - LAG_INTERVAL
+    return max(_last_lag, overdue, 0.0)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def sample_stacks(seconds: float):
+    """Снимает стеки всех потоков (кроме текущего) seconds секунд.
+
+    Возвращает Counter {"поток;файл:функция;...": снимков} или None, если профилирование уже идёт.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        me = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_name(frame))
+                    frame = frame.f_back
+                stacks[";".join([names.get(ident, str(ident)), *reversed(frames)])] += 1
+            time.sleep(PROFILE_INTERVAL)
+        return stacks
+    finally:
+        _profile_lock.release()
+
+
+def collapse(stacks: Counter) -> str:
+    """Текст collapsed stacks: строка на стек, «кадры через ; число» — от частых к редким."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def extra_stats() -> dict:
+    return {name: provider() for name, provider in STATS_PROVIDERS.items()}
@@ -0,0 +1,91 @@
+"""
+Годовая тепловая карта: по одному байту на день для каждой метрики.
+
+Карта года строится одним запросом по answers и daily_goals при первом обращении,
+хранится готовым BLOB в heatmaps и точечно исправляется при записи за день.
+Год из трёх метрик занимает ~1.1 КБ.
+
+Значение байта: энергия 1–10, прогулка 0/1, число выполненных дневных задач
+(не больше 254); NO_DATA — за день нет данных.
+"""
+from datetime import date
+
+# Номер дня 1970-01-01 в ordinal-нумерации datetime (как в bot.database.to_day)
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Метрики в порядке хранения в BLOB: field_name вопроса или "goals"
+HEATMAP_METRICS = ("energy", "walk", "goals")
+NO_DATA = 255
+
+_DAY_VALUES_SQL = """
+    SELECT a.date, q.field_name, a.int_value FROM answers a
+    JOIN questions q ON q.id = a.question_id
+    WHERE a.user_id = ? AND a.date BETWEEN ? AND ? AND q.field_name IN ('energy', 'walk')
+      AND a.int_value IS NOT NULL
+    UNION ALL
+    SELECT date, 'goals', SUM(is_completed) FROM daily_goals
+    WHERE date BETWEEN ? AND ?
+    GROUP BY date
+"""
+
+
+def year_bounds(year: int):
+    """(номер первого дня года, число дней в году)."""
+    start = date(year, 1, 1).toordinal() - _EPOCH_ORDINAL
+    end = date(year + 1, 1, 1).toordinal() - _EPOCH_ORDINAL
+    return start, end - start
+
+
+def _year_of(day: int) -> int:
+    return date.fromordinal(day + _EPOCH_ORDINAL).year
+
+
+def _values(conn, user_id: int, day_from: int, day_to: int):
+    """Строки (day, metric, value) за период — один запрос."""
+    return conn.execute(_DAY_VALUES_SQL, (user_id, day_from, day_to, day_from, day_to)).fetchall()
+
+
+def build(conn, user_id: int, year: int) -> bytearray:
+    """Строит карту года из истории: метрики подряд, по дню на байт."""
+    start, days = year_bounds(year)
+    blob = bytearray([NO_DATA]) * (days * len(HEATMAP_METRICS))
+    offsets = {metric: i * days for i, metric in enumerate(HEATMAP_METRICS)}
+    for day, metric, value in _values(conn, user_id, start, start + days - 1):
+        blob[offsets[metric] + day - start] = min(max(value, 0), NO_DATA - 1)
+    return blob
+
+
+def get(conn, user_id: int, year: int) -> dict:
+    """Карта года {metric: bytes}. Строится и сохраняется при первом обращении."""
+    row = conn.execute(
+        "SELECT data FROM heatmaps WHERE user_id = ? AND year = ?", (user_id, year)
+    ).fetchone()
+    if row is None:
+        blob = build(conn, user_id, year)
+        conn.execute(
+            "INSERT OR REPLACE INTO heatmaps (user_id, year, data) VALUES (?, ?, ?)",
+            (user_id, year, bytes(blob))
+        )
+    else:
+        blob = row[0]
+    days = year_bounds(year)[1]
+    return {metric: bytes(blob[i * days:(i + 1) * days]) for i, metric in enumerate(HEATMAP_METRICS)}
+
+
+def patch_day(conn, user_id: int, day: int):
+    """Исправляет один день в сохранённой карте года (если карта уже построена)."""
+    year = _year_of(day)
+    row = conn.execute(
+        "SELECT data FROM heatmaps WHERE user_id = ? AND year = ?", (user_id, year)
+    ).fetchone()
+    if row is None:
+        return
+    start, days = year_bounds(year)
+    blob = bytearray(row[0])
+    for i in range(len(HEATMAP_METRICS)):
+        blob[i * days + day - start] = NO_DATA
+    for _, metric, value in _values(conn, user_id, day, day):
+        blob[HEATMAP_METRICS.index(metric) * days + day - start] = min(max(value, 0), NO_DATA - 1)
+    conn.execute(
+        "UPDATE heatmaps SET data = ? WHERE user_id = ? AND year = ?", (bytes(blob), user_id, year)
+    )
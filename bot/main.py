@@ -1,8 +1,10 @@
 """
 Точка входа. Telegram-бот для ежедневного трекера привычек.
 """
+import asyncio
 import logging
 from datetime import datetime
+from functools import partial
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, MenuButtonWebApp, WebAppInfo
 from telegram.ext import (
     Application,
@@ -13,11 +15,13 @@ from telegram.ext import (
     filters,
 )
 
-from .config import BOT_TOKEN, ALLOWED_USER_ID, ALCOHOL_COST_PER_EPISODE, WEEKLY_ALCOHOL_BUDGET, WEBAPP_URL, BOT_USERNAME
+from .config import BOT_TOKEN, ALLOWED_USER_ID, ALCOHOL_COST_PER_EPISODE, WEBAPP_URL, BOT_USERNAME, CONCURRENT_UPDATES
+from .concurrency import PerUserUpdateProcessor, user_lock
 from .database import (
     init_db,
     get_or_create_today,
-    update_field,
+    save_answer,
+    add_question,
     get_week_stats,
     get_all_questions_numbered,
     update_question_text,
@@ -27,29 +31,39 @@ from .database import (
     get_questions,
     add_weekly_goals,
     get_weekly_goals,
-    toggle_goal_completion,
     get_incomplete_goals,
     move_goals_to_next_week,
     add_monthly_goals,
     get_monthly_goals,
-    toggle_monthly_goal_completion,
     get_incomplete_monthly_goals,
     move_monthly_goals_to_next_month,
     get_monthly_stats,
     is_last_day_of_month,
     add_daily_goals,
     get_daily_goals,
-    toggle_daily_goal_completion,
     is_onboarding_completed,
     set_onboarding_completed,
     reset_all_data,
+    get_habit_stats,
+    search_goals,
+    materialize_goal_templates,
+    local_today,
+    from_day,
 )
 from .questions import (
     get_question_data,
-    get_total_questions,
     get_inline_keyboard,
-    parse_callback_data,
 )
+from .checklist import reply_checklist, register_routes as register_checklist_routes
+from .templates import cmd_templates, register_routes as register_template_routes
+from .router import Router, encode_callback, get_state, set_state, clear_state
+from .reports import (
+    build_week_stats, render_week_report, render_insights, WEEKLY_SUMMARY_TITLE,
+    precompute_reports, load_report,
+)
+from .analytics import get_insights
+from . import charts, health
+from .survey import send_question, answer_and_advance
 from .scheduler import setup_jobs
 
 logging.basicConfig(
@@ -58,18 +72,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Состояние опроса: {user_id: {"type": "morning"|"evening", "index": int}}
-survey_state = {}
-# Состояние редактирования: {user_id: {"action": "edit_text"|"edit_opts", "question_id": int}}
-edit_mode = {}
+# Состояние диалога хранится в router.conversations:
+#   "survey" — опрос: {"type": "morning"|"evening", "index": int, "last_msg_id": int}
+#   "edit_question" — редактирование: {"action": "edit_text"|"edit_opts", "question_id": int}
+#   "new_question" — добавление вопроса: {"survey_type": "morning"|"evening"}
+#   "daily_goals" / "weekly_goals" / "monthly_goals" — ввод списка целей
+router = Router()
+register_checklist_routes(router)
+register_template_routes(router)
 # Тестовый режим: {user_id: {"days_left": int, "current_day": int}}
 test_mode = {}
-# Состояние ввода целей на неделю: {user_id: True}
-weekly_goals_input = {}
-# Состояние ввода целей на месяц: {user_id: True}
-monthly_goals_input = {}
-# Состояние ввода дневных целей: {user_id: True}
-daily_goals_input = {}
 
 
 def is_allowed_user(user_id: int) -> bool:
@@ -77,83 +89,57 @@ def is_allowed_user(user_id: int) -> bool:
     return user_id == ALLOWED_USER_ID
 
 
-async def send_question(chat_id: int, survey_type: str, index: int, context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет вопрос по индексу. Сохраняет message_id в survey_state для последующего удаления.
-    
-    В выходные все вопросы задаются как обычно.
-    """
-    q = get_question_data(survey_type, index)
-    if not q:
-        return None
-    
-    keyboard = get_inline_keyboard(q["field_name"], q["options"]) if q["has_keyboard"] else None
-    msg = await context.bot.send_message(
-        chat_id=chat_id,
-        text=q["text"],
-        reply_markup=keyboard,
-    )
-    if chat_id in survey_state:
-        survey_state[chat_id]["last_msg_id"] = msg.message_id
-    return msg
-
-
 async def morning_survey(context: ContextTypes.DEFAULT_TYPE):
     """Запуск утреннего опроса в 9:00 по Красноярску.
     
-    Сначала спрашивает дневные цели.
+    Сначала спрашивает дневные цели (задачи из шаблонов уже в списке).
     Первого числа месяца добавляет вопрос про цели на месяц.
     По понедельникам добавляет вопрос про цели на неделю.
     """
     if not is_allowed_user(ALLOWED_USER_ID):
         return
     
+    # Шаблоны обычно созданы в goal_rollover; повтор ничего не добавит, но закроет пропуск (бот был выключен)
+    await asyncio.to_thread(materialize_goal_templates, from_day(local_today()))
+    goals = get_daily_goals()
+    
     # Всегда спрашиваем дневные цели в начале дня
-    daily_goals_input[ALLOWED_USER_ID] = True
-    await context.bot.send_message(
-        ALLOWED_USER_ID,
-        "☀️ Доброе утро! Какие задачи на сегодня?\n\nНапиши список (каждая с новой строки):"
-    )
+    async with user_lock(ALLOWED_USER_ID):
+        set_state(ALLOWED_USER_ID, "daily_goals")
+        if goals:
+            planned = "\n".join(f"• {g['task_text']}" for g in goals)
+            text = (
+                f"☀️ Доброе утро! Задачи на сегодня:\n\n{planned}\n\n"
+                "Допиши ещё (каждая с новой строки) или отправь «-», чтобы оставить так:"
+            )
+        else:
+            text = "☀️ Доброе утро! Какие задачи на сегодня?\n\nНапиши список (каждая с новой строки):"
+        await context.bot.send_message(ALLOWED_USER_ID, text)
+
+
+async def goal_rollover(context: ContextTypes.DEFAULT_TYPE):
+    """Смена дня: создаёт цели из шаблонов на день, неделю и месяц (недостающие после простоя — тоже)."""
+    added = await asyncio.to_thread(materialize_goal_templates, from_day(local_today()))
+    logger.info("goal templates materialized: %s", added)
 
 
 async def evening_survey(context: ContextTypes.DEFAULT_TYPE):
     """Запуск вечернего опроса в 21:00 по Красноярску."""
     if not is_allowed_user(ALLOWED_USER_ID):
         return
-    survey_state[ALLOWED_USER_ID] = {"type": "evening", "index": 0}
-    await send_question(ALLOWED_USER_ID, "evening", 0, context)
+    async with user_lock(ALLOWED_USER_ID):
+        set_state(ALLOWED_USER_ID, "survey", type="evening", index=0)
+        await send_question(ALLOWED_USER_ID, "evening", 0, context)
 
 
 async def weekly_summary(context: ContextTypes.DEFAULT_TYPE):
     """Недельная сводка по воскресеньям в 14:00."""
     if not is_allowed_user(ALLOWED_USER_ID):
         return
-    stats = get_week_stats()
-    
-    episodes = stats['days_with_alcohol']
-    tasks_done = int(stats['avg_deep_work'] * stats['total_days'])
-    
-    # Финансовая бухгалтерия
-    plan = WEEKLY_ALCOHOL_BUDGET
-    fact = episodes * ALCOHOL_COST_PER_EPISODE
-    difference = plan - fact
-    
-    text = f"📊 Недельная сводка\n\n"
-    text += f"Главных задач выполнено: {tasks_done} из {stats['total_days']}\n"
-    text += f"Средняя энергия: {stats['avg_energy']}\n\n"
-    
-    text += f"📊 Алкоголь за неделю:\n"
-    text += f"План: {plan:,} ₽\n"
-    text += f"Факт: {fact:,} ₽\n"
-    text += f"Эпизодов: {episodes}\n\n"
-    
-    if difference > 0:
-        text += f"💰 Экономия: +{difference:,} ₽"
-    elif difference < 0:
-        text += f"⚠️ Перерасход: {abs(difference):,} ₽"
-    else:
-        text += "✅ По плану"
-    
-    await context.bot.send_message(ALLOWED_USER_ID, text)
+    # Сводка собрана заранее (precompute_reports_job) — здесь только чтение и отправка
+    report = await asyncio.to_thread(load_report, "week")
+    await context.bot.send_message(ALLOWED_USER_ID, report["text"])
+    await charts.send_chart(context.bot, ALLOWED_USER_ID, "week")
 
 
 async def friday_reminder(context: ContextTypes.DEFAULT_TYPE):
@@ -188,7 +174,7 @@ async def friday_reminder(context: ContextTypes.DEFAULT_TYPE):
         
         # Кнопка для переноса
         keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("📅 Перенести на следующую неделю", callback_data="move_goals")]
+            [InlineKeyboardButton("📅 Перенести на следующую неделю", callback_data=encode_callback("mw"))]
         ])
         await context.bot.send_message(ALLOWED_USER_ID, text, reply_markup=keyboard)
 
@@ -202,198 +188,210 @@ async def end_of_month_check(context: ContextTypes.DEFAULT_TYPE):
     if not is_last_day_of_month():
         return
     
-    goals = get_monthly_goals()
-    if not goals:
+    # Итоги собраны заранее (precompute_reports_job)
+    report = await asyncio.to_thread(load_report, "month")
+    if report["text"] is None:
         # Если целей нет, ничего не отправляем
         return
     
-    completed = [g for g in goals if g["is_completed"] == 1]
-    incomplete = [g for g in goals if g["is_completed"] == 0]
-    
-    if not incomplete:
-        # Все задачи выполнены
-        text = "🔥 РЕСПЕКТ! 🔥\n\n"
-        text += f"Все {len(goals)} месячных целей выполнены!\n\n"
-        text += "Отличный месяц! 🎉"
-        await context.bot.send_message(ALLOWED_USER_ID, text)
-    else:
-        # Есть невыполненные задачи
-        text = f"📊 Итоги месяца:\n\n"
-        text += f"✅ Выполнено: {len(completed)} из {len(goals)}\n"
-        text += f"⏳ Осталось: {len(incomplete)}\n\n"
-        text += "Невыполненные задачи:\n"
-        for g in incomplete:
-            text += f"• {g['task_text']}\n"
-        
+    keyboard = None
+    if report["has_incomplete"]:
         # Кнопка для переноса
         keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("📅 Перенести на следующий месяц", callback_data="move_monthly_goals")]
+            [InlineKeyboardButton("📅 Перенести на следующий месяц", callback_data=encode_callback("mm"))]
         ])
-        await context.bot.send_message(ALLOWED_USER_ID, text, reply_markup=keyboard)
+    await context.bot.send_message(ALLOWED_USER_ID, report["text"], reply_markup=keyboard)
+    await charts.send_chart(context.bot, ALLOWED_USER_ID, "month")
+
+
+async def precompute_reports_job(context: ContextTypes.DEFAULT_TYPE):
+    """Собирает воскресную сводку и итоги месяца заранее, вне момента отправки."""
+    # День — по TIMEZONE, как и расписание задачи, а не по часам сервера
+    today = from_day(local_today())
+    kinds = []
+    if today.weekday() == 6:
+        kinds.append("week")
+    if is_last_day_of_month(today):
+        kinds.append("month")
+    if not kinds:
+        return
+    built = await asyncio.to_thread(precompute_reports, kinds)
+    logger.info("precomputed reports %s: %d rebuilt", kinds, built)
+    # Прогреваем кеш графиков к тем же отчётам
+    for period in kinds:
+        try:
+            await charts.chart_png(period)
+        except Exception:
+            logger.exception("chart warmup %s failed", period)
 
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка текстовых ответов (wake_time, daily/weekly/monthly goals).
-    После ответа: удаляем вопрос, сохраняем в БД, показываем следующий или завершаем."""
+    """Обработка текстовых сообщений: обработчик выбирается по состоянию диалога (router)."""
     user_id = update.effective_user.id
     if not is_allowed_user(user_id):
         return
-    
-    # Проверяем режим ввода дневных целей
-    if user_id in daily_goals_input:
-        text = update.message.text.strip()
-        tasks = [line.strip() for line in text.split('\n') if line.strip()]
-        if tasks:
-            add_daily_goals(tasks)
-            await update.message.reply_text(f"✅ Добавлено задач на сегодня: {len(tasks)}")
-        del daily_goals_input[user_id]
-        
-        # Проверяем, это онбординг или обычное утро
-        if not is_onboarding_completed():
-            # Онбординг - продолжаем настройку целей
-            await continue_onboarding_weekly(update, context)
-        else:
-            # Обычное утро - проверяем, нужно ли спросить недельные/месячные цели
-            today = datetime.now()
-            is_monday = today.weekday() == 0
-            is_first_of_month = today.day == 1
-            
-            if is_first_of_month:
-                monthly_goals_input[user_id] = True
-                await context.bot.send_message(
-                    user_id,
-                    "🗓 Какие цели на месяц?\n\nНапиши список задач (каждая с новой строки):"
-                )
-            elif is_monday:
-                weekly_goals_input[user_id] = True
-                await context.bot.send_message(
-                    user_id,
-                    "📋 Какие цели на неделю?\n\nНапиши список задач (каждая с новой строки):"
-                )
-            else:
-                # Запускаем обычный утренний опрос
-                survey_state[user_id] = {"type": "morning", "index": 0}
-                await send_question(user_id, "morning", 0, context)
-        return
-    
-    # Проверяем режим ввода месячных целей
-    if user_id in monthly_goals_input:
-        text = update.message.text.strip()
-        tasks = [line.strip() for line in text.split('\n') if line.strip()]
-        if tasks:
-            add_monthly_goals(tasks)
-            await update.message.reply_text(f"✅ Добавлено месячных целей: {len(tasks)}")
-        del monthly_goals_input[user_id]
-        
-        # Проверяем, это онбординг или обычное утро
-        if not is_onboarding_completed():
-            # Онбординг завершён!
-            set_onboarding_completed()
-
-            # Кнопка Mini App, если настроен
-            reply_markup = None
-            if WEBAPP_URL and BOT_USERNAME:
-                app_url = f"{WEBAPP_URL.rstrip('/')}?bot={BOT_USERNAME}"
-                reply_markup = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("📱 Открыть меню", web_app=WebAppInfo(url=app_url))]
-                ])
-
-            await update.message.reply_text(
-                "🎉 **Отлично! Настройка завершена.**\n\n"
-                "Теперь запускаю утренний опрос...\n\n"
-                "💡 Меню с командами и расписанием — в кнопке **«Открыть»** рядом с полем ввода (или в Mini App).",
-                parse_mode="Markdown",
-                reply_markup=reply_markup
+    await router.dispatch_text(update, context, get_state(user_id))
+
+
+@router.text("daily_goals")
+async def on_daily_goals_text(update: Update, context: ContextTypes.DEFAULT_TYPE, state: dict):
+    """Ввод дневных задач (утро или онбординг). «-» — оставить задачи из шаблонов как есть."""
+    user_id = update.effective_user.id
+    tasks = [line.strip() for line in update.message.text.strip().split('\n') if line.strip() not in ("", "-", "—")]
+    if tasks:
+        add_daily_goals(tasks)
+        await update.message.reply_text(f"✅ Добавлено задач на сегодня: {len(tasks)}")
+    clear_state(user_id)
+
+    # Проверяем, это онбординг или обычное утро
+    if not is_onboarding_completed():
+        # Онбординг - продолжаем настройку целей
+        await continue_onboarding_weekly(update, context)
+    else:
+        # Обычное утро - проверяем, нужно ли спросить недельные/месячные цели
+        today = datetime.now()
+        is_monday = today.weekday() == 0
+        is_first_of_month = today.day == 1
+
+        if is_first_of_month:
+            set_state(user_id, "monthly_goals")
+            await context.bot.send_message(
+                user_id,
+                "🗓 Какие цели на месяц?\n\nНапиши список задач (каждая с новой строки):"
+            )
+        elif is_monday:
+            set_state(user_id, "weekly_goals")
+            await context.bot.send_message(
+                user_id,
+                "📋 Какие цели на неделю?\n\nНапиши список задач (каждая с новой строки):"
             )
-            # Запускаем утренний опрос
-            survey_state[user_id] = {"type": "morning", "index": 0}
-            await send_question(user_id, "morning", 0, context)
         else:
-            # Обычное утро (первое число, но не онбординг)
-            # Проверяем, не понедельник ли (нужно спросить недельные цели)
-            is_monday = datetime.now().weekday() == 0
-            if is_monday:
-                weekly_goals_input[user_id] = True
-                await context.bot.send_message(
-                    user_id,
-                    "📋 Какие цели на неделю?\n\nНапиши список задач (каждая с новой строки):"
-                )
-            else:
-                # Запускаем обычный утренний опрос
-                survey_state[user_id] = {"type": "morning", "index": 0}
-                await send_question(user_id, "morning", 0, context)
-        return
-    
-    # Проверяем режим ввода целей на неделю
-    if user_id in weekly_goals_input:
-        text = update.message.text.strip()
-        tasks = [line.strip() for line in text.split('\n') if line.strip()]
-        if tasks:
-            add_weekly_goals(tasks)
-            await update.message.reply_text(f"✅ Добавлено недельных целей: {len(tasks)}")
-        del weekly_goals_input[user_id]
-        
-        # Проверяем, это онбординг или обычное утро
-        if not is_onboarding_completed():
-            # Онбординг - продолжаем с месячными целями
-            await continue_onboarding_monthly(update, context)
+            # Запускаем обычный утренний опрос
+            set_state(user_id, "survey", type="morning", index=0)
+            await send_question(user_id, "morning", 0, context)
+
+
+@router.text("monthly_goals")
+async def on_monthly_goals_text(update: Update, context: ContextTypes.DEFAULT_TYPE, state: dict):
+    """Ввод целей на месяц (первое число или онбординг)."""
+    user_id = update.effective_user.id
+    tasks = [line.strip() for line in update.message.text.strip().split('\n') if line.strip()]
+    if tasks:
+        add_monthly_goals(tasks)
+        await update.message.reply_text(f"✅ Добавлено месячных целей: {len(tasks)}")
+    clear_state(user_id)
+
+    # Проверяем, это онбординг или обычное утро
+    if not is_onboarding_completed():
+        # Онбординг завершён!
+        set_onboarding_completed()
+
+        # Кнопка Mini App, если настроен
+        reply_markup = None
+        if WEBAPP_URL and BOT_USERNAME:
+            app_url = f"{WEBAPP_URL.rstrip('/')}?bot={BOT_USERNAME}"
+            reply_markup = InlineKeyboardMarkup([
+                [InlineKeyboardButton("📱 Открыть меню", web_app=WebAppInfo(url=app_url))]
+            ])
+
+        await update.message.reply_text(
+            "🎉 **Отлично! Настройка завершена.**\n\n"
+            "Теперь запускаю утренний опрос...\n\n"
+            "💡 Меню с командами и расписанием — в кнопке **«Открыть»** рядом с полем ввода (или в Mini App).",
+            parse_mode="Markdown",
+            reply_markup=reply_markup
+        )
+        # Запускаем утренний опрос
+        set_state(user_id, "survey", type="morning", index=0)
+        await send_question(user_id, "morning", 0, context)
+    else:
+        # Обычное утро (первое число, но не онбординг)
+        # Проверяем, не понедельник ли (нужно спросить недельные цели)
+        is_monday = datetime.now().weekday() == 0
+        if is_monday:
+            set_state(user_id, "weekly_goals")
+            await context.bot.send_message(
+                user_id,
+                "📋 Какие цели на неделю?\n\nНапиши список задач (каждая с новой строки):"
+            )
         else:
-            # Обычное утро - запускаем утренний опрос
-            survey_state[user_id] = {"type": "morning", "index": 0}
+            # Запускаем обычный утренний опрос
+            set_state(user_id, "survey", type="morning", index=0)
             await send_question(user_id, "morning", 0, context)
+
+
+@router.text("weekly_goals")
+async def on_weekly_goals_text(update: Update, context: ContextTypes.DEFAULT_TYPE, state: dict):
+    """Ввод целей на неделю (понедельник или онбординг)."""
+    user_id = update.effective_user.id
+    tasks = [line.strip() for line in update.message.text.strip().split('\n') if line.strip()]
+    if tasks:
+        add_weekly_goals(tasks)
+        await update.message.reply_text(f"✅ Добавлено недельных целей: {len(tasks)}")
+    clear_state(user_id)
+
+    # Проверяем, это онбординг или обычное утро
+    if not is_onboarding_completed():
+        # Онбординг - продолжаем с месячными целями
+        await continue_onboarding_monthly(update, context)
+    else:
+        # Обычное утро - запускаем утренний опрос
+        set_state(user_id, "survey", type="morning", index=0)
+        await send_question(user_id, "morning", 0, context)
+
+
+@router.text("edit_question")
+async def on_edit_question_text(update: Update, context: ContextTypes.DEFAULT_TYPE, state: dict):
+    """Новый текст или варианты ответа редактируемого вопроса."""
+    user_id = update.effective_user.id
+    text = update.message.text.strip()
+    q_id = state["question_id"]
+
+    if state["action"] == "edit_text":
+        update_question_text(q_id, text)
+        clear_state(user_id)
+        await update.message.reply_text("✅ Текст вопроса обновлён!")
+    elif state["action"] == "edit_opts":
+        update_question_options(q_id, text)
+        clear_state(user_id)
+        await update.message.reply_text("✅ Варианты обновлены!")
+
+
+@router.text("new_question")
+async def on_new_question_text(update: Update, context: ContextTypes.DEFAULT_TYPE, state: dict):
+    """Текст (и варианты) нового вопроса."""
+    user_id = update.effective_user.id
+    lines = [line.strip() for line in update.message.text.strip().split('\n') if line.strip()]
+    if not lines:
         return
-    
-    # Проверяем режим редактирования
-    if user_id in edit_mode:
-        mode = edit_mode[user_id]
-        text = update.message.text.strip()
-        q_id = mode["question_id"]
-        
-        if mode["action"] == "edit_text":
-            update_question_text(q_id, text)
-            del edit_mode[user_id]
-            await update.message.reply_text("✅ Текст вопроса обновлён!")
-        elif mode["action"] == "edit_opts":
-            update_question_options(q_id, text)
-            del edit_mode[user_id]
-            await update.message.reply_text("✅ Варианты обновлены!")
-        return
-    
-    if user_id not in survey_state:
-        return
+    options = lines[1] if len(lines) > 1 else None
+    add_question(state["survey_type"], lines[0], options)
+    clear_state(user_id)
+    await update.message.reply_text("✅ Вопрос добавлен!")
+
 
-    state = survey_state[user_id]
+@router.text("survey")
+async def on_survey_text(update: Update, context: ContextTypes.DEFAULT_TYPE, state: dict):
+    """Текстовый ответ на вопрос опроса (wake_time и другие вопросы без вариантов).
+    После ответа: удаляем вопрос, сохраняем в БД, показываем следующий или завершаем."""
+    user_id = update.effective_user.id
     survey_type = state["type"]
     index = state["index"]
     q = get_question_data(survey_type, index)
     if not q:
         return
-    field = q["field_name"]
     text = update.message.text.strip()
 
-    # Удаляем сообщение с вопросом (предыдущее)
-    last_msg_id = state.get("last_msg_id")
-    if last_msg_id:
-        try:
-            await context.bot.delete_message(chat_id=user_id, message_id=last_msg_id)
-        except Exception:
-            pass
-
-    # Сохраняем ответ
-    if field == "wake_time":
-        update_field("wake_time", text)
-    # main_task removed - now using daily_goals
+    # Сохраняем ответ (у вопросов с кнопками текст не принимаем)
+    save = None if q["options"] else partial(save_answer, q["id"], text)
 
-    # Удаляем ответ пользователя
-    await update.message.delete()
-
-    # Следующий вопрос или конец
-    state["index"] += 1
-    total = get_total_questions(survey_type)
-    if state["index"] < total:
-        await send_question(user_id, survey_type, state["index"], context)
-    else:
-        del survey_state[user_id]
+    # Удаляем вопрос и ответ пользователя, сохраняем, отправляем следующий вопрос — параллельно
+    finished = await answer_and_advance(
+        context, user_id, state, save,
+        delete_ids=(state.get("last_msg_id"), update.message.message_id),
+    )
+    if finished:
+        clear_state(user_id)
         
         # Проверяем тестовый режим
         if user_id in test_mode:
@@ -410,7 +408,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     f"Алкоголь вчера: {'Да' if row['alcohol'] == 1 else 'Нет' if row['alcohol'] == 0 else '—'}"
                 )
                 await context.bot.send_message(user_id, "Переходим к вечернему опросу! 🌙")
-                survey_state[user_id] = {"type": "evening", "index": 0}
+                set_state(user_id, "survey", type="evening", index=0)
                 await send_question(user_id, "evening", 0, context)
             else:
                 # После вечернего опроса — показываем полный /today
@@ -445,7 +443,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         f"\n➡️ День {test_state['current_day']} из {test_state['total_days']}\n"
                         "Начинаем утренний опрос! 🌅"
                     )
-                    survey_state[user_id] = {"type": "morning", "index": 0}
+                    set_state(user_id, "survey", type="morning", index=0)
                     await send_question(user_id, "morning", 0, context)
                 else:
                     # Тест завершён — показываем всю статистику
@@ -466,21 +464,21 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     
                     # Показываем финансы
                     if days_with == 0:
-                        saved = 2.5 * ALCOHOL_COST
+                        saved = 2.5 * ALCOHOL_COST_PER_EPISODE
                         await context.bot.send_message(
                             user_id,
                             f"💰 Ты заработал ~{saved:,.0f} ₽!\n"
                             "Ни разу не пил — отлично! 🔥"
                         )
                     elif days_with <= 2:
-                        spent = days_with * ALCOHOL_COST
+                        spent = days_with * ALCOHOL_COST_PER_EPISODE
                         await context.bot.send_message(
                             user_id,
                             f"💸 Потрачено: {spent:,} ₽\n"
                             "В пределах нормы"
                         )
                     else:
-                        spent = days_with * ALCOHOL_COST
+                        spent = days_with * ALCOHOL_COST_PER_EPISODE
                         await context.bot.send_message(
                             user_id,
                             f"💸 Потрачено: {spent:,} ₽\n"
@@ -491,192 +489,91 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка нажатий inline-кнопок (alcohol, walk, energy + редактирование вопросов + цели).
-    Конвертируем Да/Нет в 0/1 для БД."""
+    """Обработка нажатий inline-кнопок: обработчик выбирается по префиксу callback_data (router)."""
     user_id = update.callback_query.from_user.id
     if not is_allowed_user(user_id):
         return
-    
+    if not await router.dispatch_callback(update, context) and not await on_legacy_survey_answer(update, context):
+        await update.callback_query.answer()
+
+
+@router.callback("mw", "move_goals")
+async def on_move_weekly_goals(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перенос невыполненных недельных целей на следующую неделю."""
     query = update.callback_query
-    data = query.data
-    
-    # Обработка чекбоксов дневных целей
-    if data.startswith("dgoal_"):
-        goal_id = int(data.split("_")[1])
-        toggle_daily_goal_completion(goal_id)
-        await query.answer("Статус обновлён!")
-        
-        # Обновляем сообщение с новыми чекбоксами
-        goals = get_daily_goals()
-        completed_count = sum(1 for g in goals if g["is_completed"] == 1)
-        text = f"☀️ Задачи на сегодня ({completed_count}/{len(goals)})\n\n"
-        
-        buttons = []
-        for g in goals:
-            checkbox = "☑️" if g["is_completed"] == 1 else "☐"
-            text += f"{checkbox} {g['task_text']}\n"
-            buttons.append([InlineKeyboardButton(
-                f"{checkbox} {g['task_text'][:40]}{'...' if len(g['task_text']) > 40 else ''}",
-                callback_data=f"dgoal_{g['id']}"
-            )])
-        
-        keyboard = InlineKeyboardMarkup(buttons)
-        await query.edit_message_text(text, reply_markup=keyboard)
-        
-        # Проверяем, все ли выполнены (и отправляем респект)
-        if completed_count == len(goals) and completed_count > 0:
-            all_done = all(g["is_completed"] == 1 for g in goals)
-            if all_done:
-                await context.bot.send_message(user_id, "🔥 РЕСПЕКТ! 🔥\n\nВсе задачи на сегодня выполнены!")
-        return
-    
-    # Обработка чекбоксов целей
-    if data.startswith("goal_"):
-        goal_id = int(data.split("_")[1])
-        toggle_goal_completion(goal_id)
-        await query.answer("Статус обновлён!")
-        
-        # Обновляем сообщение с новыми чекбоксами
-        goals = get_weekly_goals()
-        completed_count = sum(1 for g in goals if g["is_completed"] == 1)
-        text = f"📋 Цели на неделю ({completed_count}/{len(goals)})\n\n"
-        
-        buttons = []
-        for g in goals:
-            checkbox = "☑️" if g["is_completed"] == 1 else "☐"
-            text += f"{checkbox} {g['task_text']}\n"
-            buttons.append([InlineKeyboardButton(
-                f"{checkbox} {g['task_text'][:40]}{'...' if len(g['task_text']) > 40 else ''}",
-                callback_data=f"goal_{g['id']}"
-            )])
-        
-        keyboard = InlineKeyboardMarkup(buttons)
-        await query.edit_message_text(text, reply_markup=keyboard)
-        
-        # Проверяем, все ли выполнены (и отправляем респект)
-        if completed_count == len(goals) and completed_count > 0:
-            all_done = all(g["is_completed"] == 1 for g in goals)
-            if all_done:
-                await context.bot.send_message(user_id, "🔥 РЕСПЕКТ! 🔥\n\nВсе цели выполнены!")
-        return
-    
-    # Обработка переноса целей
-    if data == "move_goals":
-        incomplete = get_incomplete_goals()
-        if incomplete:
-            goal_ids = [g["id"] for g in incomplete]
-            move_goals_to_next_week(goal_ids)
-            await query.answer("Задачи перенесены!")
-            await query.edit_message_text(
-                f"✅ Перенесено {len(incomplete)} задач на следующую неделю.\n\n"
-                "Отдыхай на выходных! 🏖"
-            )
-        else:
-            await query.answer("Нет задач для переноса")
-        return
-    
-    # Обработка чекбоксов месячных целей
-    if data.startswith("mgoal_"):
-        goal_id = int(data.split("_")[1])
-        toggle_monthly_goal_completion(goal_id)
-        await query.answer("Статус обновлён!")
-        
-        # Обновляем сообщение с новыми чекбоксами
-        goals = get_monthly_goals()
-        completed_count = sum(1 for g in goals if g["is_completed"] == 1)
-        text = f"🗓 Цели на месяц ({completed_count}/{len(goals)})\n\n"
-        
-        buttons = []
-        for g in goals:
-            checkbox = "☑️" if g["is_completed"] == 1 else "☐"
-            text += f"{checkbox} {g['task_text']}\n"
-            buttons.append([InlineKeyboardButton(
-                f"{checkbox} {g['task_text'][:40]}{'...' if len(g['task_text']) > 40 else ''}",
-                callback_data=f"mgoal_{g['id']}"
-            )])
-        
-        keyboard = InlineKeyboardMarkup(buttons)
-        await query.edit_message_text(text, reply_markup=keyboard)
-        
-        # Проверяем, все ли выполнены (и отправляем респект)
-        if completed_count == len(goals) and completed_count > 0:
-            all_done = all(g["is_completed"] == 1 for g in goals)
-            if all_done:
-                await context.bot.send_message(user_id, "🔥 РЕСПЕКТ! 🔥\n\nВсе месячные цели выполнены!")
-        return
-    
-    # Обработка переноса месячных целей
-    if data == "move_monthly_goals":
-        incomplete = get_incomplete_monthly_goals()
-        if incomplete:
-            goal_ids = [g["id"] for g in incomplete]
-            move_monthly_goals_to_next_month(goal_ids)
-            await query.answer("Задачи перенесены!")
-            await query.edit_message_text(
-                f"✅ Перенесено {len(incomplete)} задач на следующий месяц."
-            )
-        else:
-            await query.answer("Нет задач для переноса")
-        return
-    
-    # Обработка сброса данных
-    if data == "confirm_reset":
-        reset_all_data()
-        await query.answer("Все данные удалены")
+    incomplete = get_incomplete_goals()
+    if incomplete:
+        goal_ids = [g["id"] for g in incomplete]
+        move_goals_to_next_week(goal_ids)
+        await query.answer("Задачи перенесены!")
         await query.edit_message_text(
-            "✅ Все данные удалены.\n\n"
-            "Напиши /start чтобы начать заново."
+            f"✅ Перенесено {len(incomplete)} задач на следующую неделю.\n\n"
+            "Отдыхай на выходных! 🏖"
         )
-        return
-    
-    if data == "cancel_reset":
-        await query.answer("Отменено")
-        await query.edit_message_text("❌ Сброс отменён.")
-        return
-    
-    # Обработка кнопок редактирования вопросов
-    if data.startswith("editq_") or data.startswith("edittext_") or data.startswith("editopts_") or data == "back_to_questions":
-        await handle_edit_question_callback(update, context)
-        return
-    
-    if user_id not in survey_state:
-        await query.answer()
-        return
+    else:
+        await query.answer("Нет задач для переноса")
 
-    await query.answer()
-    field, value = parse_callback_data(data)
 
-    state = survey_state[user_id]
+@router.callback("mm", "move_monthly_goals")
+async def on_move_monthly_goals(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перенос невыполненных месячных целей на следующий месяц."""
+    query = update.callback_query
+    incomplete = get_incomplete_monthly_goals()
+    if incomplete:
+        goal_ids = [g["id"] for g in incomplete]
+        move_monthly_goals_to_next_month(goal_ids)
+        await query.answer("Задачи перенесены!")
+        await query.edit_message_text(
+            f"✅ Перенесено {len(incomplete)} задач на следующий месяц."
+        )
+    else:
+        await query.answer("Нет задач для переноса")
+
+
+@router.callback("rs", "confirm_reset")
+async def on_confirm_reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подтверждение полного сброса данных."""
+    query = update.callback_query
+    reset_all_data()
+    await query.answer("Все данные удалены")
+    await query.edit_message_text(
+        "✅ Все данные удалены.\n\n"
+        "Напиши /start чтобы начать заново."
+    )
+
+
+@router.callback("rc", "cancel_reset")
+async def on_cancel_reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отмена сброса данных."""
+    query = update.callback_query
+    await query.answer("Отменено")
+    await query.edit_message_text("❌ Сброс отменён.")
+
+
+@router.callback("a")
+async def on_survey_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, field: str, option_idx: str):
+    """Ответ на вопрос опроса кнопкой (alcohol, walk, energy и любые добавленные вопросы)."""
+    query = update.callback_query
+    user_id = query.from_user.id
+    await query.answer()
+    state = get_state(user_id)
+    if not state or state["name"] != "survey":
+        return
     survey_type = state["type"]
     index = state["index"]
     q = get_question_data(survey_type, index)
-    if not q or field != q["field_name"]:
+    option_idx = int(option_idx)
+    if not q or field != q["field_name"] or not q["options"] or option_idx >= len(q["options"]):
         return
+    value = q["options"][option_idx]
 
-    # Удаляем сообщение с вопросом
-    try:
-        await query.message.delete()
-    except Exception:
-        pass
-
-    # Сохраняем в БД (первый вариант -> 1, второй -> 0 для alcohol/walk/deep_work; energy — число)
-    if field == "alcohol":
-        update_field("alcohol", 1 if value == q["options"][0] else 0)
-    elif field == "walk":
-        update_field("walk", 1 if value == q["options"][0] else 0)
-    elif field == "deep_work_minutes":
-        # Теперь это Да/Нет вместо минут
-        update_field("deep_work_minutes", 1 if value == q["options"][0] else 0)
-    elif field == "energy":
-        update_field("energy", int(value))
-
-    # Следующий вопрос или конец
-    state["index"] += 1
-    total = get_total_questions(survey_type)
-    if state["index"] < total:
-        await send_question(user_id, survey_type, state["index"], context)
-    else:
-        del survey_state[user_id]
+    # Сохраняем в БД (тип значения определяется вариантами ответа, см. encode_answer)
+    save = partial(save_answer, q["id"], value)
+
+    # Удаляем вопрос, сохраняем ответ, отправляем следующий вопрос — параллельно
+    finished = await answer_and_advance(context, user_id, state, save, delete_ids=(query.message.message_id,))
+    if finished:
+        clear_state(user_id)
         
         # Проверяем тестовый режим (для callback)
         if user_id in test_mode:
@@ -684,13 +581,33 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             if survey_type == "morning":
                 await context.bot.send_message(user_id, "✅ Утренний опрос завершён!\n\nПереходим к вечернему опросу! 🌙")
-                survey_state[user_id] = {"type": "evening", "index": 0}
+                set_state(user_id, "survey", type="evening", index=0)
                 await send_question(user_id, "evening", 0, context)
             # Вечерний опрос уже обработан в handle_text
         else:
             await context.bot.send_message(user_id, "Опрос завершён. Спасибо!")
 
 
+
+async def on_legacy_survey_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Ответ кнопкой из сообщений, отправленных до callback_data "a:...": "<field_name>_<вариант>".
+
+    Имя поля и вариант могут содержать "_", поэтому формат разбирается по текущему вопросу опроса.
+    False — это не ответ на текущий вопрос.
+    """
+    data = update.callback_query.data or ""
+    state = get_state(update.callback_query.from_user.id)
+    if not state or state["name"] != "survey":
+        return False
+    q = get_question_data(state["type"], state["index"])
+    if not q or not q["options"] or not data.startswith(f"{q['field_name']}_"):
+        return False
+    value = data[len(q["field_name"]) + 1:]
+    if value not in q["options"]:
+        return False
+    await on_survey_answer(update, context, q["field_name"], str(q["options"].index(value)))
+    return True
+
 async def cmd_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /today — показывает ответы за сегодня."""
     if not is_allowed_user(update.effective_user.id):
@@ -726,50 +643,43 @@ async def cmd_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /week — статистика за 7 дней."""
     if not is_allowed_user(update.effective_user.id):
         return
-    stats = get_week_stats()
-    
-    episodes = stats['days_with_alcohol']
-    tasks_done = int(stats['avg_deep_work'] * stats['total_days'])
-    
-    # Финансовая бухгалтерия
-    plan = WEEKLY_ALCOHOL_BUDGET
-    fact = episodes * ALCOHOL_COST_PER_EPISODE
-    difference = plan - fact
-    
-    text = f"📊 Статистика за 7 дней:\n\n"
-    text += f"Главных задач выполнено: {tasks_done} из {stats['total_days']}\n"
-    text += f"Средняя энергия: {stats['avg_energy']}\n\n"
-    
-    text += f"📊 Алкоголь за неделю:\n"
-    text += f"План: {plan:,} ₽\n"
-    text += f"Факт: {fact:,} ₽\n"
-    text += f"Эпизодов: {episodes}\n\n"
-    
-    if difference > 0:
-        text += f"💰 Экономия: +{difference:,} ₽"
-    elif difference < 0:
-        text += f"⚠️ Перерасход: {abs(difference):,} ₽"
-    else:
-        text += "✅ По плану"
-    
-    # Добавляем статистику по целям
-    daily_goals = get_daily_goals()
-    weekly_goals = get_weekly_goals()
-    monthly_goals = get_monthly_goals()
-    
-    if daily_goals:
-        d_completed = sum(1 for g in daily_goals if g["is_completed"] == 1)
-        text += f"\n\n☀️ Задачи сегодня: {d_completed}/{len(daily_goals)}"
-    
-    if weekly_goals:
-        w_completed = sum(1 for g in weekly_goals if g["is_completed"] == 1)
-        text += f"\n📋 Цели недели: {w_completed}/{len(weekly_goals)}"
-    
-    if monthly_goals:
-        m_completed = sum(1 for g in monthly_goals if g["is_completed"] == 1)
-        text += f"\n🗓 Цели месяца: {m_completed}/{len(monthly_goals)}"
-    
+    text = render_week_report(build_week_stats())
     await update.message.reply_text(text)
+    await charts.send_chart(context.bot, update.effective_chat.id, "week")
+
+
+async def cmd_insights(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /insights — аналитика за всю историю."""
+    if not is_allowed_user(update.effective_user.id):
+        return
+    insights = await asyncio.to_thread(get_insights)
+    await update.message.reply_text(render_insights(insights))
+
+
+# Сколько результатов /search показывать
+SEARCH_RESULTS_LIMIT = 10
+SEARCH_KIND_ICONS = {"daily": "☀️", "weekly": "📋", "monthly": "🗓"}
+
+
+async def cmd_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /search <запрос> — поиск по всем целям."""
+    if not is_allowed_user(update.effective_user.id):
+        return
+    query = " ".join(context.args or [])
+    if not query:
+        await update.message.reply_text("Напиши, что искать: /search молоко")
+        return
+    found = await asyncio.to_thread(search_goals, query, SEARCH_RESULTS_LIMIT)
+    if not found["total"]:
+        await update.message.reply_text(f"🔍 По запросу «{query}» ничего не найдено.")
+        return
+    lines = [f"🔍 Найдено: {found['total']}", ""]
+    for r in found["results"]:
+        checkbox = "☑️" if r["is_completed"] == 1 else "☐"
+        lines.append(f"{SEARCH_KIND_ICONS[r['kind']]} {r['date']} {checkbox} {r['task_text']}")
+    if found["total"] > SEARCH_RESULTS_LIMIT:
+        lines += ["", f"Показаны первые {SEARCH_RESULTS_LIMIT} — уточни запрос."]
+    await update.message.reply_text("\n".join(lines))
 
 
 async def cmd_goals(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -784,20 +694,7 @@ async def cmd_goals(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("📋 Нет целей на эту неделю.\n\nЦели добавляются автоматически по понедельникам.")
         return
     
-    completed_count = sum(1 for g in goals if g["is_completed"] == 1)
-    text = f"📋 Цели на неделю ({completed_count}/{len(goals)})\n\n"
-    
-    buttons = []
-    for g in goals:
-        checkbox = "☑️" if g["is_completed"] == 1 else "☐"
-        text += f"{checkbox} {g['task_text']}\n"
-        buttons.append([InlineKeyboardButton(
-            f"{checkbox} {g['task_text'][:40]}{'...' if len(g['task_text']) > 40 else ''}",
-            callback_data=f"goal_{g['id']}"
-        )])
-    
-    keyboard = InlineKeyboardMarkup(buttons)
-    await update.message.reply_text(text, reply_markup=keyboard)
+    completed_count = await reply_checklist(update.message, "wg", goals)
     
     # Проверяем, все ли выполнены
     if completed_count == len(goals) and completed_count > 0:
@@ -816,20 +713,7 @@ async def cmd_month_goals(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("🗓 Нет целей на этот месяц.\n\nЦели добавляются автоматически первого числа месяца.")
         return
     
-    completed_count = sum(1 for g in goals if g["is_completed"] == 1)
-    text = f"🗓 Цели на месяц ({completed_count}/{len(goals)})\n\n"
-    
-    buttons = []
-    for g in goals:
-        checkbox = "☑️" if g["is_completed"] == 1 else "☐"
-        text += f"{checkbox} {g['task_text']}\n"
-        buttons.append([InlineKeyboardButton(
-            f"{checkbox} {g['task_text'][:40]}{'...' if len(g['task_text']) > 40 else ''}",
-            callback_data=f"mgoal_{g['id']}"
-        )])
-    
-    keyboard = InlineKeyboardMarkup(buttons)
-    await update.message.reply_text(text, reply_markup=keyboard)
+    completed_count = await reply_checklist(update.message, "mg", goals)
     
     # Проверяем, все ли выполнены
     if completed_count == len(goals) and completed_count > 0:
@@ -848,20 +732,7 @@ async def cmd_today_goals(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("☀️ Нет задач на сегодня.\n\nЗадачи добавляются каждое утро.")
         return
     
-    completed_count = sum(1 for g in goals if g["is_completed"] == 1)
-    text = f"☀️ Задачи на сегодня ({completed_count}/{len(goals)})\n\n"
-    
-    buttons = []
-    for g in goals:
-        checkbox = "☑️" if g["is_completed"] == 1 else "☐"
-        text += f"{checkbox} {g['task_text']}\n"
-        buttons.append([InlineKeyboardButton(
-            f"{checkbox} {g['task_text'][:40]}{'...' if len(g['task_text']) > 40 else ''}",
-            callback_data=f"dgoal_{g['id']}"
-        )])
-    
-    keyboard = InlineKeyboardMarkup(buttons)
-    await update.message.reply_text(text, reply_markup=keyboard)
+    completed_count = await reply_checklist(update.message, "dg", goals)
     
     # Проверяем, все ли выполнены
     if completed_count == len(goals) and completed_count > 0:
@@ -926,7 +797,7 @@ async def start_onboarding(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     # Начинаем с дневных целей
-    daily_goals_input[user_id] = True
+    set_state(user_id, "daily_goals")
     await update.message.reply_text(
         "☀️ **Задачи на сегодня**\n\n"
         "Какие задачи ты хочешь выполнить сегодня?\n\n"
@@ -950,7 +821,7 @@ async def continue_onboarding_weekly(update: Update, context: ContextTypes.DEFAU
             parse_mode="Markdown"
         )
         # Цели будут добавлены на следующий понедельник
-        weekly_goals_input[user_id] = True
+        set_state(user_id, "weekly_goals")
     else:  # Пн-Чт
         await update.message.reply_text(
             "📋 **Цели на неделю**\n\n"
@@ -958,7 +829,7 @@ async def continue_onboarding_weekly(update: Update, context: ContextTypes.DEFAU
             "Напиши список (каждая с новой строки):",
             parse_mode="Markdown"
         )
-        weekly_goals_input[user_id] = True
+        set_state(user_id, "weekly_goals")
 
 
 async def continue_onboarding_monthly(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -987,7 +858,7 @@ async def continue_onboarding_monthly(update: Update, context: ContextTypes.DEFA
             "Напиши список (каждая с новой строки):",
             parse_mode="Markdown"
         )
-        monthly_goals_input[user_id] = True
+        set_state(user_id, "monthly_goals")
     else:
         await update.message.reply_text(
             "🗓 **Цели на месяц**\n\n"
@@ -995,7 +866,7 @@ async def continue_onboarding_monthly(update: Update, context: ContextTypes.DEFA
             "Напиши список (каждая с новой строки):",
             parse_mode="Markdown"
         )
-        monthly_goals_input[user_id] = True
+        set_state(user_id, "monthly_goals")
 
 
 async def show_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1024,11 +895,25 @@ async def show_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     text += f"\n📈 Энергия за неделю: {stats['avg_energy']}\n"
     
+    # Серии по привычкам (текущая / лучшая)
+    sober = get_habit_stats("sober")
+    walk = get_habit_stats("walk")
+    goals_done = get_habit_stats("goals_done")
+    text += (
+        f"\n🔥 Серии (сейчас / рекорд):\n"
+        f"Без алкоголя: {sober['current_streak']} / {sober['longest_streak']}\n"
+        f"Прогулки: {walk['current_streak']} / {walk['longest_streak']}\n"
+        f"Все задачи дня: {goals_done['current_streak']} / {goals_done['longest_streak']}\n"
+    )
+    
     text += "\n**Команды:**\n"
     text += "/today_goals — задачи на сегодня\n"
     text += "/goals — цели на неделю\n"
     text += "/month_goals — цели на месяц\n"
     text += "/week — полная статистика\n"
+    text += "/insights — аналитика за всю историю\n"
+    text += "/search — поиск по целям\n"
+    text += "/templates — повторяющиеся цели\n"
     text += "/reset — сбросить все данные"
     
     # Кнопка Mini App
@@ -1050,8 +935,8 @@ async def cmd_reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Подтверждение
     keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("✅ Да, сбросить всё", callback_data="confirm_reset")],
-        [InlineKeyboardButton("❌ Отмена", callback_data="cancel_reset")]
+        [InlineKeyboardButton("✅ Да, сбросить всё", callback_data=encode_callback("rs"))],
+        [InlineKeyboardButton("❌ Отмена", callback_data=encode_callback("rc"))]
     ])
     
     await update.message.reply_text(
@@ -1148,72 +1033,22 @@ async def cmd_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 5. Воскресная сводка
     await asyncio.sleep(0.3)
     
-    stats = get_week_stats()
-    days_with = stats['days_with_alcohol']
-    tasks_done = int(stats['avg_deep_work'] * stats['total_days'])
-    
-    # Финансовая бухгалтерия
-    plan = WEEKLY_ALCOHOL_BUDGET
-    fact = episodes * ALCOHOL_COST_PER_EPISODE
-    difference = plan - fact
-    
-    text = f"📊 Недельная сводка\n\n"
-    text += f"Главных задач выполнено: {tasks_done} из {stats['total_days']}\n"
-    text += f"Средняя энергия: {stats['avg_energy']}\n\n"
-    
-    text += f"📊 Алкоголь за неделю:\n"
-    text += f"План: {plan:,} ₽\n"
-    text += f"Факт: {fact:,} ₽\n"
-    text += f"Эпизодов: {episodes}\n\n"
-    
-    if difference > 0:
-        text += f"💰 Экономия: +{difference:,} ₽"
-    elif difference < 0:
-        text += f"⚠️ Перерасход: {abs(difference):,} ₽"
-    else:
-        text += "✅ По плану"
-    
-    await context.bot.send_message(user_id, text)
+    stats = build_week_stats()
+    await context.bot.send_message(user_id, render_week_report(stats, WEEKLY_SUMMARY_TITLE, with_goals=False))
     
     await asyncio.sleep(0.5)
     
     # 6. Команда /week (показываем то же самое)
     await asyncio.sleep(0.3)
     
-    text = f"📊 Статистика за 7 дней:\n\n"
-    text += f"Главных задач выполнено: {tasks_done} из {stats['total_days']}\n"
-    text += f"Средняя энергия: {stats['avg_energy']}\n\n"
-    
-    text += f"📊 Алкоголь за неделю:\n"
-    text += f"План: {plan:,} ₽\n"
-    text += f"Факт: {fact:,} ₽\n"
-    text += f"Эпизодов: {episodes}\n\n"
-    
-    if difference > 0:
-        text += f"💰 Экономия: +{difference:,} ₽"
-    elif difference < 0:
-        text += f"⚠️ Перерасход: {abs(difference):,} ₽"
-    else:
-        text += "✅ По плану"
-    
-    await context.bot.send_message(user_id, text)
+    await context.bot.send_message(user_id, render_week_report(stats))
     
     await asyncio.sleep(0.5)
     
     # 7. Настройка вопросов
     await asyncio.sleep(0.3)
     
-    questions = get_all_questions_numbered()
-    text = "📝 Настройка вопросов\n\n🌅 — утренние\n🌙 — вечерние\n\n"
-    buttons = []
-    
-    for i, q in enumerate(questions, 1):
-        survey = "🌅" if q["survey_type"] == "morning" else "🌙"
-        q_text = q['text'][:30] + "..." if len(q['text']) > 30 else q['text']
-        text += f"{i}. {survey} {q['text']}\n"
-        buttons.append([InlineKeyboardButton(f"✏️ {i}. {q_text}", callback_data=f"editq_{q['id']}")])
-    
-    keyboard = InlineKeyboardMarkup(buttons)
+    text, keyboard = render_questions_menu()
     await context.bot.send_message(user_id, text, reply_markup=keyboard)
     
     await asyncio.sleep(0.5)
@@ -1224,87 +1059,97 @@ async def cmd_questions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /questions — список вопросов с кнопками редактирования."""
     if not is_allowed_user(update.effective_user.id):
         return
+    text, keyboard = render_questions_menu()
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+
+def render_questions_menu():
+    """Текст и клавиатура списка вопросов для /questions."""
     questions = get_all_questions_numbered()
-    
-    text = "📝 Настройка вопросов\n\n"
-    text += "🌅 — утренние\n🌙 — вечерние\n\n"
-    
+    lines = ["📝 Настройка вопросов", "", "🌅 — утренние", "🌙 — вечерние", ""]
     buttons = []
     for i, q in enumerate(questions, 1):
         survey = "🌅" if q["survey_type"] == "morning" else "🌙"
         q_text = q['text'][:30] + "..." if len(q['text']) > 30 else q['text']
-        text += f"{i}. {survey} {q['text']}\n"
-        buttons.append([InlineKeyboardButton(f"✏️ {i}. {q_text}", callback_data=f"editq_{q['id']}")])
-    
-    keyboard = InlineKeyboardMarkup(buttons)
-    await update.message.reply_text(text, reply_markup=keyboard)
+        lines.append(f"{i}. {survey} {q['text']}")
+        buttons.append([InlineKeyboardButton(f"✏️ {i}. {q_text}", callback_data=encode_callback("eq", q["id"]))])
+    buttons.append([
+        InlineKeyboardButton("➕ Утренний", callback_data=encode_callback("nq", "morning")),
+        InlineKeyboardButton("➕ Вечерний", callback_data=encode_callback("nq", "evening")),
+    ])
+    return "\n".join(lines) + "\n", InlineKeyboardMarkup(buttons)
 
 
-async def handle_edit_question_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка нажатия кнопки редактирования вопроса."""
+@router.callback("eq", "editq")
+async def on_edit_question(update: Update, context: ContextTypes.DEFAULT_TYPE, question_id: str):
+    """Меню редактирования вопроса."""
     query = update.callback_query
     await query.answer()
-    
-    if not is_allowed_user(query.from_user.id):
+    q_id = int(question_id)
+    questions = get_all_questions_numbered()
+    q = next((q for q in questions if q["id"] == q_id), None)
+    if not q:
+        await query.message.edit_text("❌ Вопрос не найден")
         return
     
-    data = query.data
-    
-    if data.startswith("editq_"):
-        # Показать меню редактирования вопроса
-        q_id = int(data.split("_")[1])
-        questions = get_all_questions_numbered()
-        q = next((q for q in questions if q["id"] == q_id), None)
-        if not q:
-            await query.message.edit_text("❌ Вопрос не найден")
-            return
-        
-        text = f"Редактирование вопроса:\n\n{q['text']}"
-        if q["options"]:
-            text += f"\n\nВарианты: {q['options']}"
-        
-        buttons = [[InlineKeyboardButton("📝 Изменить текст", callback_data=f"edittext_{q_id}")]]
-        if q["options"]:
-            buttons.append([InlineKeyboardButton("🔘 Изменить варианты", callback_data=f"editopts_{q_id}")])
-        buttons.append([InlineKeyboardButton("◀️ Назад", callback_data="back_to_questions")])
-        
-        keyboard = InlineKeyboardMarkup(buttons)
-        await query.message.edit_text(text, reply_markup=keyboard)
-    
-    elif data.startswith("edittext_"):
-        # Начать редактирование текста
-        q_id = int(data.split("_")[1])
-        edit_mode[query.from_user.id] = {"action": "edit_text", "question_id": q_id}
-        await query.message.edit_text(
-            "✏️ Введи новый текст вопроса:\n\n"
-            "(отправь любое сообщение, и оно станет новым текстом вопроса)"
-        )
+    text = f"Редактирование вопроса:\n\n{q['text']}"
+    if q["options"]:
+        text += f"\n\nВарианты: {q['options']}"
     
-    elif data.startswith("editopts_"):
-        # Начать редактирование вариантов
-        q_id = int(data.split("_")[1])
-        edit_mode[query.from_user.id] = {"action": "edit_opts", "question_id": q_id}
-        await query.message.edit_text(
-            "🔘 Введи варианты ответа через запятую:\n\n"
-            "Например: Да,Нет\n"
-            "Или: 1,2,3,4,5,6,7,8,9,10"
-        )
+    buttons = [[InlineKeyboardButton("📝 Изменить текст", callback_data=encode_callback("et", q_id))]]
+    if q["options"]:
+        buttons.append([InlineKeyboardButton("🔘 Изменить варианты", callback_data=encode_callback("eo", q_id))])
+    buttons.append([InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("bq"))])
     
-    elif data == "back_to_questions":
-        # Вернуться к списку вопросов
-        questions = get_all_questions_numbered()
-        text = "📝 Настройка вопросов\n\n"
-        text += "🌅 — утренние\n🌙 — вечерние\n\n"
-        
-        buttons = []
-        for i, q in enumerate(questions, 1):
-            survey = "🌅" if q["survey_type"] == "morning" else "🌙"
-            q_text = q['text'][:30] + "..." if len(q['text']) > 30 else q['text']
-            text += f"{i}. {survey} {q['text']}\n"
-            buttons.append([InlineKeyboardButton(f"✏️ {i}. {q_text}", callback_data=f"editq_{q['id']}")])
-        
-        keyboard = InlineKeyboardMarkup(buttons)
-        await query.message.edit_text(text, reply_markup=keyboard)
+    keyboard = InlineKeyboardMarkup(buttons)
+    await query.message.edit_text(text, reply_markup=keyboard)
+
+
+@router.callback("et", "edittext")
+async def on_edit_question_text_start(update: Update, context: ContextTypes.DEFAULT_TYPE, question_id: str):
+    """Начать редактирование текста вопроса."""
+    query = update.callback_query
+    await query.answer()
+    set_state(query.from_user.id, "edit_question", action="edit_text", question_id=int(question_id))
+    await query.message.edit_text(
+        "✏️ Введи новый текст вопроса:\n\n"
+        "(отправь любое сообщение, и оно станет новым текстом вопроса)"
+    )
+
+
+@router.callback("eo", "editopts")
+async def on_edit_question_options_start(update: Update, context: ContextTypes.DEFAULT_TYPE, question_id: str):
+    """Начать редактирование вариантов ответа."""
+    query = update.callback_query
+    await query.answer()
+    set_state(query.from_user.id, "edit_question", action="edit_opts", question_id=int(question_id))
+    await query.message.edit_text(
+        "🔘 Введи варианты ответа через запятую:\n\n"
+        "Например: Да,Нет\n"
+        "Или: 1,2,3,4,5,6,7,8,9,10"
+    )
+
+
+@router.callback("nq")
+async def on_new_question_start(update: Update, context: ContextTypes.DEFAULT_TYPE, survey_type: str):
+    """Начать добавление вопроса в утренний или вечерний опрос."""
+    query = update.callback_query
+    await query.answer()
+    set_state(query.from_user.id, "new_question", survey_type=survey_type)
+    await query.message.edit_text(
+        "➕ Введи текст нового вопроса.\n\n"
+        "Если нужны кнопки — на второй строке варианты через запятую:\n"
+        "Например:\nМедитировал сегодня?\nДа,Нет"
+    )
+
+
+@router.callback("bq", "back_to_questions")
+async def on_back_to_questions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Вернуться к списку вопросов."""
+    query = update.callback_query
+    await query.answer()
+    text, keyboard = render_questions_menu()
+    await query.message.edit_text(text, reply_markup=keyboard)
 
 
 async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1328,7 +1173,8 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 
 async def post_init(application):
-    """Настройка кнопки Mini App при запуске."""
+    """Настройка кнопки Mini App и монитор задержки цикла событий (для /readyz) при запуске."""
+    health.start_loop_monitor()
     if WEBAPP_URL and BOT_USERNAME:
         app_url = f"{WEBAPP_URL.rstrip('/')}?bot={BOT_USERNAME}"
         await application.bot.set_chat_menu_button(
@@ -1337,6 +1183,11 @@ async def post_init(application):
         logger.info("Mini App menu button configured")
 
 
+async def post_shutdown(application):
+    """Остановка процессов рисования графиков."""
+    charts.shutdown()
+
+
 def main():
     """Запуск бота и API в одном процессе."""
     import threading
@@ -1348,6 +1199,7 @@ def main():
         raise ValueError("Укажите ALLOWED_USER_ID в .env (ваш Telegram ID)")
 
     init_db()
+    health.STATS_PROVIDERS["routes"] = router.route_stats
 
     # Запуск API в фоновом потоке (все логи в одном терминале)
     try:
@@ -1361,11 +1213,22 @@ def main():
         else:
             raise
 
-    app = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
+    # Апдейты разных пользователей — параллельно, одного пользователя — по очереди
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("today", cmd_today))
     app.add_handler(CommandHandler("week", cmd_week))
+    app.add_handler(CommandHandler("insights", cmd_insights))
+    app.add_handler(CommandHandler("search", cmd_search))
+    app.add_handler(CommandHandler("templates", cmd_templates))
     app.add_handler(CommandHandler("today_goals", cmd_today_goals))
     app.add_handler(CommandHandler("goals", cmd_goals))
     app.add_handler(CommandHandler("month_goals", cmd_month_goals))
@@ -1377,7 +1240,10 @@ def main():
     app.add_handler(CallbackQueryHandler(handle_callback))
 
     # Планировщик опросов и напоминаний
-    setup_jobs(app.job_queue, morning_survey, evening_survey, weekly_summary, friday_reminder, end_of_month_check)
+    setup_jobs(
+        app.job_queue, morning_survey, evening_survey, weekly_summary, friday_reminder, end_of_month_check,
+        precompute_reports_job, goal_rollover,
+    )
 
     app.run_polling(allowed_updates=Update.ALL_TYPES)
 
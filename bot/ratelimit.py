@@ -0,0 +1,107 @@
+"""
+Ограничение нагрузки на API: token bucket на клиента и класс маршрута, очередь допуска записей.
+
+SQLite пишет один писатель за раз, и бот (опросы, чек-листы) пишет в ту же БД. Поэтому
+записи из API допускаются по WRITE_CONCURRENCY одновременно, остальные ждут в короткой
+очереди; переполненная очередь или пустой bucket — сразу 429 с Retry-After,
+а не «database is locked» через несколько секунд ожидания блокировки.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Маршруты без ограничений: проверки здоровья не должны получать 429 под нагрузкой
+UNLIMITED_ENDPOINTS = ("healthz", "readyz")
+
+# Классы маршрутов: {класс: (запас запросов, пополнение в секунду)}
+RATE_LIMITS = {
+    "read": (120, 20.0),
+    "write": (30, 5.0),
+    "stream": (5, 0.2),   # переподключения /api/events
+}
+# Сколько bucket'ов помнить (дольше всех не обращавшиеся вытесняются — и начинают с полного запаса)
+MAX_BUCKETS = 10000
+
+# Одновременных записей из API, ожидающих в очереди и сколько ждать места (сек)
+WRITE_CONCURRENCY = 1
+WRITE_QUEUE = 16
+WRITE_WAIT_SECONDS = 3.0
+# Retry-After при переполненной очереди записей (сек)
+WRITE_RETRY_AFTER = 1
+
+_lock = threading.Lock()
+# {(клиент, класс): [токены, время последнего обновления]}
+_buckets = OrderedDict()
+
+
+def route_class(method: str, endpoint):
+    """Класс маршрута для ограничения или None (preflight CORS и проверки здоровья не ограничиваются)."""
+    if method == "OPTIONS" or endpoint in UNLIMITED_ENDPOINTS:
+        return None
+    if endpoint == "events_api":
+        return "stream"
+    if method in ("GET", "HEAD"):
+        return "read"
+    return "write"
+
+
+def take(client: str, kind: str) -> float:
+    """Берёт токен из bucket'а клиента. 0 — можно; иначе — через сколько секунд появится токен."""
+    burst, rate = RATE_LIMITS[kind]
+    key = (client, kind)
+    now = time.monotonic()
+    with _lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = [burst, now]
+            if len(_buckets) > MAX_BUCKETS:
+                _buckets.popitem(last=False)
+        else:
+            _buckets.move_to_end(key)
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / rate
+
+
+class AdmissionGate:
+    """Не больше limit одновременных владельцев; остальные ждут до timeout в очереди длиной max_waiting."""
+
+    def __init__(self, limit: int, max_waiting: int, timeout: float):
+        self._limit = limit
+        self._max_waiting = max_waiting
+        self._timeout = timeout
+        self._active = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> bool:
+        """True — допущен (потом обязательно release), False — очередь полна или не дождался."""
+        with self._cond:
+            if self._active < self._limit:
+                self._active += 1
+                return True
+            if self._waiting >= self._max_waiting:
+                return False
+            self._waiting += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self._active < self._limit, self._timeout)
+            finally:
+                self._waiting -= 1
+            if admitted:
+                self._active += 1
+            return admitted
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        return {"active": self._active, "waiting": self._waiting, "limit": self._limit}
+
+
+write_gate = AdmissionGate(WRITE_CONCURRENCY, WRITE_QUEUE, WRITE_WAIT_SECONDS)
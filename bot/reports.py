@@ -0,0 +1,225 @@
+"""
+Отчёты: сбор статистики в словарь и отрисовка по заранее разобранным шаблонам.
+Одна реализация для бота (/week, воскресная сводка) и для API Mini App.
+
+Плановые отчёты (воскресная сводка, итоги месяца) собираются заранее в таблицу
+reports (precompute_reports), а в момент отправки только читаются.
+"""
+import logging
+from string import Formatter
+
+from .config import ALCOHOL_COST_PER_EPISODE, WEEKLY_ALCOHOL_BUDGET, ALLOWED_USER_ID
+from .database import (
+    get_week_stats, get_daily_goals, get_weekly_goals, get_monthly_goals,
+    get_data_version, save_report, get_report, get_monday_of_week, get_first_day_of_month, to_day,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Template:
+    """Шаблон в синтаксисе str.format, разобранный один раз при создании."""
+
+    def __init__(self, source: str):
+        self._parts = [
+            (literal, field, spec)
+            for literal, field, spec, _ in Formatter().parse(source)
+        ]
+
+    def render(self, values: dict) -> str:
+        out = []
+        for literal, field, spec in self._parts:
+            out.append(literal)
+            if field is not None:
+                out.append(format(values[field], spec))
+        return "".join(out)
+
+
+WEEK_REPORT = Template(
+    "{title}\n\n"
+    "Главных задач выполнено: {tasks_done} из {total_days}\n"
+    "Средняя энергия: {avg_energy}\n\n"
+    "📊 Алкоголь за неделю:\n"
+    "План: {plan:,} ₽\n"
+    "Факт: {fact:,} ₽\n"
+    "Эпизодов: {episodes}\n\n"
+    "{balance}{goals}"
+)
+SAVED = Template("💰 Экономия: +{difference:,} ₽")
+OVERSPENT = Template("⚠️ Перерасход: {overspent:,} ₽")
+ON_BUDGET = "✅ По плану"
+
+# (ключ, шаблон строки) — строка выводится, только если целей этого типа больше нуля
+GOAL_LINES = (
+    ("daily", Template("☀️ Задачи сегодня: {completed}/{total}")),
+    ("weekly", Template("📋 Цели недели: {completed}/{total}")),
+    ("monthly", Template("🗓 Цели месяца: {completed}/{total}")),
+)
+
+WEEK_TITLE = "📊 Статистика за 7 дней:"
+WEEKLY_SUMMARY_TITLE = "📊 Недельная сводка"
+
+
+def goal_progress() -> dict:
+    """Выполнено/всего по дневным, недельным и месячным целям."""
+    result = {}
+    for kind, goals in (("daily", get_daily_goals()), ("weekly", get_weekly_goals()), ("monthly", get_monthly_goals())):
+        result[kind] = {
+            "completed": sum(1 for g in goals if g["is_completed"] == 1),
+            "total": len(goals),
+        }
+    return result
+
+
+def build_week_stats() -> dict:
+    """Статистика за 7 дней с финансами по алкоголю и прогрессом по целям."""
+    stats = get_week_stats()
+    episodes = stats["days_with_alcohol"]
+    fact = episodes * ALCOHOL_COST_PER_EPISODE
+    stats.update({
+        "episodes": episodes,
+        "tasks_done": int(stats["avg_deep_work"] * stats["total_days"]),
+        "plan": WEEKLY_ALCOHOL_BUDGET,
+        "fact": fact,
+        "difference": WEEKLY_ALCOHOL_BUDGET - fact,
+        "goals": goal_progress(),
+    })
+    return stats
+
+
+def render_week_report(stats: dict, title: str = WEEK_TITLE, with_goals: bool = True) -> str:
+    """Текст недельного отчёта из словаря build_week_stats().
+
+    with_goals=False — без строк прогресса целей (воскресная сводка, как была до общего шаблона).
+    """
+    difference = stats["difference"]
+    if difference > 0:
+        balance = SAVED.render(stats)
+    elif difference < 0:
+        balance = OVERSPENT.render({"overspent": -difference})
+    else:
+        balance = ON_BUDGET
+
+    goal_lines = [
+        line.render(stats["goals"][kind])
+        for kind, line in GOAL_LINES
+        if with_goals and stats["goals"][kind]["total"]
+    ]
+    goals = "\n\n" + "\n".join(goal_lines) if goal_lines else ""
+    return WEEK_REPORT.render({**stats, "title": title, "balance": balance, "goals": goals})
+
+
+INSIGHTS_TITLE = "🔎 Аналитика за всю историю"
+# Подписи метрик и корреляций для /insights
+METRIC_LABELS = {
+    "energy": "Энергия",
+    "walk": "Прогулки",
+    "alcohol": "Алкоголь",
+    "goals": "Задачи дня",
+}
+ROLLING_LINE = Template("{label}: {7} · {30} · {90} · {365}")
+TREND_LINE = Template("📈 Тренд энергии: {ewma} ({change})")
+CORRELATION_LINE = Template("{a} ↔ {b}: {value:+.2f}")
+
+
+def _fmt(value, percent=False) -> str:
+    if value is None:
+        return "—"
+    return f"{round(value * 100)}%" if percent else f"{value:g}"
+
+
+def render_insights(insights: dict) -> str:
+    """Текст /insights из словаря analytics.get_insights()."""
+    if not insights["days"]:
+        return f"{INSIGHTS_TITLE}\n\nПока нет данных."
+    lines = [INSIGHTS_TITLE, f"Дней с данными: {insights['days']} (с {insights['first_date']})", ""]
+    lines.append("Средние за 7 · 30 · 90 · 365 дней:")
+    for metric, label in METRIC_LABELS.items():
+        # Привычки да/нет и задачи — доля дней, показываем в процентах
+        percent = metric != "energy"
+        values = {window: _fmt(v, percent) for window, v in insights["rolling"][metric].items()}
+        lines.append(ROLLING_LINE.render({"label": label, **values}))
+
+    trend = insights["energy_trend"]
+    if trend["ewma"] is not None:
+        change = trend["change_7d"]
+        lines += ["", TREND_LINE.render({
+            "ewma": _fmt(trend["ewma"]),
+            "change": "за неделю " + ("—" if change is None else f"{change:+g}"),
+        })]
+
+    correlations = [
+        CORRELATION_LINE.render({"a": METRIC_LABELS[a], "b": METRIC_LABELS[b], "value": value})
+        for pair, value in insights["correlations"].items()
+        if value is not None
+        for a, b in [pair.split("~")]
+    ]
+    if correlations:
+        lines += ["", "Связи (корреляция от -1 до 1):", *correlations]
+    return "\n".join(lines)
+
+
+def build_month_end_payload() -> dict:
+    """Итоги месяца: текст и нужна ли кнопка переноса. text = None, если целей на месяц нет."""
+    goals = get_monthly_goals()
+    if not goals:
+        return {"text": None, "has_incomplete": False}
+    completed = [g for g in goals if g["is_completed"] == 1]
+    incomplete = [g for g in goals if g["is_completed"] == 0]
+
+    if not incomplete:
+        # Все задачи выполнены
+        text = "🔥 РЕСПЕКТ! 🔥\n\n"
+        text += f"Все {len(goals)} месячных целей выполнены!\n\n"
+        text += "Отличный месяц! 🎉"
+    else:
+        text = "📊 Итоги месяца:\n\n"
+        text += f"✅ Выполнено: {len(completed)} из {len(goals)}\n"
+        text += f"⏳ Осталось: {len(incomplete)}\n\n"
+        text += "Невыполненные задачи:\n"
+        for g in incomplete:
+            text += f"• {g['task_text']}\n"
+    return {"text": text, "has_incomplete": bool(incomplete)}
+
+
+def build_weekly_summary_payload() -> dict:
+    """Воскресная сводка: статистика и готовый текст."""
+    stats = build_week_stats()
+    return {"stats": stats, "text": render_week_report(stats, WEEKLY_SUMMARY_TITLE, with_goals=False)}
+
+
+# Плановые отчёты: {kind: (начало текущего периода, сборка payload)}
+SCHEDULED_REPORTS = {
+    "week": (lambda: to_day(get_monday_of_week()), build_weekly_summary_payload),
+    "month": (lambda: to_day(get_first_day_of_month()), build_month_end_payload),
+}
+
+
+def precompute_reports(kinds=tuple(SCHEDULED_REPORTS), user_id: int = ALLOWED_USER_ID) -> int:
+    """Собирает отчёты заранее; пересобирает только те, чьи данные изменились. Возвращает число собранных."""
+    built = 0
+    for kind in kinds:
+        period_start, build = SCHEDULED_REPORTS[kind]
+        period = period_start()
+        # Версия читается до сборки: запись во время сборки сделает отчёт устаревшим, а не потерянным
+        version = get_data_version()
+        stored = get_report(kind, period, user_id)
+        if stored is not None and stored[0] == version:
+            continue
+        save_report(kind, period, version, build(), user_id)
+        built += 1
+    return built
+
+
+def load_report(kind: str, user_id: int = ALLOWED_USER_ID) -> dict:
+    """Готовый отчёт текущего периода. Если его нет или данные с тех пор изменились — собирает сейчас."""
+    period_start, build = SCHEDULED_REPORTS[kind]
+    period = period_start()
+    version = get_data_version()
+    stored = get_report(kind, period, user_id)
+    if stored is not None and stored[0] == version:
+        return stored[1]
+    logger.info("report %s for %s is stale, building at send time", kind, user_id)
+    payload = build()
+    save_report(kind, period, version, payload, user_id)
+    return payload
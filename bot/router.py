@@ -0,0 +1,125 @@
+"""
+Маршрутизация апдейтов по таблицам.
+
+Текст направляется по состоянию диалога пользователя, нажатие кнопки — по префиксу
+callback_data. Обе таблицы — словари, поэтому выбор обработчика не зависит от числа
+маршрутов. callback_data кодируется компактно: "префикс:арг1:арг2" (лимит Telegram — 64 байта).
+"""
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_SEP = ":"
+
+# Состояние диалога: {user_id: {"name": "survey"|"daily_goals"|..., ...данные состояния}}
+conversations = {}
+
+
+def get_state(user_id: int):
+    """Текущее состояние диалога пользователя (или None)."""
+    return conversations.get(user_id)
+
+
+def set_state(user_id: int, name: str, **data):
+    """Переводит диалог в состояние name. Предыдущее состояние заменяется."""
+    state = {"name": name, **data}
+    conversations[user_id] = state
+    return state
+
+
+def clear_state(user_id: int):
+    """Завершает диалог пользователя."""
+    conversations.pop(user_id, None)
+
+
+def encode_callback(prefix: str, *args) -> str:
+    """Кодирует callback_data: encode_callback("dg", 12) -> "dg:12"."""
+    return CALLBACK_SEP.join((prefix, *map(str, args)))
+
+
+class Router:
+    """Таблицы маршрутов (состояние → обработчик текста, префикс → обработчик кнопки)
+    и статистика времени выполнения по каждому маршруту."""
+
+    def __init__(self):
+        self._text_routes = {}
+        self._callback_routes = {}
+        # Старый формат callback_data ("dgoal_12", "move_goals") → новый префикс
+        self._legacy = {}
+        # {маршрут: [вызовов, суммарное время, максимум]}
+        self.timings = {}
+
+    def text(self, state_name: str):
+        """Декоратор: обработчик текста в состоянии state_name. Сигнатура (update, context, state)."""
+        def decorator(handler):
+            self._text_routes[state_name] = handler
+            return handler
+        return decorator
+
+    def callback(self, prefix: str, *legacy):
+        """Декоратор: обработчик кнопки с префиксом prefix. Сигнатура (update, context, *args).
+        legacy — префиксы или целые значения callback_data в старом формате."""
+        def decorator(handler):
+            self.add_callback(prefix, handler, legacy)
+            return handler
+        return decorator
+
+    def add_callback(self, prefix: str, handler, legacy=()):
+        self._callback_routes[prefix] = handler
+        for old in legacy:
+            self._legacy[old] = prefix
+
+    def parse_callback(self, data: str) -> tuple:
+        """Разбирает callback_data один раз: "dg:12" -> ("dg", ["12"]), "dgoal_12" -> ("dg", ["12"])."""
+        if CALLBACK_SEP in data:
+            prefix, *args = data.split(CALLBACK_SEP)
+            return prefix, args
+        if data in self._legacy:
+            return self._legacy[data], []
+        old_prefix, _, arg = data.partition("_")
+        if old_prefix in self._legacy:
+            return self._legacy[old_prefix], [arg]
+        return data, []
+
+    async def dispatch_text(self, update, context, state) -> bool:
+        """Вызывает обработчик текста для состояния. False — подходящего маршрута нет."""
+        if state is None:
+            return False
+        handler = self._text_routes.get(state["name"])
+        if handler is None:
+            return False
+        await self._timed(f"text:{state['name']}", handler(update, context, state))
+        return True
+
+    async def dispatch_callback(self, update, context) -> bool:
+        """Вызывает обработчик кнопки по префиксу. False — подходящего маршрута нет."""
+        prefix, args = self.parse_callback(update.callback_query.data or "")
+        handler = self._callback_routes.get(prefix)
+        if handler is None:
+            return False
+        await self._timed(f"callback:{prefix}", handler(update, context, *args))
+        return True
+
+    async def _timed(self, route: str, coroutine):
+        started = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self.timings.setdefault(route, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            logger.debug("route %s: %.1f ms", route, elapsed * 1000)
+
+    def route_stats(self) -> dict:
+        """Статистика по маршрутам: вызовы, среднее и максимальное время (мс)."""
+        return {
+            route: {
+                "calls": calls,
+                "avg_ms": round(total / calls * 1000, 2),
+                "max_ms": round(worst * 1000, 2),
+            }
+            for route, (calls, total, worst) in self.timings.items()
+        }
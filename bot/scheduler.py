@@ -1,7 +1,7 @@
 """
 Настройка расписания опросов через JobQueue.
 """
-from datetime import time
+from datetime import datetime, time, timedelta
 
 import pytz
 
@@ -17,16 +17,30 @@ from .config import (
     FRIDAY_REMINDER_MINUTE,
     END_OF_MONTH_CHECK_HOUR,
     END_OF_MONTH_CHECK_MINUTE,
+    REPORTS_PRECOMPUTE_HOUR,
+    REPORTS_PRECOMPUTE_MINUTE,
+    REPORTS_REFRESH_MINUTES_BEFORE,
+    GOAL_ROLLOVER_HOUR,
+    GOAL_ROLLOVER_MINUTE,
 )
 
 
-def setup_jobs(job_queue, morning_callback, evening_callback, weekly_summary_callback, friday_reminder_callback, end_of_month_callback):
+def _minutes_before(hour: int, minute: int, minutes: int, tz):
+    """Время за minutes минут до hour:minute (в пределах суток)."""
+    moment = datetime(2000, 1, 2, hour, minute) - timedelta(minutes=minutes)
+    return time(moment.hour, moment.minute, tzinfo=tz)
+
+
+def setup_jobs(job_queue, morning_callback, evening_callback, weekly_summary_callback, friday_reminder_callback, end_of_month_callback, precompute_callback, rollover_callback):
     """
     Добавляет опросы и напоминания в планировщик.
     job_queue — app.job_queue из python-telegram-bot.
     """
     tz = pytz.timezone(TIMEZONE)
     
+    # Цели из шаблонов на новый день (неделю, месяц) — до утреннего опроса
+    job_queue.run_daily(rollover_callback, time=time(GOAL_ROLLOVER_HOUR, GOAL_ROLLOVER_MINUTE, tzinfo=tz))
+    
     # Ежедневные опросы
     job_queue.run_daily(morning_callback, time=time(MORNING_HOUR, MORNING_MINUTE, tzinfo=tz))
     job_queue.run_daily(evening_callback, time=time(EVENING_HOUR, EVENING_MINUTE, tzinfo=tz))
@@ -50,3 +64,15 @@ def setup_jobs(job_queue, morning_callback, evening_callback, weekly_summary_cal
         end_of_month_callback,
         time=time(END_OF_MONTH_CHECK_HOUR, END_OF_MONTH_CHECK_MINUTE, tzinfo=tz)
     )
+    
+    # Сборка отчётов заранее: ночью и незадолго до отправки (пересобираются только изменившиеся)
+    job_queue.run_daily(precompute_callback, time=time(REPORTS_PRECOMPUTE_HOUR, REPORTS_PRECOMPUTE_MINUTE, tzinfo=tz))
+    job_queue.run_daily(
+        precompute_callback,
+        time=_minutes_before(WEEKLY_SUMMARY_HOUR, WEEKLY_SUMMARY_MINUTE, REPORTS_REFRESH_MINUTES_BEFORE, tz),
+        days=(0,)
+    )
+    job_queue.run_daily(
+        precompute_callback,
+        time=_minutes_before(END_OF_MONTH_CHECK_HOUR, END_OF_MONTH_CHECK_MINUTE, REPORTS_REFRESH_MINUTES_BEFORE, tz)
+    )
@@ -0,0 +1,138 @@
+"""
+Сериализация и сжатие ответов API.
+
+JSON кодируется через orjson, если он установлен, иначе — стандартным json (результат
+одинаковый: даты в ISO, UTF-8 без экранирования). Клиент, который просит
+Accept: application/msgpack, получает MessagePack (если установлен msgpack).
+Ответы от COMPRESS_MIN_BYTES сжимаются brotli или gzip по Accept-Encoding.
+
+orjson, msgpack и brotli необязательны: без них API работает на стандартной библиотеке.
+"""
+import base64
+import gzip
+import json
+from datetime import date, datetime
+
+from flask import request
+from flask.json.provider import JSONProvider
+from werkzeug.http import parse_accept_header
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MSGPACK_MIMETYPE = "application/msgpack"
+
+# Меньшие ответы не сжимаем: выигрыш меньше заголовков и времени на сжатие
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Что сжимать (бинарные форматы вроде PNG уже сжаты)
+COMPRESSIBLE_MIMETYPES = ("application/json", MSGPACK_MIMETYPE, "application/octet-stream", "text/plain", "text/html")
+
+
+def _default(value):
+    """Типы, которых нет в JSON: даты — ISO, байты — base64, множества — списки."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode("ascii")
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Не сериализуется: {type(value).__name__}")
+
+
+def dumps_json(obj) -> bytes:
+    """JSON в UTF-8 (orjson или стандартный json)."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_msgpack(obj) -> bytes:
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+
+class FastJSONProvider(JSONProvider):
+    """JSON-провайдер Flask: jsonify и request.json идут через dumps_json/orjson.loads,
+    jsonify отдаёт MessagePack, если клиент предпочитает его."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return dumps_json(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if msgpack is None:
+            return self._app.response_class(dumps_json(obj), mimetype="application/json")
+        if wants_msgpack():
+            response = self._app.response_class(dumps_msgpack(obj), mimetype=MSGPACK_MIMETYPE)
+        else:
+            response = self._app.response_class(dumps_json(obj), mimetype="application/json")
+        response.vary.add("Accept")
+        return response
+
+
+def wants_msgpack() -> bool:
+    """Клиент предпочитает MessagePack (по качеству в Accept)."""
+    best = request.accept_mimetypes.best_match(["application/json", MSGPACK_MIMETYPE])
+    return best == MSGPACK_MIMETYPE
+
+
+def response_mimetype() -> str:
+    """Формат, в котором jsonify ответит на текущий запрос."""
+    if msgpack is not None and wants_msgpack():
+        return MSGPACK_MIMETYPE
+    return "application/json"
+
+
+def compress(body: bytes, accept_encoding: str):
+    """(сжатое тело, Content-Encoding) или (body, None), если клиент не принимает сжатие."""
+    accepted = parse_accept_header(accept_encoding)
+    if brotli is not None and accepted["br"] > 0:
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if accepted["gzip"] > 0:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def compress_response(response):
+    """Сжимает готовый ответ, если он достаточно большой и клиент это принимает."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    compressed, encoding = compress(body, request.headers.get("Accept-Encoding", ""))
+    if encoding is not None:
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app):
+    """Подключает сериализацию и сжатие к приложению Flask.
+
+    Вызывать сразу после создания app: after_request выполняются в обратном порядке,
+    и сжатие должно идти последним — после ETag и 304.
+    """
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
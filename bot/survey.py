@@ -0,0 +1,65 @@
+"""
+Движок опросов: отправка вопросов и переход к следующему после ответа.
+
+Независимые действия после ответа (удаление вопроса и ответа, запись в БД,
+отправка следующего вопроса) выполняются параллельно, поэтому между нажатием
+и следующим вопросом проходит примерно один запрос к Telegram. Ошибка одного
+действия логируется и не мешает остальным.
+"""
+import asyncio
+import logging
+
+from .questions import get_question_data, get_inline_keyboard
+from .router import get_state
+
+logger = logging.getLogger(__name__)
+
+
+async def send_question(chat_id: int, survey_type: str, index: int, context, q: dict = None):
+    """Отправляет вопрос по индексу. Сохраняет message_id в состоянии опроса для последующего удаления.
+
+    В выходные все вопросы задаются как обычно.
+    """
+    if q is None:
+        q = get_question_data(survey_type, index)
+    if not q:
+        return None
+
+    keyboard = get_inline_keyboard(q["field_name"], q["options"]) if q["has_keyboard"] else None
+    msg = await context.bot.send_message(
+        chat_id=chat_id,
+        text=q["text"],
+        reply_markup=keyboard,
+    )
+    state = get_state(chat_id)
+    if state and state["name"] == "survey":
+        state["last_msg_id"] = msg.message_id
+    return msg
+
+
+async def _delete_message(bot, chat_id: int, message_id: int):
+    await bot.delete_message(chat_id=chat_id, message_id=message_id)
+
+
+async def answer_and_advance(context, user_id: int, state: dict, save=None, delete_ids=()) -> bool:
+    """Сохраняет ответ и отправляет следующий вопрос опроса.
+
+    save — функция записи ответа в БД (выполняется в отдельном потоке),
+    delete_ids — id сообщений, которые нужно удалить (вопрос, ответ пользователя).
+    Возвращает True, если вопросов больше нет и опрос завершён.
+    """
+    survey_type = state["type"]
+    state["index"] += 1
+    # Следующий вопрос берётся из кеша вопросов, до любых сетевых вызовов
+    next_q = get_question_data(survey_type, state["index"])
+
+    actions = [_delete_message(context.bot, user_id, message_id) for message_id in delete_ids if message_id]
+    if save is not None:
+        actions.append(asyncio.to_thread(save))
+    if next_q:
+        actions.append(send_question(user_id, survey_type, state["index"], context, next_q))
+
+    for result in await asyncio.gather(*actions, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.warning("survey step failed for %s: %r", user_id, result)
+    return next_q is None
@@ -0,0 +1,106 @@
+"""
+Шаблоны повторяющихся целей: /templates, добавление и удаление.
+
+Цели из шаблонов создаются сами при смене периода (materialize_goal_templates):
+дневные — в выбранные дни недели, недельные — в понедельник, месячные — первого числа.
+"""
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .config import ALLOWED_USER_ID
+from .database import ALL_WEEKDAYS, add_goal_template, get_goal_templates, delete_goal_template
+from .router import encode_callback, set_state, clear_state
+
+WEEKDAY_NAMES = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+
+# Типы шаблонов: {kind: (иконка, подпись кнопки добавления)}
+TEMPLATE_KINDS = {
+    "daily": ("☀️", "➕ Дневная"),
+    "weekly": ("📋", "➕ Недельная"),
+    "monthly": ("🗓", "➕ Месячная"),
+}
+
+
+def parse_template_line(kind: str, line: str):
+    """Строка ввода → (weekdays, текст). Для дневных можно указать дни: «пн,ср,пт: Спортзал»."""
+    if kind == "daily" and ":" in line:
+        days, _, text = line.partition(":")
+        names = [d.strip().lower() for d in days.split(",")]
+        if names and all(n in WEEKDAY_NAMES for n in names):
+            weekdays = 0
+            for n in names:
+                weekdays |= 1 << WEEKDAY_NAMES.index(n)
+            return weekdays, text.strip()
+    return ALL_WEEKDAYS, line.strip()
+
+
+def format_weekdays(weekdays: int) -> str:
+    if weekdays == ALL_WEEKDAYS:
+        return "каждый день"
+    return ",".join(name for i, name in enumerate(WEEKDAY_NAMES) if weekdays >> i & 1)
+
+
+def render_templates_menu(user_id: int = ALLOWED_USER_ID):
+    """Текст и клавиатура списка шаблонов."""
+    templates = get_goal_templates(user_id)
+    lines = ["🔁 Повторяющиеся цели", ""]
+    buttons = []
+    if not templates:
+        lines.append("Пока нет шаблонов.")
+    for t in templates:
+        icon = TEMPLATE_KINDS[t["kind"]][0]
+        when = f" ({format_weekdays(t['weekdays'])})" if t["kind"] == "daily" else ""
+        lines.append(f"{icon} {t['task_text']}{when}")
+        short = t["task_text"][:30] + ("..." if len(t["task_text"]) > 30 else "")
+        buttons.append([InlineKeyboardButton(f"🗑 {short}", callback_data=encode_callback("td", t["id"]))])
+    buttons.append([
+        InlineKeyboardButton(label, callback_data=encode_callback("tn", kind))
+        for kind, (_, label) in TEMPLATE_KINDS.items()
+    ])
+    return "\n".join(lines) + "\n", InlineKeyboardMarkup(buttons)
+
+
+async def cmd_templates(update, context):
+    """Команда /templates — список шаблонов повторяющихся целей."""
+    if update.effective_user.id != ALLOWED_USER_ID:
+        return
+    text, keyboard = render_templates_menu(update.effective_user.id)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+
+async def on_new_template(update, context, kind: str):
+    """Начать добавление шаблонов выбранного типа."""
+    query = update.callback_query
+    await query.answer()
+    set_state(query.from_user.id, "template", kind=kind)
+    hint = "\n\nДля дневных можно указать дни недели:\nпн,ср,пт: Спортзал" if kind == "daily" else ""
+    await query.message.edit_text(f"{TEMPLATE_KINDS[kind][0]} Напиши цели (каждая с новой строки).{hint}")
+
+
+async def on_template_text(update, context, state: dict):
+    """Ввод шаблонов: каждая строка — отдельный шаблон."""
+    user_id = update.effective_user.id
+    added = 0
+    for line in update.message.text.strip().split("\n"):
+        weekdays, text = parse_template_line(state["kind"], line)
+        if text and weekdays:
+            add_goal_template(state["kind"], text, weekdays, user_id)
+            added += 1
+    clear_state(user_id)
+    text, keyboard = render_templates_menu(user_id)
+    await update.message.reply_text(f"✅ Добавлено шаблонов: {added}\n\n{text}", reply_markup=keyboard)
+
+
+async def on_delete_template(update, context, template_id: str):
+    """Удаление шаблона."""
+    query = update.callback_query
+    await query.answer("Шаблон удалён")
+    delete_goal_template(int(template_id))
+    text, keyboard = render_templates_menu(query.from_user.id)
+    await query.message.edit_text(text, reply_markup=keyboard)
+
+
+def register_routes(router):
+    """Подключает кнопки и ввод шаблонов к роутеру."""
+    router.add_callback("tn", on_new_template)
+    router.add_callback("td", on_delete_template)
+    router.text("template")(on_template_text)
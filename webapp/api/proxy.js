@@ -2,41 +2,132 @@
  * Vercel serverless proxy — пересылает /api/* на внешний API
  * Установи API_URL в Vercel: Project Settings → Environment Variables
  * Пример: https://ваш-проект.railway.app
+ *
+ * Тела запроса и ответа идут потоком, без разбора JSON. Соединения с API переиспользуются
+ * (keep-alive) между вызовами в тёплом экземпляре функции. Заголовки кеширования
+ * (Cache-Control, Vary, ETag) и условные заголовки запроса передаются как есть.
  */
-export default async function handler(req, res) {
+import http from 'node:http';
+import https from 'node:https';
+
+// Пулы соединений с API живут, пока жив экземпляр функции
+const agents = {
+  'http:': new http.Agent({ keepAlive: true, maxSockets: 16 }),
+  'https:': new https.Agent({ keepAlive: true, maxSockets: 16 }),
+};
+
+// Заголовки запроса, которые уходят в API (условные — для 304 без тела, Idempotency-Key — для повторов)
+const REQUEST_HEADERS = [
+  'accept', 'accept-encoding', 'content-type', 'content-length',
+  'if-none-match', 'if-modified-since', 'idempotency-key',
+];
+
+// Заголовки клиента про адрес не передаются: их может подставить кто угодно.
+// Адрес для лимитов запросов API прокси ставит сам (clientAddress)
+const CLIENT_ADDRESS_HEADERS = new Set(['x-forwarded-for', 'x-forwarded-host', 'x-forwarded-proto', 'x-real-ip']);
+
+// Заголовки ответа API, которые не передаются клиенту (относятся к соединению)
+const HOP_BY_HOP = new Set([
+  'connection', 'keep-alive', 'transfer-encoding', 'upgrade',
+  'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+]);
+
+export function targetUrl(apiUrl, query) {
+  let pathStr = query?.path;
+  if (Array.isArray(pathStr)) pathStr = pathStr.join('/');
+  pathStr = String(pathStr || '').replace(/^\//, '');
+  // Остальные параметры запроса (?metric=...&bucket=...) передаём как есть
+  const { path: _path, ...rest } = query || {};
+  const search = new URLSearchParams(rest).toString();
+  return new URL(`${apiUrl.replace(/\/$/, '')}/api/${pathStr}${search ? `?${search}` : ''}`);
+}
+
+// Адрес клиента: на Vercel — x-real-ip, который ставит сама платформа, иначе — адрес соединения
+export function clientAddress(req) {
+  const realIp = process.env.VERCEL ? req.headers['x-real-ip'] : null;
+  return realIp || req.socket?.remoteAddress || '';
+}
+
+function sendError(res, status, error) {
+  res.statusCode = status;
+  res.setHeader('Content-Type', 'application/json; charset=utf-8');
+  res.setHeader('Cache-Control', 'no-store');
+  res.end(JSON.stringify({ success: false, error }));
+}
+
+// req.query есть у Vercel; без него (локальный сервер, тесты) — разбираем URL запроса
+function requestQuery(req) {
+  if (req.query) return req.query;
+  const params = new URL(req.url, 'http://localhost').searchParams;
+  const query = {};
+  for (const key of params.keys()) {
+    const values = params.getAll(key);
+    query[key] = values.length > 1 ? values : values[0];
+  }
+  return query;
+}
+
+export default function handler(req, res) {
   const apiUrl = process.env.API_URL;
   if (!apiUrl) {
-    return res.status(502).json({ success: false, error: 'API_URL не настроен в Vercel' });
+    return sendError(res, 502, 'API_URL не настроен в Vercel');
   }
 
-  let pathStr = req.query?.path;
-  if (Array.isArray(pathStr)) pathStr = pathStr.join('/');
-  pathStr = String(pathStr || '').replace(/^\//, '');
-  const targetUrl = `${apiUrl.replace(/\/$/, '')}/api/${pathStr}`;
-  console.log('[Proxy]', req.method, pathStr || '(empty)', '→', targetUrl);
+  const url = targetUrl(apiUrl, requestQuery(req));
+  console.log('[Proxy]', req.method, url.pathname, '→', url.origin);
 
-  try {
-    const options = {
-      method: req.method,
-      headers: {
-        'Content-Type': req.headers['content-type'] || 'application/json',
-        'ngrok-skip-browser-warning': 'true',
-      },
-    };
-    if (req.method !== 'GET' && req.body != null) {
-      options.body = typeof req.body === 'string' ? req.body : JSON.stringify(req.body);
+  const headers = { 'ngrok-skip-browser-warning': 'true' };
+  for (const name of REQUEST_HEADERS) {
+    if (req.headers[name] != null) headers[name] = req.headers[name];
+  }
+  for (const [name, value] of Object.entries(req.headers)) {
+    if (name.startsWith('x-') && !name.startsWith('x-vercel-') && !CLIENT_ADDRESS_HEADERS.has(name)) {
+      headers[name] = value;
     }
+  }
+  // Первый прокси в цепочке: X-Forwarded-For начинается с адреса клиента, дальше его дополняют
+  // следующие прокси (ngrok, балансировщик); API доверяет TRUSTED_PROXIES последним записям
+  const address = clientAddress(req);
+  if (address) headers['x-forwarded-for'] = address;
+
+  return new Promise((resolve) => {
+    const transport = url.protocol === 'https:' ? https : http;
+    const upstream = transport.request(url, {
+      method: req.method,
+      headers,
+      agent: agents[url.protocol],
+    }, (response) => {
+      console.log('[Proxy]', response.statusCode, url.pathname);
+      for (const [name, value] of Object.entries(response.headers)) {
+        if (!HOP_BY_HOP.has(name)) res.setHeader(name, value);
+      }
+      res.statusCode = response.statusCode;
+      response.pipe(res);
+      response.on('end', resolve);
+      response.on('error', (err) => {
+        console.error('Proxy response error:', err);
+        res.destroy(err);
+        resolve();
+      });
+    });
+
+    upstream.on('error', (err) => {
+      console.error('Proxy error:', err);
+      if (!res.headersSent) sendError(res, 502, 'Ошибка соединения с API');
+      else res.destroy(err);
+      resolve();
+    });
 
-    const response = await fetch(targetUrl, options);
-    const data = await response.text();
-    console.log('[Proxy]', response.status, pathStr || '(empty)');
-    try {
-      res.status(response.status).json(JSON.parse(data));
-    } catch {
-      res.status(response.status).send(data);
+    // Тело запроса — потоком. req.body у Vercel читает поток при обращении, поэтому
+    // берём его, только если платформа уже прочитала тело сама
+    if (req.method === 'GET' || req.method === 'HEAD') {
+      upstream.end();
+    } else if (req.readableEnded) {
+      const body = req.body == null ? '' : (typeof req.body === 'string' || Buffer.isBuffer(req.body) ? req.body : JSON.stringify(req.body));
+      upstream.setHeader('content-length', Buffer.byteLength(body));
+      upstream.end(body);
+    } else {
+      req.pipe(upstream);
     }
-  } catch (err) {
-    console.error('Proxy error:', err);
-    res.status(502).json({ success: false, error: 'Ошибка соединения с API' });
-  }
+  });
 }
@@ -54,11 +54,394 @@ const API_BASE_URL = /localhost|127\.0\.0\.1/.test(window.location?.hostname ||
     ? 'http://localhost:5001'
     : '';
 
+// Подписанные данные Telegram: по ним API узнаёт пользователя (лимиты запросов — на пользователя)
+const AUTH_HEADERS = tg?.initData ? { 'X-Telegram-Init-Data': tg.initData } : {};
+
 // Логи для отладки (видны в DevTools или tg://web_app_debug)
 const log = (...a) => console.log('[MiniApp]', ...a);
 const logErr = (...a) => console.error('[MiniApp]', ...a);
 
+// Локальная копия данных (цели, ответы, вопросы, шаблоны): { rev, periods, tables: {таблица: {id: строка}} }.
+// Хранится в localStorage и догоняется дельтами /api/sync — повторный визит стоит одного короткого запроса.
+const REPLICA_KEY = 'replica_v1';
+let replica = loadReplica();
+let syncPromise = null;
+
+function emptyReplica() {
+    return { rev: 0, periods: {}, tables: {} };
+}
+
+function loadReplica() {
+    try {
+        const saved = JSON.parse(localStorage.getItem(REPLICA_KEY));
+        if (saved && Number.isInteger(saved.rev)) return saved;
+    } catch (e) {
+        logErr('loadReplica', e);
+    }
+    return emptyReplica();
+}
+
+function saveReplica() {
+    try {
+        localStorage.setItem(REPLICA_KEY, JSON.stringify(replica));
+    } catch (e) {
+        logErr('saveReplica', e);
+    }
+}
+
+function applyDelta(delta) {
+    if (delta.reset) replica = emptyReplica();
+    for (const [table, rows] of Object.entries(delta.upserts || {})) {
+        const t = replica.tables[table] ||= {};
+        rows.forEach(row => { t[row.id] = row; });
+    }
+    for (const [table, ids] of Object.entries(delta.deletes || {})) {
+        const t = replica.tables[table];
+        if (t) ids.forEach(id => { delete t[id]; });
+    }
+    replica.rev = delta.rev;
+    replica.periods = delta.periods;
+}
+
+// Догоняет копию до сервера; параллельные вызовы ждут один и тот же запрос
+function sync() {
+    if (!syncPromise) {
+        syncPromise = (async () => {
+            try {
+                let more = true;
+                while (more) {
+                    const res = await fetch(`${API_BASE_URL}/api/sync?since=${replica.rev}`, { headers: AUTH_HEADERS });
+                    const delta = res.ok ? await res.json() : null;
+                    if (!delta?.success) {
+                        logErr('sync failed', res.status, delta?.error);
+                        break;
+                    }
+                    applyDelta(delta);
+                    more = delta.more;
+                }
+                saveReplica();
+            } catch (e) {
+                logErr('sync', e);
+            } finally {
+                syncPromise = null;
+            }
+        })();
+    }
+    return syncPromise;
+}
+
+// Живые обновления (/api/events): после каждой записи сервер присылает дельту журнала,
+// копия и открытый экран обновляются без запросов. Пока поток открыт, смена экрана не синхронизирует.
+let eventsLive = false;
+
+function connectEvents() {
+    if (!window.EventSource) return;
+    const source = new EventSource(`${API_BASE_URL}/api/events`);
+    source.onopen = () => {
+        eventsLive = true;
+        // Что изменилось, пока потока не было
+        sync().then(refreshActiveScreen);
+    };
+    source.onerror = () => { eventsLive = false; };
+    source.addEventListener('changes', (e) => {
+        const delta = JSON.parse(e.data);
+        if (delta.rev <= replica.rev && !delta.reset) return;
+        if (delta.since === replica.rev) {
+            applyDelta(delta);
+            saveReplica();
+            if (!delta.more) return refreshActiveScreen();
+        }
+        // Пропущено событие или дельта неполная — догоняем обычной синхронизацией
+        sync().then(refreshActiveScreen);
+    });
+}
+
+// Синхронизация при открытии экрана; не нужна, пока события приходят сами
+function catchUp() {
+    return eventsLive ? Promise.resolve() : sync();
+}
+
+function refreshActiveScreen() {
+    const active = document.querySelector('.screen.active')?.id?.replace('screen-', '');
+    if (active) loadScreenData(active);
+}
+
+// Цели текущего периода из копии
+function replicaGoals(type) {
+    const period = replica.periods[type];
+    return Object.values(replica.tables[`${type}_goals`] || {})
+        .filter(g => g.date === period)
+        .sort((a, b) => a.id - b.id);
+}
+
+// Очередь изменений целей в IndexedDB: действие сразу видно на экране, а на сервер уходит
+// пачкой в /api/mutations. Повторные отметки одной цели схлопываются, ключ идемпотентности
+// не даёт применить изменение дважды при повторной отправке.
+const APP_DB = 'miniapp';
+const QUEUE_STORE = 'mutations';
+const FLUSH_DELAY = 300;
+const MAX_RETRY_DELAY = 30000;
+const MUTATIONS_BATCH = 100;
+let appDbPromise = null;
+let pendingMutations = [];        // копия очереди в памяти, по порядку
+const inFlight = new Set();       // ключи отправленных, но ещё не подтверждённых изменений
+let flushTimer = null;
+let flushing = false;
+let retryDelay = 1000;
+
+function idbRequest(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+// База приложения: очередь изменений и кеш ответов; null — IndexedDB недоступна (всё только в памяти)
+function openAppDb() {
+    if (!appDbPromise) {
+        appDbPromise = new Promise(resolve => {
+            if (!window.indexedDB) return resolve(null);
+            const request = indexedDB.open(APP_DB, 2);
+            request.onupgradeneeded = () => {
+                const db = request.result;
+                if (!db.objectStoreNames.contains(QUEUE_STORE)) db.createObjectStore(QUEUE_STORE, { keyPath: 'key' });
+                if (!db.objectStoreNames.contains(CACHE_STORE)) db.createObjectStore(CACHE_STORE, { keyPath: 'key' });
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => { logErr('openAppDb', request.error); resolve(null); };
+        });
+    }
+    return appDbPromise;
+}
+
+async function idbWrite(storeName, fn) {
+    const db = await openAppDb();
+    if (!db) return;
+    const tx = db.transaction(storeName, 'readwrite');
+    fn(tx.objectStore(storeName));
+    await new Promise((resolve, reject) => {
+        tx.oncomplete = resolve;
+        tx.onerror = () => reject(tx.error);
+    });
+}
+
+async function loadQueue() {
+    const db = await openAppDb();
+    if (!db) return;
+    const saved = await idbRequest(db.transaction(QUEUE_STORE).objectStore(QUEUE_STORE).getAll());
+    pendingMutations = saved.sort((a, b) => a.seq - b.seq);
+}
+
+function newMutationKey() {
+    return crypto.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Ставит изменение в очередь; set и edit одной цели заменяют ещё не отправленные предыдущие
+async function enqueueMutation(mutation) {
+    const entry = { ...mutation, key: newMutationKey(), seq: (pendingMutations.at(-1)?.seq ?? 0) + 1 };
+    const replaced = (mutation.op === 'set' || mutation.op === 'edit')
+        ? pendingMutations.filter(m => !inFlight.has(m.key) && m.op === mutation.op
+            && m.type === mutation.type && m.id === mutation.id)
+        : [];
+    pendingMutations = pendingMutations.filter(m => !replaced.includes(m)).concat(entry);
+    try {
+        await idbWrite(QUEUE_STORE, store => {
+            replaced.forEach(m => store.delete(m.key));
+            store.put(entry);
+        });
+    } catch (e) {
+        logErr('enqueueMutation', e);
+    }
+    scheduleFlush(FLUSH_DELAY);
+}
+
+// Ключ пачки для Idempotency-Key: одна и та же пачка при повторе получает тот же ключ
+async function batchKey(batch) {
+    const keys = batch.map(m => m.key).join(',');
+    if (!crypto.subtle) return keys.slice(0, 255);
+    const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(keys));
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+function scheduleFlush(delay) {
+    clearTimeout(flushTimer);
+    flushTimer = setTimeout(flushQueue, delay);
+}
+
+async function dropMutations(keys) {
+    pendingMutations = pendingMutations.filter(m => !keys.includes(m.key));
+    try {
+        await idbWrite(QUEUE_STORE, store => keys.forEach(key => store.delete(key)));
+    } catch (e) {
+        logErr('dropMutations', e);
+    }
+}
+
+// Отправляет очередь пачками; при сетевой ошибке повторяет с растущей паузой
+async function flushQueue() {
+    if (flushing) return;
+    const batch = pendingMutations.filter(m => !inFlight.has(m.key)).slice(0, MUTATIONS_BATCH);
+    if (!batch.length) return;
+    flushing = true;
+    batch.forEach(m => inFlight.add(m.key));
+    let retry = false;
+    try {
+        const res = await fetch(`${API_BASE_URL}/api/mutations`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Idempotency-Key': await batchKey(batch), ...AUTH_HEADERS },
+            body: JSON.stringify({ mutations: batch.map(({ seq, ...m }) => m) })
+        });
+        const data = await res.json().catch(() => null);
+        // 429 — сервер перегружен, 409 — предыдущая отправка этой пачки ещё выполняется
+        // (и может завершиться ошибкой): ждём сколько просит сервер и повторяем
+        const retryable = res.status >= 500 || res.status === 429 || res.status === 409;
+        const retryAfter = Number(res.headers.get('Retry-After'));
+        if (retryable && retryAfter > 0) retryDelay = Math.max(retryDelay, retryAfter * 1000);
+        // Обрыв связи тоже повторяется; другая 4xx — пачка не примется никогда
+        if (retryable) throw new Error(data?.error || `HTTP ${res.status}`);
+        const failed = data?.success ? data.results.filter(r => !r.ok) : batch;
+        if (failed.length) {
+            logErr('mutations failed', failed);
+            tg?.showAlert?.('Часть изменений не сохранилась');
+        }
+        retryDelay = 1000;
+        await sync();
+        await dropMutations(batch.map(m => m.key));
+        refreshGoalViews();
+    } catch (e) {
+        logErr('flushQueue', e);
+        retry = true;
+    } finally {
+        batch.forEach(m => inFlight.delete(m.key));
+        flushing = false;
+    }
+    if (retry) {
+        scheduleFlush(retryDelay);
+        retryDelay = Math.min(retryDelay * 2, MAX_RETRY_DELAY);
+    } else if (pendingMutations.length) {
+        scheduleFlush(0);
+    }
+}
+
+// Цели периода: копия с сервера плюс ещё не подтверждённые изменения из очереди
+function currentGoals(type) {
+    const goals = replicaGoals(type).map(g => ({ ...g }));
+    const byId = new Map(goals.map(g => [String(g.id), g]));
+    for (const m of pendingMutations) {
+        if (m.type !== type) continue;
+        if (m.op === 'add') {
+            goals.push({ id: `tmp-${m.key}`, text: m.text, completed: false, pending: true });
+            continue;
+        }
+        if (m.op === 'set_many') {
+            m.ids.forEach(id => { const g = byId.get(String(id)); if (g) g.completed = m.completed; });
+            continue;
+        }
+        const goal = byId.get(String(m.id));
+        if (!goal) continue;
+        if (m.op === 'set') goal.completed = m.completed;
+        else if (m.op === 'edit') goal.text = m.text;
+    }
+    return goals;
+}
+
+function refreshGoalViews() {
+    const active = document.querySelector('.screen.active')?.id;
+    if (active === 'screen-home') renderHomeFromReplica();
+    else if (active === 'screen-goals') {
+        const container = document.getElementById(`${currentGoalTab}-goals`);
+        if (container) displayGoals(container, currentGoals(currentGoalTab), currentGoalTab);
+    }
+}
+
+// Ответ на вопрос с field_name за сегодня из копии
+function replicaAnswer(field) {
+    const today = replica.periods.daily;
+    return Object.values(replica.tables.answers || {}).find(a => a.date === today && a.field_name === field);
+}
+
+// Кеш ответов API в IndexedDB (stale-while-revalidate): сохранённый ответ показывается сразу,
+// затем проверяется условным запросом (If-None-Match → 304 без тела). Запись свежая, пока не
+// прошёл её TTL и не сменилась ревизия данных; объём ограничен, вытесняются давно не читанные.
+const CACHE_STORE = 'responses';
+const CACHE_MAX_BYTES = 512 * 1024;
+const STATS_TTL = 5 * 60 * 1000;
+const CHARTS_TTL = 30 * 60 * 1000;
+const cacheUser = tg?.initDataUnsafe?.user?.id ?? 'anon';
+
+async function cacheGet(key) {
+    try {
+        const db = await openAppDb();
+        if (!db) return null;
+        return await idbRequest(db.transaction(CACHE_STORE).objectStore(CACHE_STORE).get(key)) || null;
+    } catch (e) {
+        logErr('cacheGet', e);
+        return null;
+    }
+}
+
+// Сохраняет запись и вытесняет самые давно прочитанные, пока кеш больше CACHE_MAX_BYTES
+async function cachePut(entry) {
+    try {
+        const db = await openAppDb();
+        if (!db) return;
+        const entries = await idbRequest(db.transaction(CACHE_STORE).objectStore(CACHE_STORE).getAll());
+        const others = entries.filter(e => e.key !== entry.key).sort((a, b) => a.usedAt - b.usedAt);
+        let total = others.reduce((sum, e) => sum + e.size, entry.size);
+        const evicted = [];
+        while (total > CACHE_MAX_BYTES && others.length) {
+            const oldest = others.shift();
+            total -= oldest.size;
+            evicted.push(oldest.key);
+        }
+        await idbWrite(CACHE_STORE, store => {
+            evicted.forEach(key => store.delete(key));
+            store.put(entry);
+        });
+    } catch (e) {
+        logErr('cachePut', e);
+    }
+}
+
+// GET JSON через кеш: render вызывается с сохранённым ответом (если есть) и с новым, если он отличается.
+// ready — ожидание синхронизации копии (ревизия нужна, чтобы решить, свежа ли запись).
+async function cachedJson(path, ttl, render, ready = Promise.resolve()) {
+    const key = `${cacheUser}:${path}`;
+    const cached = await cacheGet(key);
+    if (cached) render(cached.data);
+    await ready;
+    const now = Date.now();
+    if (cached && cached.rev === replica.rev && now - cached.storedAt < ttl) {
+        cachePut({ ...cached, usedAt: now });
+        return;
+    }
+    try {
+        const res = await fetch(`${API_BASE_URL}${path}`, {
+            headers: cached?.etag ? { ...AUTH_HEADERS, 'If-None-Match': cached.etag } : AUTH_HEADERS
+        });
+        if (res.status === 304 && cached) {
+            cachePut({ ...cached, rev: replica.rev, storedAt: now, usedAt: now });
+            return;
+        }
+        const data = await res.json().catch(() => null);
+        if (!res.ok || !data?.success) {
+            logErr('cachedJson', path, res.status, data?.error);
+            if (!cached) render(data || { success: false, error: `HTTP ${res.status}` });
+            return;
+        }
+        render(data);
+        const body = JSON.stringify(data);
+        cachePut({ key, etag: res.headers.get('ETag'), data, rev: replica.rev, storedAt: now, usedAt: now, size: body.length });
+    } catch (e) {
+        logErr('cachedJson', path, e);
+        if (!cached) render({ success: false, error: 'Ошибка соединения' });
+    }
+}
+
 let currentGoalTab = 'daily';
+let currentBucket = 'day';
+let currentHeatmapMetric = 'energy';
+let heatmapData = null;
 
 const screens = ['home', 'goals', 'stats', 'settings'];
 const screenTitles = { home: 'Главная', goals: 'Цели', stats: 'Статистика', settings: 'Настройки' };
@@ -90,65 +473,154 @@ async function loadScreenData(screenName) {
     }
 }
 
+function goalCount(type) {
+    const goals = currentGoals(type);
+    return `${goals.filter(g => g.completed).length}/${goals.length}`;
+}
+
+// Цели и сегодняшние ответы — из локальной копии, недельные сводки — с сервера
+function renderHomeFromReplica() {
+    setText('home-daily-progress', goalCount('daily'));
+    setText('home-weekly-goals', goalCount('weekly'));
+    setText('home-monthly-goals', goalCount('monthly'));
+    const energy = replicaAnswer('energy');
+    const walk = replicaAnswer('walk');
+    setText('home-energy', energy?.int_value ?? '-');
+    setText('home-walk', walk?.int_value == null ? '-' : (walk.int_value ? 'Да' : 'Нет'));
+}
+
+function renderHomeProgress(progress) {
+    if (!progress?.success) return;
+    const s = progress.stats;
+    setText('home-avg-energy', s.avg_energy != null ? String(s.avg_energy.toFixed(1)) : '-');
+    setText('home-walks', s.walks_count ?? '-');
+}
+
+function renderHomeAlcohol(alcohol) {
+    if (!alcohol?.success) return;
+    const s = alcohol.stats;
+    setText('home-days-sober', s.days_sober ?? '-');
+    setText('home-money-saved', s.money_saved != null ? `${Number(s.money_saved).toLocaleString('ru-RU')} ₽` : '-');
+}
+
 async function loadHomeData() {
-    log('loadHomeData, API=', API_BASE_URL || '(relative)');
-    try {
-        const [progressRes, alcoholRes] = await Promise.all([
-            fetch(`${API_BASE_URL}/api/stats/progress`),
-            fetch(`${API_BASE_URL}/api/stats/alcohol`)
-        ]);
-        log('home progress', progressRes.status, 'alcohol', alcoholRes.status);
-        const progress = progressRes.ok ? await progressRes.json() : null;
-        const alcohol = alcoholRes.ok ? await alcoholRes.json() : null;
-        if (!progressRes.ok) logErr('progress fetch failed', progressRes.status, await progressRes.text());
-        if (!alcoholRes.ok) logErr('alcohol fetch failed', alcoholRes.status, await alcoholRes.text());
-
-        if (progress?.success) {
-            const s = progress.stats;
-            setText('home-daily-progress', `${s.daily_goals?.completed ?? 0}/${s.daily_goals?.total ?? 0}`);
-            setText('home-energy', '-');
-            setText('home-walk', '-');
-            setText('home-weekly-goals', `${s.weekly_goals?.completed ?? 0}/${s.weekly_goals?.total ?? 0}`);
-            setText('home-avg-energy', s.avg_energy != null ? String(s.avg_energy.toFixed(1)) : '-');
-            setText('home-walks', s.walks_count ?? '-');
-            setText('home-monthly-goals', `${s.monthly_goals?.completed ?? 0}/${s.monthly_goals?.total ?? 0}`);
-        }
+    log('loadHomeData, API=', API_BASE_URL || '(relative)', 'rev', replica.rev);
+    renderHomeFromReplica();
+    const synced = catchUp().then(renderHomeFromReplica);
+    await Promise.all([
+        cachedJson('/api/stats/progress', STATS_TTL, renderHomeProgress, synced),
+        cachedJson('/api/stats/alcohol', STATS_TTL, renderHomeAlcohol, synced),
+    ]);
+}
 
-        if (alcohol?.success) {
-            const s = alcohol.stats;
-            setText('home-days-sober', s.days_sober ?? '-');
-            setText('home-money-saved', s.money_saved != null ? `${Number(s.money_saved).toLocaleString('ru-RU')} ₽` : '-');
-        }
-    } catch (e) {
-        logErr('loadHomeData', e);
-    }
+function renderStatsProgress(progress) {
+    if (!progress?.success) return;
+    const s = progress.stats;
+    setText('stats-avg-energy', s.avg_energy != null ? String(s.avg_energy.toFixed(1)) : '-');
+    setText('stats-walks', s.walks_count ?? '-');
+}
+
+function renderStatsAlcohol(alcohol) {
+    if (!alcohol?.success) return;
+    const s = alcohol.stats;
+    setText('days-sober', s.days_sober ?? '-');
+    setText('money-saved', s.money_saved != null ? `${Number(s.money_saved).toLocaleString('ru-RU')} ₽` : '-');
+    setText('episodes-month', s.episodes_this_month ?? '-');
+    setText('spent-month', s.money_spent_this_month != null ? `${Number(s.money_spent_this_month).toLocaleString('ru-RU')} ₽` : '-');
 }
 
 async function loadStatsData() {
-    try {
-        const [progressRes, alcoholRes] = await Promise.all([
-            fetch(`${API_BASE_URL}/api/stats/progress`),
-            fetch(`${API_BASE_URL}/api/stats/alcohol`)
-        ]);
-        const progress = progressRes.ok ? await progressRes.json() : null;
-        const alcohol = alcoholRes.ok ? await alcoholRes.json() : null;
-
-        if (progress?.success) {
-            const s = progress.stats;
-            setText('stats-avg-energy', s.avg_energy != null ? String(s.avg_energy.toFixed(1)) : '-');
-            setText('stats-walks', s.walks_count ?? '-');
-        }
+    const synced = catchUp();
+    await Promise.all([
+        cachedJson('/api/stats/progress', STATS_TTL, renderStatsProgress, synced),
+        cachedJson('/api/stats/alcohol', STATS_TTL, renderStatsAlcohol, synced),
+        loadSeries(synced),
+        loadHeatmap(synced),
+    ]);
+}
 
-        if (alcohol?.success) {
-            const s = alcohol.stats;
-            setText('days-sober', s.days_sober ?? '-');
-            setText('money-saved', s.money_saved != null ? `${Number(s.money_saved).toLocaleString('ru-RU')} ₽` : '-');
-            setText('episodes-month', s.episodes_this_month ?? '-');
-            setText('spent-month', s.money_spent_this_month != null ? `${Number(s.money_spent_this_month).toLocaleString('ru-RU')} ₽` : '-');
+// График: один запрос /api/stats/series на выбранную метрику и период
+async function loadSeries(ready) {
+    const container = document.getElementById('series-chart');
+    if (!container) return;
+    const metric = document.getElementById('chart-metric')?.value || 'energy';
+    const bucket = currentBucket;
+
+    await cachedJson(`/api/stats/series?metric=${encodeURIComponent(metric)}&bucket=${bucket}`, CHARTS_TTL, data => {
+        // Пока шёл запрос, могли выбрать другую метрику или период
+        if (bucket !== currentBucket || metric !== (document.getElementById('chart-metric')?.value || 'energy')) return;
+        if (!data?.success) {
+            container.innerHTML = `<div class="loading">Ошибка: ${escapeHtml(data?.error)}</div>`;
+            return;
         }
-    } catch (e) {
-        console.error('loadStatsData', e);
+        drawChart(container, data.series, metric);
+    }, ready);
+}
+
+function drawChart(container, series, metric) {
+    if (!series.length) {
+        container.innerHTML = '<div class="empty-state"><div class="empty-state-text">Нет данных</div></div>';
+        return;
     }
+    // Энергия — среднее 1–10, остальное — доля дней (в процентах)
+    const percent = metric !== 'energy';
+    const max = percent ? 100 : 10;
+    const values = series.map(p => p.avg == null ? null : (percent ? p.avg * 100 : p.avg));
+    const height = 100;
+    const step = 10;
+    const bars = values.map((v, i) => {
+        if (v == null) return '';
+        const h = Math.max(1, v / max * height);
+        const label = `${series[i].start}: ${percent ? Math.round(v) + '%' : v.toFixed(1)}`;
+        return `<rect x="${i * step + 1}" y="${height - h}" width="${step - 2}" height="${h}" rx="2"><title>${label}</title></rect>`;
+    }).join('');
+    container.innerHTML = `
+        <svg class="chart-svg" viewBox="0 0 ${series.length * step} ${height}" preserveAspectRatio="none">${bars}</svg>
+        <div class="chart-axis"><span>${series[0].start}</span><span>${series[series.length - 1].start}</span></div>
+    `;
+}
+
+// Тепловая карта: весь год одним ответом, по байту на день (255 — нет данных)
+async function loadHeatmap(ready) {
+    const container = document.getElementById('heatmap');
+    if (!container) return;
+    await cachedJson('/api/heatmap', CHARTS_TTL, data => {
+        if (!data?.success) {
+            container.innerHTML = `<div class="loading">Ошибка: ${escapeHtml(data?.error)}</div>`;
+            return;
+        }
+        heatmapData = data;
+        drawHeatmap();
+    }, ready);
+}
+
+function drawHeatmap() {
+    const container = document.getElementById('heatmap');
+    if (!container || !heatmapData) return;
+    const bytes = Uint8Array.from(atob(heatmapData.metrics[currentHeatmapMetric]), c => c.charCodeAt(0));
+    const present = Array.from(bytes).filter(v => v !== heatmapData.no_data);
+    const max = currentHeatmapMetric === 'energy' ? 10 : Math.max(1, ...present);
+    // Колонка — неделя с понедельника, как в боте
+    const offset = (new Date(`${heatmapData.start}T00:00:00`).getDay() + 6) % 7;
+    const cells = [];
+    for (let i = 0; i < offset; i++) cells.push('<div class="heat-cell empty"></div>');
+    bytes.forEach(v => {
+        if (v === heatmapData.no_data) cells.push('<div class="heat-cell"></div>');
+        else cells.push(`<div class="heat-cell filled" style="opacity:${(0.15 + 0.85 * v / max).toFixed(2)}"></div>`);
+    });
+    container.innerHTML = `<div class="heatmap-grid">${cells.join('')}</div>`;
+}
+
+function switchHeatmapMetric(metric) {
+    currentHeatmapMetric = metric;
+    document.querySelectorAll('.tab[data-heatmap]').forEach(t => t.classList.toggle('active', t.dataset.heatmap === metric));
+    drawHeatmap();
+}
+
+function switchBucket(bucket) {
+    currentBucket = bucket;
+    document.querySelectorAll('.tab[data-bucket]').forEach(t => t.classList.toggle('active', t.dataset.bucket === bucket));
+    loadSeries();
 }
 
 function setText(id, text) {
@@ -158,7 +630,7 @@ function setText(id, text) {
 
 function switchGoalTab(tabName) {
     currentGoalTab = tabName;
-    document.querySelectorAll('.tab').forEach(t => t.classList.toggle('active', t.dataset.tab === tabName));
+    document.querySelectorAll('.tab[data-tab]').forEach(t => t.classList.toggle('active', t.dataset.tab === tabName));
     document.querySelectorAll('.goals-list').forEach(l => l.classList.remove('active'));
     const list = document.getElementById(`${tabName}-goals`);
     if (list) list.classList.add('active');
@@ -166,40 +638,31 @@ function switchGoalTab(tabName) {
 }
 
 async function loadGoals(type) {
-    log('loadGoals', type);
+    log('loadGoals', type, 'rev', replica.rev);
     const container = document.getElementById(`${type}-goals`);
     if (!container) return;
-    container.innerHTML = '<div class="loading">Загрузка...</div>';
+    // Сначала — из копии (мгновенно), затем — после синхронизации
+    if (replica.rev) displayGoals(container, currentGoals(type), type);
+    else container.innerHTML = '<div class="loading">Загрузка...</div>';
 
-    try {
-        const url = `${API_BASE_URL}/api/goals/${type}`;
-        const res = await fetch(url);
-        const text = await res.text();
-        log('goals fetch', type, res.status, text.slice(0, 100));
-        let data = null;
-        try { data = text ? JSON.parse(text) : null; } catch { logErr('JSON parse failed', text.slice(0, 200)); }
-        if (!res.ok) logErr('goals fetch failed', type, res.status, text.slice(0, 200));
-
-        if (data?.success && Array.isArray(data.goals)) {
-            displayGoals(container, data.goals, type);
-        } else {
-            const err = data?.error || (res.ok ? 'Неверный формат ответа' : `HTTP ${res.status}`);
-            container.innerHTML = `<div class="loading">Ошибка: ${escapeHtml(err)}</div>`;
-        }
-    } catch (e) {
-        logErr('loadGoals', e);
+    const rev = replica.rev;
+    await catchUp();
+    if (!replica.rev) {
         container.innerHTML = '<div class="loading">Ошибка соединения</div>';
+        return;
     }
+    if (replica.rev !== rev || !rev) displayGoals(container, currentGoals(type), type);
 }
 
 function displayGoals(container, goals, type) {
+    updateBulkButtons(goals);
     if (!goals.length) {
         container.innerHTML = '<div class="empty-state"><div class="empty-state-text">Нет целей</div><div class="empty-state-hint">Добавьте новые цели</div></div>';
         return;
     }
 
     container.innerHTML = goals.map(g => `
-        <div class="list-item goal-item ${g.completed ? 'completed' : ''}" data-id="${g.id}" data-type="${type}">
+        <div class="list-item goal-item ${g.completed ? 'completed' : ''} ${g.pending ? 'pending' : ''}" data-id="${g.id}" data-type="${type}">
             <div class="goal-checkbox" aria-hidden="true">
                 <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
                     <polyline points="20 6 9 17 4 12"></polyline>
@@ -214,29 +677,35 @@ function displayGoals(container, goals, type) {
     });
 }
 
+// Отметка цели: сразу на экране, на сервер — через очередь (несколько нажатий — одно изменение)
 async function toggleGoal(element) {
     const goalId = element.dataset.id;
     const goalType = element.dataset.type;
-    if (!goalId || !goalType) return;
+    if (!goalId || !goalType || element.classList.contains('pending')) return;
 
-    element.classList.toggle('completed');
+    const completed = element.classList.toggle('completed');
+    tg?.HapticFeedback?.impactOccurred?.('light');
+    await enqueueMutation({ op: 'set', type: goalType, id: Number(goalId), completed });
+}
 
-    try {
-        const res = await fetch(`${API_BASE_URL}/api/goals/${goalType}/${goalId}/toggle`, { method: 'POST' });
-        const data = res.ok ? await res.json() : null;
+// Кнопки «отметить все» / «снять отметки» — только когда им есть что менять
+function updateBulkButtons(goals) {
+    const saved = goals.filter(g => !g.pending);
+    const completeAll = document.getElementById('goals-complete-all');
+    const clearCompleted = document.getElementById('goals-clear-completed');
+    if (completeAll) completeAll.hidden = !saved.some(g => !g.completed);
+    if (clearCompleted) clearCompleted.hidden = !saved.some(g => g.completed);
+}
 
-        if (!data?.success) {
-            element.classList.toggle('completed');
-            tg?.showAlert?.('Ошибка при сохранении');
-        } else {
-            tg?.HapticFeedback?.impactOccurred?.('light');
-            const active = document.querySelector('.screen.active');
-            if (active?.id === 'screen-home') loadHomeData();
-        }
-    } catch (e) {
-        element.classList.toggle('completed');
-        tg?.showAlert?.('Ошибка соединения');
-    }
+// Статус всех целей вкладки: одно изменение в очереди, на сервере — один UPDATE
+async function setAllGoals(completed) {
+    const type = currentGoalTab;
+    const ids = currentGoals(type).filter(g => !g.pending && g.completed !== completed).map(g => Number(g.id));
+    log('setAllGoals', type, completed, ids.length);
+    if (!ids.length) return;
+    tg?.HapticFeedback?.notificationOccurred?.('success');
+    await enqueueMutation({ op: 'set_many', type, ids, completed });
+    refreshGoalViews();
 }
 
 function escapeHtml(text) {
@@ -254,30 +723,15 @@ async function addSingleGoal() {
         return;
     }
 
-    try {
-        const res = await fetch(`${API_BASE_URL}/api/goals/${currentGoalTab}`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ goals: [text] })
-        });
-        const data = res.ok ? await res.json() : null;
-
-        if (data?.success) {
-            log('addSingleGoal ok');
-            input.value = '';
-            tg?.HapticFeedback?.notificationOccurred?.('success');
-            await loadGoals(currentGoalTab);
-            if (document.querySelector('.screen.active')?.id === 'screen-home') loadHomeData();
-        } else {
-            tg?.showAlert?.('Ошибка при сохранении');
-        }
-    } catch (e) {
-        logErr('addSingleGoal', e);
-        tg?.showAlert?.('Ошибка соединения');
-    }
+    input.value = '';
+    tg?.HapticFeedback?.notificationOccurred?.('success');
+    await enqueueMutation({ op: 'add', type: currentGoalTab, text });
+    refreshGoalViews();
 }
 
 document.getElementById('add-single-goal-btn')?.addEventListener('click', addSingleGoal);
+document.getElementById('goals-complete-all')?.addEventListener('click', () => setAllGoals(true));
+document.getElementById('goals-clear-completed')?.addEventListener('click', () => setAllGoals(false));
 document.getElementById('new-goal-input')?.addEventListener('keydown', (e) => {
     if (e.key === 'Enter') { e.preventDefault(); addSingleGoal(); }
 });
@@ -290,13 +744,29 @@ document.querySelectorAll('.nav-item').forEach(item => {
     });
 });
 
-document.querySelectorAll('.tab').forEach(tab => {
+document.querySelectorAll('.tab[data-tab]').forEach(tab => {
     tab.addEventListener('click', () => {
         switchGoalTab(tab.dataset.tab);
         tg?.HapticFeedback?.impactOccurred?.('light');
     });
 });
 
+document.querySelectorAll('.tab[data-bucket]').forEach(tab => {
+    tab.addEventListener('click', () => {
+        switchBucket(tab.dataset.bucket);
+        tg?.HapticFeedback?.impactOccurred?.('light');
+    });
+});
+
+document.querySelectorAll('.tab[data-heatmap]').forEach(tab => {
+    tab.addEventListener('click', () => {
+        switchHeatmapMetric(tab.dataset.heatmap);
+        tg?.HapticFeedback?.impactOccurred?.('light');
+    });
+});
+
+document.getElementById('chart-metric')?.addEventListener('change', () => loadSeries());
+
 // Настройки
 document.getElementById('edit-questions-btn')?.addEventListener('click', () => {
     tg?.sendData?.('edit_questions');
@@ -314,6 +784,14 @@ document.getElementById('help-btn')?.addEventListener('click', () => {
     tg?.HapticFeedback?.impactOccurred?.('light');
 });
 
+window.addEventListener('online', () => scheduleFlush(0));
+
 // Старт
 log('init, API_BASE_URL=', API_BASE_URL || '(relative)');
-switchScreen('home');
+loadQueue()
+    .catch(e => logErr('loadQueue', e))
+    .finally(() => {
+        switchScreen('home');
+        connectEvents();
+        if (pendingMutations.length) scheduleFlush(0);
+    });
@@ -0,0 +1,179 @@
+// Проверка прокси (api/proxy.js) на заглушке API: node --test webapp/test/
+import { test, before, after } from 'node:test';
+import assert from 'node:assert/strict';
+import http from 'node:http';
+import { once } from 'node:events';
+
+import handler from '../api/proxy.js';
+
+let upstream;
+let proxy;
+let proxyUrl;
+// Запросы, дошедшие до заглушки, и число открытых к ней соединений
+const seen = [];
+let connections = 0;
+
+// Заглушка API: отвечает по пути, записывает запросы
+function stubApi(req, res) {
+  const chunks = [];
+  req.on('data', (chunk) => chunks.push(chunk));
+  req.on('end', () => {
+    const url = new URL(req.url, 'http://stub');
+    seen.push({ method: req.method, url, headers: req.headers, body: Buffer.concat(chunks).toString() });
+    if (url.pathname === '/api/stats/progress') {
+      if (req.headers['if-none-match'] === '"v1"') {
+        res.writeHead(304, { ETag: '"v1"', 'Cache-Control': 'private, no-cache' });
+        return res.end();
+      }
+      // Нестандартное форматирование: прокси не должен разбирать и пересобирать JSON
+      res.writeHead(200, {
+        'Content-Type': 'application/json',
+        ETag: '"v1"',
+        'Cache-Control': 'private, no-cache',
+        Vary: 'Accept-Encoding',
+      });
+      return res.end('{"success": true,   "stats": {}}\n');
+    }
+    if (url.pathname === '/api/heatmap') {
+      res.writeHead(200, { 'Content-Type': 'application/octet-stream', 'X-Heatmap-Days': '365' });
+      return res.end(Buffer.from([0, 1, 2, 255]));
+    }
+    if (url.pathname === '/api/stream') {
+      // Ответ частями: первая часть должна дойти до клиента раньше последней
+      res.writeHead(200, { 'Content-Type': 'text/plain' });
+      res.write('first;');
+      return setTimeout(() => res.end('last'), 200);
+    }
+    if (url.pathname === '/api/mutations') {
+      res.writeHead(200, { 'Content-Type': 'application/json', 'Cache-Control': 'no-store' });
+      return res.end(JSON.stringify({ success: true, echo: Buffer.concat(chunks).toString() }));
+    }
+    res.writeHead(404, { 'Content-Type': 'application/json' });
+    res.end('{"success": false}');
+  });
+}
+
+// Как Vercel: /api/<path> → /api/proxy?path=<path>
+function vercelRewrite(req, res) {
+  const url = new URL(req.url, 'http://proxy');
+  const path = url.pathname.replace(/^\/api\//, '');
+  url.searchParams.set('path', path);
+  req.url = `/api/proxy?${url.searchParams}`;
+  handler(req, res);
+}
+
+before(async () => {
+  upstream = http.createServer(stubApi);
+  upstream.on('connection', () => { connections += 1; });
+  upstream.listen(0);
+  await once(upstream, 'listening');
+  process.env.API_URL = `http://127.0.0.1:${upstream.address().port}`;
+
+  proxy = http.createServer(vercelRewrite);
+  proxy.listen(0);
+  await once(proxy, 'listening');
+  proxyUrl = `http://127.0.0.1:${proxy.address().port}`;
+});
+
+after(() => {
+  proxy.close();
+  upstream.close();
+  upstream.closeAllConnections();
+});
+
+test('тело ответа передаётся байт в байт, заголовки кеширования — как есть', async () => {
+  const res = await fetch(`${proxyUrl}/api/stats/progress`);
+  assert.equal(res.status, 200);
+  assert.equal(await res.text(), '{"success": true,   "stats": {}}\n');
+  assert.equal(res.headers.get('etag'), '"v1"');
+  assert.equal(res.headers.get('cache-control'), 'private, no-cache');
+  assert.equal(res.headers.get('vary'), 'Accept-Encoding');
+});
+
+test('условный запрос доходит до API, 304 возвращается без тела', async () => {
+  const res = await fetch(`${proxyUrl}/api/stats/progress`, { headers: { 'If-None-Match': '"v1"' } });
+  assert.equal(res.status, 304);
+  assert.equal(await res.text(), '');
+  assert.equal(seen.at(-1).headers['if-none-match'], '"v1"');
+});
+
+test('параметры запроса передаются, бинарный ответ не меняется', async () => {
+  const res = await fetch(`${proxyUrl}/api/heatmap?format=binary&year=2025`);
+  assert.equal(res.headers.get('content-type'), 'application/octet-stream');
+  assert.equal(res.headers.get('x-heatmap-days'), '365');
+  assert.deepEqual([...new Uint8Array(await res.arrayBuffer())], [0, 1, 2, 255]);
+  const { url } = seen.at(-1);
+  assert.equal(url.searchParams.get('format'), 'binary');
+  assert.equal(url.searchParams.get('year'), '2025');
+  assert.equal(url.searchParams.has('path'), false);
+});
+
+test('тело POST уходит в API без изменений', async () => {
+  const body = '{"mutations": [ {"op": "add"} ]}';
+  const res = await fetch(`${proxyUrl}/api/mutations`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'Idempotency-Key': 'k1' },
+    body,
+  });
+  const data = await res.json();
+  assert.equal(data.echo, body);
+  assert.equal(res.headers.get('cache-control'), 'no-store');
+  assert.equal(seen.at(-1).headers['content-type'], 'application/json');
+  assert.equal(seen.at(-1).headers['idempotency-key'], 'k1');
+});
+
+test('адрес клиента ставит прокси, подставленный X-Forwarded-For не передаётся', async () => {
+  await (await fetch(`${proxyUrl}/api/stats/progress`, {
+    headers: { 'X-Forwarded-For': '203.0.113.7', 'X-Real-IP': '203.0.113.8', 'X-Telegram-Init-Data': 'q' },
+  })).text();
+  const { headers } = seen.at(-1);
+  assert.match(headers['x-forwarded-for'], /^(::ffff:)?127\.0\.0\.1$/);
+  assert.equal(headers['x-real-ip'], undefined);
+  assert.equal(headers['x-telegram-init-data'], 'q');
+});
+
+test('ответ идёт потоком, не дожидаясь конца', async () => {
+  const started = Date.now();
+  const res = await fetch(`${proxyUrl}/api/stream`);
+  const reader = res.body.getReader();
+  const first = await reader.read();
+  assert.equal(new TextDecoder().decode(first.value), 'first;');
+  assert.ok(Date.now() - started < 150, 'первая часть пришла только с концом ответа');
+  let rest = '';
+  for (let chunk = await reader.read(); !chunk.done; chunk = await reader.read()) {
+    rest += new TextDecoder().decode(chunk.value);
+  }
+  assert.equal(rest, 'last');
+});
+
+test('соединение с API переиспользуется (keep-alive)', async () => {
+  const before = connections;
+  for (let i = 0; i < 5; i++) {
+    const res = await fetch(`${proxyUrl}/api/stats/progress`);
+    await res.text();
+  }
+  assert.ok(connections - before <= 1, `новых соединений: ${connections - before}`);
+});
+
+test('API недоступен — 502 с ошибкой в JSON', async () => {
+  const saved = process.env.API_URL;
+  process.env.API_URL = 'http://127.0.0.1:1';
+  try {
+    const res = await fetch(`${proxyUrl}/api/stats/progress`);
+    assert.equal(res.status, 502);
+    assert.equal((await res.json()).success, false);
+  } finally {
+    process.env.API_URL = saved;
+  }
+});
+
+test('без API_URL — 502', async () => {
+  const saved = process.env.API_URL;
+  delete process.env.API_URL;
+  try {
+    const res = await fetch(`${proxyUrl}/api/stats/progress`);
+    assert.equal(res.status, 502);
+  } finally {
+    process.env.API_URL = saved;
+  }
+});